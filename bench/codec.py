@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+"""
+Compare JSON codec backends on RAPI-shaped payloads.
+
+    $ python bench/codec.py --sizes 100,1000,10000
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from gentleman.codec import Codec, available
+from gentleman.fake import make_instance
+
+
+def measure(f, repeat):
+    # Best of several runs, to filter out noise from the rest of the system.
+    timer = timeit.Timer(f)
+    number = 1
+    while timer.timeit(number) < 0.2:
+        number *= 2
+    return min(timer.repeat(repeat, number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="instance counts to try, comma-separated")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--backends", default=",".join(available()))
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    backends = args.backends.split(",")
+
+    print("%-12s %8s %10s %12s %12s %12s" % ("backend", "count", "size",
+                                             "decode", "encode",
+                                             "encode/sort"))
+
+    for size in sizes:
+        data = [make_instance(i) for i in range(size)]
+        body = Codec("json").dumps(data).encode("ascii")
+
+        for backend in backends:
+            codec = Codec(backend, sort_keys=False)
+            sorting = Codec(backend, sort_keys=True)
+
+            decode = measure(lambda: codec.loads(body), args.repeat)
+            encode = measure(lambda: codec.dumps(data), args.repeat)
+            encode_sorted = measure(lambda: sorting.dumps(data), args.repeat)
+
+            print("%-12s %8d %9.1fK %10.2fms %10.2fms %10.2fms" % (
+                backend, size, len(body) / 1024.0, decode * 1000,
+                encode * 1000, encode_sorted * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Compare two sets of benchmark results from run.py.
+
+    $ python bench/compare.py before.json after.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+
+# Metrics to compare, and whether bigger is better.
+METRICS = [
+    ("throughput", True),
+    ("p50_ms", False),
+    ("p99_ms", False),
+    ("peak_rss_kb", False),
+]
+
+
+def load(path):
+    with open(path) as f:
+        results = json.load(f)["results"]
+    return dict(((r["client"], r["instances"], r["benchmark"]), r)
+                for r in results)
+
+
+def change(old, new, bigger_is_better):
+    if not old:
+        return 0.0, False
+    ratio = (new - old) / float(old)
+    worse = ratio < 0 if bigger_is_better else ratio > 0
+    return ratio * 100, worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark runs.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent change to flag as a regression")
+    args = parser.parse_args()
+
+    before = load(args.before)
+    after = load(args.after)
+
+    print("%-8s %7s %-20s" % ("client", "count", "benchmark") +
+          "".join(" %18s" % name for name, bigger in METRICS))
+
+    regressions = 0
+
+    for key in sorted(set(before) & set(after)):
+        cells = []
+        for name, bigger in METRICS:
+            percent, worse = change(before[key][name], after[key][name],
+                                    bigger)
+            flag = "!" if worse and abs(percent) >= args.threshold else " "
+            if flag == "!":
+                regressions += 1
+            cells.append(" %10.1f %+6.1f%%%s" % (after[key][name], percent,
+                                                 flag))
+        print("%-8s %7d %-20s" % key + "".join(cells))
+
+    for key in sorted(set(before) ^ set(after)):
+        print("%-8s %7d %-20s only in one run" % key)
+
+    if regressions:
+        print("\n%d regressions of more than %.0f%%" % (regressions,
+                                                        args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
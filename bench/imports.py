@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Time importing gentleman.base and a client, against a budget.
+
+Each import is timed in a fresh interpreter; the best of several runs is
+compared with the budget, and the exit status is 1 if it's over.
+
+    $ python bench/imports.py --budget 30
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Importing gentleman.base and a client should take no longer than this, in
+# milliseconds. The requests stack alone takes several times this.
+BUDGET_MS = 30
+
+CLIENTS = {
+    "sync": "from gentleman.sync import RequestsRapiClient",
+    "stdlib": "from gentleman.stdlib import StdlibRapiClient",
+}
+
+_script = """
+import time
+started = time.time()
+import gentleman.base
+%s
+print((time.time() - started) * 1000)
+"""
+
+
+def measure(statement):
+    output = subprocess.check_output([sys.executable, "-c",
+                                      _script % statement], cwd=root)
+    return float(output.decode("ascii"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--budget", type=float, default=BUDGET_MS,
+                        help="milliseconds which each import may take")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--clients", default=",".join(sorted(CLIENTS)))
+    args = parser.parse_args()
+
+    over = False
+
+    for client in args.clients.split(","):
+        # Best of several runs, to filter out noise from the rest of the
+        # system.
+        elapsed = min(measure(CLIENTS[client]) for i in range(args.repeat))
+        ok = elapsed < args.budget
+        over = over or not ok
+        print("%-8s %8.1fms %s" % (client, elapsed, "ok" if ok else "OVER"))
+
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
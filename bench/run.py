@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""
+Benchmark the RAPI clients against a fake RAPI.
+
+For each cluster size, a fake RAPI is started in its own process, and each
+benchmark is run by each client in a fresh process, so that peak memory is
+measured per benchmark. Results are written as JSON, to be compared between
+runs with compare.py.
+
+    $ python bench/run.py --sizes 100,1000,10000 --output before.json
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+from gentleman import base
+
+CLIENTS = "sync", "stdlib", "twisted"
+
+# Finished jobs in the fake's queue, for polling.
+JOBS = 100
+
+# Each benchmark is called with the client and the iteration number.
+BENCHMARKS = [
+    ("GetInfo", lambda r, names, i: base.GetInfo(r)),
+    ("GetInstances", lambda r, names, i: base.GetInstances(r)),
+    ("GetInstances(bulk)",
+     lambda r, names, i: base.GetInstances(r, bulk=True)),
+    ("IterInstances",
+     lambda r, names, i: base.IterInstances(r, callback=lambda item: None)),
+    ("GetInstance",
+     lambda r, names, i: base.GetInstance(r, names[i % len(names)])),
+    ("GetNodes(bulk)", lambda r, names, i: base.GetNodes(r, bulk=True)),
+    ("GetJobStatus",
+     lambda r, names, i: base.GetJobStatus(r, i % JOBS + 1)),
+    ("WaitForJobChange",
+     lambda r, names, i: base.WaitForJobChange(r, i % JOBS + 1, ["status"],
+                                               None, 0)),
+]
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    index = int(round((len(ordered) - 1) * p / 100.0))
+    return ordered[index]
+
+
+def peak_rss():
+    # Kilobytes on Linux, bytes on OS X.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+    return rss
+
+
+def summarize(samples, elapsed, rss_before):
+    return {
+        "ops": len(samples),
+        "seconds": elapsed,
+        "throughput": len(samples) / elapsed,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "peak_rss_kb": peak_rss(),
+        "rss_growth_kb": peak_rss() - rss_before,
+    }
+
+
+def keep_going(samples, started, args):
+    if len(samples) < args.min_ops:
+        return True
+    return (len(samples) < args.max_ops and
+            time.time() - started < args.duration)
+
+
+def tls_options(args):
+    from gentleman.tls import TLSOptions
+
+    return TLSOptions("localhost", ca_file=args.cert)
+
+
+def run_sync(benchmark, names, args):
+    if args.client == "stdlib":
+        from gentleman.stdlib import StdlibRapiClient as client
+    else:
+        from gentleman.sync import RequestsRapiClient as client
+
+    r = client("localhost", args.port, tls=tls_options(args))
+    r.start()
+    rss_before = peak_rss()
+
+    samples = []
+    started = time.time()
+
+    while keep_going(samples, started, args):
+        t = time.time()
+        benchmark(r, names, len(samples))
+        samples.append(time.time() - t)
+
+    return summarize(samples, time.time() - started, rss_before)
+
+
+def run_twisted(benchmark, names, args):
+    from twisted.internet import reactor
+    from twisted.internet.defer import inlineCallbacks
+
+    from gentleman.async import TwistedRapiClient
+
+    r = TwistedRapiClient("localhost", args.port, tls=tls_options(args))
+
+    result = {}
+
+    @inlineCallbacks
+    def go():
+        try:
+            yield r.start()
+            rss_before = peak_rss()
+
+            samples = []
+            started = time.time()
+
+            while keep_going(samples, started, args):
+                t = time.time()
+                yield benchmark(r, names, len(samples))
+                samples.append(time.time() - t)
+
+            result.update(summarize(samples, time.time() - started,
+                                    rss_before))
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(go)
+    reactor.run()
+
+    if not result:
+        raise RuntimeError("Benchmark failed")
+    return result
+
+
+def worker(args):
+    benchmark = dict(BENCHMARKS)[args.benchmark]
+    names = ["inst%05d.example.com" % i for i in range(args.instances)]
+
+    if args.client == "twisted":
+        result = run_twisted(benchmark, names, args)
+    else:
+        result = run_sync(benchmark, names, args)
+
+    print(json.dumps(result))
+
+
+def start_fake(instances):
+    # Jobs never change in the fake's queue while benchmarking, so that job
+    # polling measures the clients rather than the wait.
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(here))
+    process = subprocess.Popen([sys.executable, "-m", "gentleman.fake",
+                                "--instances", str(instances),
+                                "--jobs", str(JOBS)],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               env=env)
+    port = int(process.stdout.readline())
+    cert = process.stdout.readline().strip().decode("utf-8")
+    return process, port, cert
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAPI clients.")
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="instance counts, comma-separated")
+    parser.add_argument("--clients", default=",".join(CLIENTS))
+    parser.add_argument("--benchmarks",
+                        default=",".join(name for name, f in BENCHMARKS))
+    parser.add_argument("--duration", type=float, default=2.0,
+                        help="seconds to run each benchmark for")
+    parser.add_argument("--min-ops", type=int, default=5)
+    parser.add_argument("--max-ops", type=int, default=10000)
+    parser.add_argument("--output", default="bench-results.json")
+
+    # Used by the runner to start each benchmark in its own process.
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--client", help=argparse.SUPPRESS)
+    parser.add_argument("--benchmark", help=argparse.SUPPRESS)
+    parser.add_argument("--instances", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--cert", help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    results = []
+
+    for size in [int(size) for size in args.sizes.split(",")]:
+        process, port, cert = start_fake(size)
+
+        try:
+            for client in args.clients.split(","):
+                for name in args.benchmarks.split(","):
+                    output = subprocess.check_output([
+                        sys.executable, __file__, "--worker",
+                        "--client", client, "--benchmark", name,
+                        "--instances", str(size), "--port", str(port),
+                        "--cert", cert,
+                        "--duration", str(args.duration),
+                        "--min-ops", str(args.min_ops),
+                        "--max-ops", str(args.max_ops),
+                    ])
+                    result = json.loads(output.decode("utf-8"))
+                    result.update(client=client, benchmark=name,
+                                  instances=size)
+                    results.append(result)
+
+                    print("%-8s %7d %-20s %9.1f ops/s  p50 %8.2fms  "
+                          "p99 %8.2fms  peak %7dK" % (
+                              client, size, name, result["throughput"],
+                              result["p50_ms"], result["p99_ms"],
+                              result["peak_rss_kb"]))
+                    sys.stdout.flush()
+        finally:
+            process.stdin.close()
+            process.wait()
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.time(),
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,508 @@
+"""
+Base functionality for the Ganeti RAPI, client-side.
+
+This module provides combinators which are used to provide a full RAPI client.
+"""
+
+import asyncio
+import codecs
+import inspect
+import logging
+import time
+
+import aiohttp
+
+from gentleman.codec import default_codec
+from gentleman.errors import (CertificateError, CircuitOpenError,
+                              ClientError, GanetiApiError, NotOkayError)
+from gentleman.helpers import prepare_query
+from gentleman.metrics import RequestRecord, calling_function
+from gentleman.retry import parse_retry_after
+from gentleman.stream import JsonStreamDecoder
+from gentleman.tls import options_for
+
+headers = {
+    "accept": "application/json",
+    "content-type": "application/json",
+    "user-agent": "Ganeti RAPI Client (asyncio)",
+}
+
+_stream_chunk_size = 64 * 1024
+
+
+def _settle(source, target):
+    """
+    Copy the outcome of one finished future onto another.
+    """
+
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def chain(future, callback, errback=None):
+    """
+    Attach a callback, and optionally an errback, to an awaitable.
+
+    Whatever the callback or errback returns becomes the result of the new
+    future; if they return another awaitable, it is waited on first, so
+    coroutines compose the same way Deferreds do in the Twisted client.
+    Cancelling the returned future cancels the one it is waiting on.
+
+    @type future: awaitable
+    @param future: the awaitable to chain onto
+    @type callback: callable
+    @param callback: called with the result of C{future}
+    @type errback: callable or None
+    @param errback: called with the exception raised by C{future}
+
+    @rtype: L{asyncio.Future}
+    @return: a future for the result of the chain
+    """
+
+    future = asyncio.ensure_future(future)
+    result = future.get_loop().create_future()
+
+    def done(fut):
+        if result.done():
+            return
+        if fut.cancelled():
+            result.cancel()
+            return
+
+        exc = fut.exception()
+
+        try:
+            if exc is None:
+                value = callback(fut.result())
+            elif errback is not None:
+                value = errback(exc)
+            else:
+                result.set_exception(exc)
+                return
+        except Exception as e:
+            result.set_exception(e)
+            return
+
+        if inspect.isawaitable(value):
+            inner = asyncio.ensure_future(value)
+            inner.add_done_callback(lambda i: _settle(i, result))
+            result.add_done_callback(
+                lambda r: r.cancelled() and inner.cancel())
+        else:
+            result.set_result(value)
+
+    future.add_done_callback(done)
+    result.add_done_callback(lambda r: r.cancelled() and future.cancel())
+
+    return result
+
+
+class AsyncioRapiClient(object):
+    """
+    Ganeti RAPI client using aiohttp on an asyncio event loop.
+    """
+
+    version = None
+    features = []
+
+    def __init__(self, host, port=5080, username=None, password=None,
+                 timeout=60, pool_size=10, keepalive_timeout=15, retry=None,
+                 breaker=None, limiter=None, hooks=None, codec=None,
+                 tls=None):
+        """
+        Initializes this class.
+
+        The underlying session and its pool of keep-alive connections are
+        created on first use, from within the running event loop.
+
+        @type host: string
+        @param host: the ganeti cluster master to interact with
+        @type port: int
+        @param port: the port on which the RAPI is running (default is 5080)
+        @type username: string
+        @param username: the username to connect with
+        @type password: string
+        @param password: the password to connect with
+        @type pool_size: int
+        @param pool_size: the maximum number of simultaneous connections
+        @type keepalive_timeout: float
+        @param keepalive_timeout: seconds to keep an idle connection open
+        @type retry: L{gentleman.retry.RetryPolicy} or None
+        @param retry: when to retry failed requests
+        @type breaker: L{gentleman.retry.CircuitBreaker} or None
+        @param breaker: the circuit breaker for this cluster
+        @type limiter: L{gentleman.limit.Limiter} or None
+        @param limiter: the limiter for this cluster
+        @type hooks: list of callables
+        @param hooks: called with a L{gentleman.metrics.RequestRecord} as
+                      each request finishes
+        @type codec: L{gentleman.codec.Codec} or None
+        @param codec: the JSON codec for bodies; defaults to the fastest
+                      installed
+        @type tls: L{gentleman.tls.TLSOptions} or None
+        @param tls: how to secure connections; defaults to the cluster's
+                    shared options, which don't verify certificates. A
+                    pinned fingerprint is checked instead of the CA file.
+        """
+
+        if username is not None and password is None:
+            raise ClientError("Password not specified")
+        elif password is not None and username is None:
+            raise ClientError("Specified password without username")
+
+        self._auth = None
+        if username and password:
+            self._auth = aiohttp.BasicAuth(username, password)
+
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+
+        self.retry = retry
+        self.breaker = breaker
+        self.limiter = limiter
+        self.hooks = list(hooks or [])
+        self.codec = codec or default_codec()
+        self.tls = tls or options_for(host, port)
+
+        self._session = None
+        self._base_url = "https://%s:%d" % (host, port)
+
+
+    def _ssl(self):
+        if self.tls.fingerprint is not None:
+            # aiohttp checks the fingerprint once per connection.
+            return aiohttp.Fingerprint(bytes.fromhex(self.tls.fingerprint))
+        return self.tls.context()
+
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ssl=self._ssl())
+            self._session = aiohttp.ClientSession(
+                connector=connector, headers=headers, auth=self._auth,
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+        return self._session
+
+
+    def request(self, method, path, query=None, content=None):
+        """
+        Sends an HTTP request.
+
+        This constructs a full URL, encodes and decodes HTTP bodies, and
+        handles invalid responses in a pythonic way.
+
+        @type method: string
+        @param method: HTTP method to use
+        @type path: string
+        @param path: HTTP URL path
+        @type query: list of two-tuples
+        @param query: query arguments to pass to urllib.urlencode
+        @type content: str or None
+        @param content: HTTP body content
+
+        @rtype: L{asyncio.Future}
+        @return: JSON-Decoded response
+
+        @raises GanetiApiError: If an invalid response is returned
+        """
+
+        url, params = self._url(path, query)
+        record = self._record(method, path)
+        return asyncio.ensure_future(
+            self._send(method, url, params, content, None, record))
+
+
+    def stream(self, method, path, query=None, content=None, callback=None):
+        """
+        Sends an HTTP request, decoding a JSON array response as it arrives.
+
+        @type method: string
+        @param method: HTTP method to use
+        @type path: string
+        @param path: HTTP URL path
+        @type query: list of two-tuples
+        @param query: query arguments
+        @type content: str or None
+        @param content: HTTP body content
+        @type callback: callable
+        @param callback: called with each element of the response as soon as
+                         it has been decoded
+
+        @rtype: L{asyncio.Future}
+        @return: the number of elements passed to the callback
+
+        @raises GanetiApiError: If an invalid response is returned
+        """
+
+        if callback is None:
+            raise ClientError("Streaming requires a callback")
+
+        url, params = self._url(path, query)
+        record = self._record(method, path)
+        return asyncio.ensure_future(
+            self._send(method, url, params, content, callback, record))
+
+
+    def _url(self, path, query):
+        if not path.startswith("/"):
+            raise ClientError("Implementation error: Called with bad path %s"
+                              % path)
+
+        params = None
+        if query:
+            prepare_query(query)
+            params = []
+            for name, value in query.items():
+                if isinstance(value, list):
+                    params.extend((name, str(v)) for v in value)
+                else:
+                    params.append((name, str(value)))
+
+        return self._base_url + path, params
+
+
+    def _record(self, method, path):
+        if self.hooks:
+            return RequestRecord(method, path, calling_function())
+
+
+    async def _send(self, method, url, params, content, callback, record):
+        attempt = 0
+
+        try:
+            while True:
+                if self.breaker is not None and not self.breaker.allow():
+                    raise CircuitOpenError("Not contacting %s while it is"
+                                           " failing" % self._base_url)
+
+                attempt += 1
+                if record is not None:
+                    record.attempt()
+
+                try:
+                    result = await self._send_limited(method, url, params,
+                                                      content, callback,
+                                                      record)
+                except asyncio.CancelledError:
+                    # Given up on; this says nothing about the RAPI.
+                    if self.breaker is not None:
+                        self.breaker.abandon()
+                    raise
+                except GanetiApiError as e:
+                    if self.breaker is not None:
+                        self.breaker.record(e)
+                    if (self.retry is None or
+                        not self.retry.retryable(method, e, attempt)):
+                        raise
+                    await asyncio.sleep(self.retry.delay(attempt, e))
+                except Exception:
+                    if self.breaker is not None:
+                        self.breaker.failure()
+                    raise
+                else:
+                    if self.breaker is not None:
+                        self.breaker.record()
+                    break
+        except (Exception, asyncio.CancelledError) as e:
+            if record is not None:
+                record.finish(self.hooks, e)
+            raise
+
+        if record is not None:
+            record.finish(self.hooks)
+        return result
+
+
+    async def _send_limited(self, method, url, params, content, callback,
+                            record):
+        if self.limiter is None:
+            return await self._send_once(method, url, params, content,
+                                         callback, record)
+
+        loop = asyncio.get_running_loop()
+
+        delay = self.limiter.reserve(method, url)
+        if delay:
+            await asyncio.sleep(delay)
+
+        admitted = loop.create_future()
+
+        def admit():
+            if not admitted.done():
+                admitted.set_result(None)
+
+        self.limiter.admit(admit)
+        try:
+            await admitted
+        except asyncio.CancelledError:
+            if not self.limiter.withdraw(admit):
+                # Admitted just as it was cancelled; give the slot back.
+                self.limiter.release(None)
+            raise
+
+        started = loop.time()
+        try:
+            result = await self._send_once(method, url, params, content,
+                                           callback, record)
+        except asyncio.CancelledError:
+            # Cut short, so its latency measures nothing.
+            self.limiter.release(None)
+            raise
+        except Exception as e:
+            self.limiter.release(loop.time() - started, e)
+            raise
+
+        self.limiter.release(loop.time() - started)
+        return result
+
+
+    async def _send_once(self, method, url, params, content, callback,
+                         record):
+        # Certificates are checked against the name in the TLS options,
+        # which needn't be how the master was reached.
+        kwargs = {"server_hostname": self.tls.host}
+
+        started = time.time()
+        if content is not None:
+            kwargs["data"] = self.codec.dumps(content)
+        encoded = time.time()
+
+        if params:
+            kwargs["params"] = params
+
+        try:
+            response = await self._get_session().request(method.upper(), url,
+                                                         **kwargs)
+        except (aiohttp.ServerFingerprintMismatch,
+                aiohttp.ClientConnectorCertificateError) as e:
+            raise CertificateError(str(e))
+        except asyncio.TimeoutError:
+            raise GanetiApiError("Timed out connecting to %s" %
+                                 self._base_url)
+        except aiohttp.ClientConnectionError:
+            raise GanetiApiError("Couldn't connect to %s" % self._base_url)
+
+        responded = time.time()
+
+        if record is not None:
+            record.status = response.status
+            record.encode = encoded - started
+            record.ttfb = responded - encoded
+            record.bytes_out = len(kwargs.get("data") or b"")
+
+        try:
+            if response.status != 200:
+                # Read the error body, so that the connection may be reused.
+                await response.read()
+                retry_after = response.headers.get("retry-after")
+                raise NotOkayError(code=response.status,
+                                   retry_after=parse_retry_after(retry_after))
+
+            if callback is None:
+                body = await response.read()
+                received = time.time()
+                result = self.codec.loads(body) if body else None
+                decoded = time.time()
+
+                if record is not None:
+                    record.bytes_in = len(body)
+                    record.transfer = received - responded
+                    record.decode = decoded - received
+                return result
+
+            return await self._receive(response, callback, responded, record)
+        except aiohttp.ClientError:
+            raise GanetiApiError("Couldn't read response from %s" %
+                                 self._base_url)
+        finally:
+            # Any unread body is read or dropped along with the connection,
+            # so that it never lingers checked out of the pool.
+            response.release()
+
+
+    async def _receive(self, response, callback, responded, record):
+        decoder = JsonStreamDecoder(callback, self.codec.loads)
+        # Chunks may split characters which take several bytes.
+        text = codecs.getincrementaldecoder("utf-8")()
+        decoding = 0.0
+
+        async for chunk in response.content.iter_chunked(_stream_chunk_size):
+            started = time.time()
+            decoder.feed(text.decode(chunk))
+            decoding += time.time() - started
+            if record is not None:
+                record.bytes_in += len(chunk)
+
+        decoder.feed(text.decode(b"", True))
+        count = decoder.close()
+
+        if record is not None:
+            record.decode = decoding
+            record.transfer = time.time() - responded - decoding
+        return count
+
+
+    @staticmethod
+    def applier(f, d):
+        return chain(d, f)
+
+
+    @staticmethod
+    def succeed(value):
+        future = asyncio.Future()
+        future.set_result(value)
+        return future
+
+
+    def start(self):
+        """
+        Confirm that we may access the target cluster.
+        """
+
+        def gotVersion(version):
+            if version != 2:
+                raise GanetiApiError("Can't work with Ganeti RAPI version %d"
+                                     % version)
+
+            logging.info("Accessing Ganeti RAPI, version %d" % version)
+            self.version = version
+
+            return chain(self.request("get", "/2/features"), gotFeatures,
+                         noFeatures)
+
+        def noFeatures(e):
+            if isinstance(e, NotOkayError) and e.code == 404:
+                # Okay, let's calm down, this is totally reasonable. Certain
+                # older Ganeti RAPIs don't have a list of features.
+                return gotFeatures([])
+            # No, wait, panic was the correct thing to do.
+            raise e
+
+        def gotFeatures(features):
+            logging.info("RAPI features: %r" % (features,))
+            self.features = features
+
+        return chain(self.request("get", "/version"), gotVersion)
+
+
+    def close(self):
+        """
+        Close all pooled connections.
+
+        @rtype: awaitable
+        """
+
+        if self._session is None:
+            return chain(asyncio.sleep(0), lambda _: None)
+        return self._session.close()
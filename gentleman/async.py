@@ -5,22 +5,39 @@ This module provides combinators which are used to provide a full RAPI client.
 """
 
 from base64 import b64encode
-import simplejson as json
+import time
 from urllib import urlencode
+from weakref import WeakSet
 
+from OpenSSL import SSL, crypto
 from twisted.internet import reactor
-from twisted.internet.defer import (Deferred, DeferredList, inlineCallbacks,
+from twisted.internet.abstract import isIPAddress, isIPv6Address
+from twisted.internet.defer import (CancelledError, Deferred, DeferredList,
+                                    DeferredSemaphore, fail, inlineCallbacks,
                                     succeed)
-from twisted.internet.error import ConnectionRefusedError
+from twisted.internet.error import ConnectError, ConnectionRefusedError
+from twisted.internet.interfaces import IOpenSSLClientConnectionCreator
 from twisted.internet.protocol import Protocol
+from twisted.internet.task import deferLater
 from twisted.python import log
-from twisted.web.client import Agent, HTTPConnectionPool
+from twisted.python.failure import Failure
+from twisted.web.client import (Agent, HTTPConnectionPool,
+                                ResponseNeverReceived, readBody)
 from twisted.web.http_headers import Headers
-from twisted.web.iweb import IBodyProducer
+from twisted.web.iweb import IBodyProducer, IPolicyForHTTPS
 from zope.interface import implements
 
-from gentleman.errors import ClientError, GanetiApiError, NotOkayError
+from gentleman.base import GetJobStatus, WaitForJobChange
+from gentleman.bulk import BulkJobs, BulkTagger
+from gentleman.codec import default_codec
+from gentleman.errors import (CertificateError, CircuitOpenError,
+                              ClientError, DeadlineError, GanetiApiError,
+                              NotOkayError)
 from gentleman.helpers import prepare_query
+from gentleman.jobs import NO_WAIT_CODES, JobTracker
+from gentleman.metrics import RequestRecord, calling_function
+from gentleman.retry import parse_retry_after
+from gentleman.stream import JsonStreamDecoder
 
 _headers = Headers({
     "accept": ["application/json"],
@@ -48,15 +65,23 @@ class StringProducer(object):
 
 
 class JsonResponseProtocol(Protocol):
+    """
+    Decode a JSON response body incrementally, as it is delivered.
+    """
 
-    def __init__(self, d):
+    def __init__(self, d, callback=None, loads=None):
         self._upstream = d
-        self._finished = Deferred()
-        self.buf = []
+        self._finished = Deferred(self._cancel)
+        self._decoder = JsonStreamDecoder(callback, loads)
+        self._error = None
+
+        self.responded = None
+        self.received = 0
+        self.decoding = 0.0
 
     def getData(self):
         dl = DeferredList([self._finished, self._upstream],
-                          fireOnOneErrback=True)
+                          fireOnOneErrback=True, consumeErrors=True)
 
         @dl.addCallback
         def cb(l):
@@ -69,29 +94,325 @@ class JsonResponseProtocol(Protocol):
         return dl
 
     def dataReceived(self, data):
-        self.buf.append(data)
+        if self._error is not None:
+            return
+
+        self.received += len(data)
+        started = time.time()
+
+        try:
+            self._decoder.feed(data)
+        except Exception, e:
+            self._error = e
+
+        self.decoding += time.time() - started
+
+    def _cancel(self, d):
+        # The rest of the body is still on its way, so the connection can't
+        # go back to the pool; stopping it closes it.
+        if self.transport is not None:
+            self.transport.stopProducing()
 
     def connectionLost(self, reason):
+        if self._finished.called:
+            # Cancelled.
+            return
+
+        if self._error is not None:
+            self._finished.errback(self._error)
+            return
+
+        started = time.time()
+
         try:
-            data = json.loads("".join(self.buf))
+            data = self._decoder.close()
         except Exception, e:
+            self.decoding += time.time() - started
             self._finished.errback(e)
         else:
+            self.decoding += time.time() - started
             self._finished.callback(data)
 
 
+class StatsConnectionPool(HTTPConnectionPool):
+    """
+    A connection pool which keeps count of its connections, for each host.
+    """
+
+    def __init__(self, reactor, persistent=True):
+        HTTPConnectionPool.__init__(self, reactor, persistent)
+        self._requests = {}
+        self._created = {}
+        self._open = {}
+
+    def getConnection(self, key, endpoint):
+        self._requests[key] = self._requests.get(key, 0) + 1
+        return HTTPConnectionPool.getConnection(self, key, endpoint)
+
+    def _newConnection(self, key, endpoint):
+        self._created[key] = self._created.get(key, 0) + 1
+        d = HTTPConnectionPool._newConnection(self, key, endpoint)
+
+        @d.addCallback
+        def connected(connection):
+            self._open.setdefault(key, set()).add(connection)
+            return connection
+
+        return d
+
+    def stats(self, key=None):
+        """
+        Count connections.
+
+        @param key: the pool key of the host to count, as made by C{Agent};
+                    None to count every host
+        @rtype: dict
+        @return: number of connections open, idle in the pool, and in use;
+                 and of connections created, and requests which reused a
+                 connection
+        """
+
+        keys = [key] if key is not None else list(self._requests)
+        counts = dict.fromkeys(["open", "idle", "in_use", "created",
+                                "reused"], 0)
+
+        for key in keys:
+            connections = self._open.get(key, set())
+            for connection in list(connections):
+                if connection.state == "CONNECTION_LOST":
+                    connections.discard(connection)
+
+            created = self._created.get(key, 0)
+            idle = len(self._connections.get(key, []))
+
+            counts["open"] += len(connections)
+            counts["idle"] += idle
+            counts["in_use"] += max(len(connections) - idle, 0)
+            counts["created"] += created
+            counts["reused"] += self._requests.get(key, 0) - created
+
+        return counts
+
+
+class _ConnectTimer(object):
+    """
+    Stand in front of a connection pool, timing how long each request waits
+    for a connection.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.record = None
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    def getConnection(self, key, endpoint):
+        d = self.pool.getConnection(key, endpoint)
+
+        record = self.record
+        if record is not None:
+            started = time.time()
+
+            @d.addCallback
+            def connected(connection):
+                record.connect = time.time() - started
+                return connection
+
+        return d
+
+
+# Whether pyOpenSSL can resume TLS sessions.
+_resumable = hasattr(SSL.Connection, "set_session")
+
+
+class _TLSPolicy(object):
+    """
+    Secure connections to a cluster according to its L{TLSOptions}, resuming
+    the last TLS session whenever a new connection is made.
+
+    There is one policy for each L{TLSOptions}, shared by every client of the
+    cluster. With a pyOpenSSL too old to hand sessions between connections,
+    every connection makes a full handshake.
+    """
+
+    implements(IPolicyForHTTPS, IOpenSSLClientConnectionCreator)
+
+    def __init__(self, options):
+        self.options = options
+        self._hostname = options.host.encode("idna")
+        self._identity = self._hostname.decode("ascii")
+        self._is_address = (isIPAddress(options.host) or
+                            isIPv6Address(options.host))
+        self._context = None
+        self._last = None
+        # Connections which were sent a certificate, rather than resuming.
+        self._full = WeakSet()
+
+        self.handshakes = 0
+        self.resumed = 0
+
+    def creatorForNetloc(self, hostname, port):
+        return self
+
+    def context(self):
+        if self._context is None:
+            context = SSL.Context(SSL.SSLv23_METHOD)
+            context.set_options(SSL.OP_NO_SSLv2 | SSL.OP_NO_SSLv3 |
+                                SSL.OP_NO_COMPRESSION)
+            context.set_session_cache_mode(SSL.SESS_CACHE_CLIENT)
+            if self.options.verify:
+                context.load_verify_locations(self.options.ca_file)
+            # Also without verifying, so that full handshakes can be told
+            # from resumed ones, which skip the certificate.
+            context.set_verify(SSL.VERIFY_PEER, self._chain)
+            context.set_info_callback(self._info)
+            self._context = context
+        return self._context
+
+    def clientConnectionForTLS(self, protocol):
+        connection = SSL.Connection(self.context(), None)
+        connection.set_app_data(protocol)
+        if not self._is_address:
+            connection.set_tlsext_host_name(self._hostname)
+
+        # Sessions are taken from the last connection as late as possible;
+        # TLS 1.3 only sends its tickets once the handshake is over.
+        if self._last is not None and _resumable:
+            session = self._last.get_session()
+            if session is not None:
+                connection.set_session(session)
+
+        connection.set_connect_state()
+        return connection
+
+    def _chain(self, connection, certificate, errno, depth, ok):
+        self._full.add(connection)
+        return ok or not self.options.verify
+
+    def _info(self, connection, where, ret):
+        if not where & SSL.SSL_CB_HANDSHAKE_DONE:
+            return
+
+        # Anything going wrong here must fail the connection; exceptions
+        # raised from this callback would otherwise be ignored.
+        try:
+            self._verify(connection)
+        except Exception:
+            connection.get_app_data().failVerification(Failure())
+        else:
+            self._last = connection
+            self.handshakes += 1
+            if connection not in self._full:
+                self.resumed += 1
+
+    def _verify(self, connection):
+        certificate = connection.get_peer_certificate()
+        if certificate is None:
+            raise CertificateError("%s sent no certificate" %
+                                   self.options.host)
+
+        self.options.check(crypto.dump_certificate(crypto.FILETYPE_ASN1,
+                                                   certificate))
+
+        if self.options.verify:
+            from service_identity import VerificationError
+            from service_identity.pyopenssl import (verify_hostname,
+                                                    verify_ip_address)
+
+            try:
+                if self._is_address:
+                    verify_ip_address(connection, self._identity)
+                else:
+                    verify_hostname(connection, self._identity)
+            except VerificationError, e:
+                raise CertificateError(str(e))
+
+
+_policies = {}
+
+
+def _policy(options):
+    policy = _policies.get(options)
+    if policy is None:
+        policy = _policies[options] = _TLSPolicy(options)
+    return policy
+
+
+class _Coalesced(object):
+    """
+    Requests waiting on the response to one GET in flight.
+
+    Each waiter may be cancelled on its own; the GET itself is cancelled once
+    nobody is waiting for it.
+    """
+
+    sent = None
+
+    def __init__(self):
+        self.waiters = []
+
+    def wait(self):
+        d = Deferred(self._abandon)
+        self.waiters.append(d)
+        return d
+
+    def _abandon(self, d):
+        self.waiters.remove(d)
+        if not self.waiters and self.sent is not None:
+            self.sent.cancel()
+
+    def fire(self, result):
+        while self.waiters:
+            waiter = self.waiters.pop(0)
+            if isinstance(result, Failure):
+                waiter.errback(result)
+            else:
+                waiter.callback(result)
+
+
+class _Deadline(object):
+    """
+    A client whose requests must all be answered by the same moment.
+
+    @see: L{TwistedRapiClient.within}
+    """
+
+    def __init__(self, client, expires):
+        self._client = client
+        self._expires = expires
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _remaining(self):
+        return max(self._expires - reactor.seconds(), 0)
+
+    def within(self, seconds):
+        return _Deadline(self._client,
+                         min(self._expires, reactor.seconds() + seconds))
+
+    def request(self, method, path, query=None, content=None):
+        return self._client.request(method, path, query, content,
+                                    deadline=self._remaining())
+
+    def stream(self, method, path, query=None, content=None, callback=None):
+        return self._client.stream(method, path, query, content, callback,
+                                   deadline=self._remaining())
+
+
 class TwistedRapiClient(object):
     """
     Ganeti RAPI client using Twisted's Agent for HTTP.
     """
 
-    _json_encoder = json.JSONEncoder(sort_keys=True)
-
     version = None
     features = []
 
     def __init__(self, host, port=5080, username=None, password=None,
-                 timeout=60):
+                 timeout=60, retry=None, breaker=None, pool=None,
+                 limiter=None, hooks=None, codec=None, tls=None,
+                 max_persistent=2, idle_timeout=240, warm=0, deadline=None):
         """
         Initializes this class.
 
@@ -103,6 +424,37 @@ class TwistedRapiClient(object):
         @param username: the username to connect with
         @type password: string
         @param password: the password to connect with
+        @type retry: L{gentleman.retry.RetryPolicy} or None
+        @param retry: when to retry failed requests
+        @type breaker: L{gentleman.retry.CircuitBreaker} or None
+        @param breaker: the circuit breaker for this cluster
+        @type pool: L{HTTPConnectionPool} or None
+        @param pool: a connection pool to share with other clients; its
+                     settings are left alone
+        @type limiter: L{gentleman.limit.Limiter} or None
+        @param limiter: the limiter for this cluster
+        @type hooks: list of callables
+        @param hooks: called with a L{gentleman.metrics.RequestRecord} as
+                      each request finishes
+        @type codec: L{gentleman.codec.Codec} or None
+        @param codec: the JSON codec for bodies; defaults to the fastest
+                      installed
+        @type tls: L{gentleman.tls.TLSOptions} or None
+        @param tls: how to secure connections, pinning certificates and
+                    resuming TLS sessions; if None, Agent's default policy
+                    is used, which verifies certificates against the system's
+                    CAs and resumes nothing
+        @type max_persistent: int
+        @param max_persistent: the number of idle connections to keep open
+        @type idle_timeout: float
+        @param idle_timeout: seconds after which idle connections are closed
+        @type warm: int
+        @param warm: the number of connections to open when starting, so
+                     that a first burst of requests needn't wait for them
+        @type deadline: float or None
+        @param deadline: seconds within which each request must be answered,
+                         body and all, or be cancelled (None to wait as long
+                         as it takes)
         """
 
         if username is not None and password is None:
@@ -116,19 +468,52 @@ class TwistedRapiClient(object):
             encoded = b64encode("%s:%s" % (username, password))
             self.headers.addRawHeader("Authorization", "Basic %s" % encoded)
 
-        pool = HTTPConnectionPool(reactor, persistent=True)
-        self._agent = Agent(reactor, connectTimeout=timeout, pool=pool)
+        if pool is None:
+            pool = StatsConnectionPool(reactor, persistent=True)
+            # Warm connections would be closed as soon as they were idle.
+            pool.maxPersistentPerHost = max(max_persistent, warm)
+            pool.cachedConnectionTimeout = idle_timeout
+        self.pool = pool
+        self._timer = _ConnectTimer(pool)
+        self.tls = tls
+        if tls is None:
+            self._agent = Agent(reactor, connectTimeout=timeout,
+                                pool=self._timer)
+        else:
+            self._agent = Agent(reactor, contextFactory=_policy(tls),
+                                connectTimeout=timeout, pool=self._timer)
 
         self._base_url = "https://%s:%d" % (host, port)
+        # How Agent tells hosts apart in the pool.
+        self._key = "https", host, port
+        self.warm = warm
+        self.deadline = deadline
 
+        self.retry = retry
+        self.breaker = breaker
+        self.limiter = limiter
+        self.hooks = list(hooks or [])
+        self.codec = codec or default_codec()
 
-    def request(self, method, path, query=None, content=None):
+        self._inflight = {}
+        self.coalesce_hits = 0
+        self.coalesce_misses = 0
+
+
+    def request(self, method, path, query=None, content=None, deadline=None):
         """
         Sends an HTTP request.
 
         This constructs a full URL, encodes and decodes HTTP bodies, and
         handles invalid responses in a pythonic way.
 
+        Identical GETs which are sent while one is already in flight don't
+        go out over the wire; they share the response of the first, and
+        all receive the same decoded object.
+
+        Cancelling the returned Deferred cancels the request, closing its
+        connection if the response has started to arrive.
+
         @type method: string
         @param method: HTTP method to use
         @type path: string
@@ -137,22 +522,134 @@ class TwistedRapiClient(object):
         @param query: query arguments to pass to urllib.urlencode
         @type content: str or None
         @param content: HTTP body content
+        @type deadline: float or None
+        @param deadline: seconds within which the request must be answered;
+                         defaults to the client's deadline
 
         @rtype: object
         @return: JSON-Decoded response
 
         @raises GanetiApiError: If an invalid response is returned
+        @raises DeadlineError: If the deadline passed first
+        """
+
+        url = self._url(path, query)
+        record = self._record(method, path)
+
+        if method.lower() == "get" and content is None:
+            d = self._coalesce(method, url, record)
+        else:
+            d = self._send(method, url, content, record=record)
+
+        self._within(d, url, deadline)
+
+        if record is not None:
+            d.addBoth(self._finish, record)
+        return d
+
+
+    def stream(self, method, path, query=None, content=None, callback=None,
+               deadline=None):
+        """
+        Sends an HTTP request, decoding a JSON array response as it arrives.
+
+        @type method: string
+        @param method: HTTP method to use
+        @type path: string
+        @param path: HTTP URL path
+        @type query: list of two-tuples
+        @param query: query arguments to pass to urllib.urlencode
+        @type content: str or None
+        @param content: HTTP body content
+        @type callback: callable
+        @param callback: called with each element of the response as soon as
+                         it has been decoded
+        @type deadline: float or None
+        @param deadline: seconds within which the whole response must arrive;
+                         defaults to the client's deadline
+
+        @rtype: int
+        @return: the number of elements passed to the callback
+
+        @raises GanetiApiError: If an invalid response is returned
+        @raises DeadlineError: If the deadline passed first
+        """
+
+        if callback is None:
+            raise ClientError("Streaming requires a callback")
+
+        url = self._url(path, query)
+        record = self._record(method, path)
+        d = self._send(method, url, content, callback, record)
+        self._within(d, url, deadline)
+
+        if record is not None:
+            d.addBoth(self._finish, record)
+        return d
+
+
+    def within(self, seconds):
         """
+        Set a deadline for a series of requests.
 
+        The returned client stands in for this one, and every request made
+        through it must be answered within C{seconds} of now, however many
+        requests are chained one after another; those still outstanding when
+        the time is up are cancelled.
+
+            >>> d = GetInstances(r.within(5), bulk=True)
+
+        @type seconds: float
+        @rtype: a client
+        """
+
+        return _Deadline(self, reactor.seconds() + seconds)
+
+
+    def _within(self, d, url, deadline):
+        """
+        Cancel a request which isn't answered by its deadline.
+        """
+
+        if deadline is None:
+            deadline = self.deadline
+            if deadline is None:
+                return
+
+        timer = reactor.callLater(deadline, d.cancel)
+
+        @d.addBoth
+        def expired(result):
+            if timer.active():
+                timer.cancel()
+            elif isinstance(result, Failure) and result.check(CancelledError):
+                raise DeadlineError("%s wasn't answered within %.2fs" %
+                                    (url, deadline))
+            return result
+
+
+    def _record(self, method, path):
+        if self.hooks:
+            return RequestRecord(method, path, calling_function())
+
+
+    def _finish(self, result, record):
+        if isinstance(result, Failure):
+            record.finish(self.hooks, result.value)
+        else:
+            record.finish(self.hooks)
+        return result
+
+
+    def _url(self, path, query):
         if not path.startswith("/"):
             raise ClientError("Implementation error: Called with bad path %s"
                               % path)
 
-        body = None
-
-        if content is not None:
-            data = self._json_encoder.encode(content)
-            body = StringProducer(data)
+        if isinstance(path, unicode):
+            # Names taken from decoded responses are unicode, but Agent only
+            # takes bytes.
+            path = path.encode("utf-8")
 
         url = self._base_url + path
 
@@ -161,26 +658,206 @@ class TwistedRapiClient(object):
             params = urlencode(query, doseq=True)
             url += "?%s" % params
 
+        return url
+
+
+    def _coalesce(self, method, url, record=None):
+        coalesced = self._inflight.get(url)
+
+        if coalesced is not None:
+            self.coalesce_hits += 1
+            if record is not None:
+                record.coalesced = True
+            return coalesced.wait()
+
+        self.coalesce_misses += 1
+        # The response may already be here by the time _send() returns, so
+        # the first waiter has to be in place before sending.
+        coalesced = self._inflight[url] = _Coalesced()
+        d = coalesced.wait()
+
+        def fire(result):
+            del self._inflight[url]
+            coalesced.fire(result)
+
+        coalesced.sent = self._send(method, url, None, record=record)
+        coalesced.sent.addBoth(fire)
+        return d
+
+
+    def coalesce_stats(self):
+        """
+        Report on GETs which shared a response with an identical GET.
+
+        @rtype: dict
+        @return: the number of GETs which shared a response (hits), which
+                 were sent (misses), and which are still in flight
+        """
+
+        return {
+            "hits": self.coalesce_hits,
+            "misses": self.coalesce_misses,
+            "inflight": len(self._inflight),
+        }
+
+
+    def _send(self, method, url, content, callback=None, record=None,
+              attempt=1):
+        if self.breaker is not None and not self.breaker.allow():
+            return fail(CircuitOpenError("Not contacting %s while it is"
+                                         " failing" % self._base_url))
+
+        if record is not None:
+            record.attempt()
+
+        d = self._send_limited(method, url, content, callback, record)
+
+        def succeeded(result):
+            if self.breaker is not None:
+                self.breaker.record()
+            return result
+
+        def failed(failure):
+            if failure.check(CancelledError):
+                # Given up on; this says nothing about the RAPI.
+                if self.breaker is not None:
+                    self.breaker.abandon()
+                return failure
+
+            if not failure.check(GanetiApiError):
+                if self.breaker is not None:
+                    self.breaker.failure()
+                return failure
+
+            if self.breaker is not None:
+                self.breaker.record(failure.value)
+
+            if (self.retry is None or
+                not self.retry.retryable(method, failure.value, attempt)):
+                return failure
+
+            delay = self.retry.delay(attempt, failure.value)
+            return deferLater(reactor, delay, self._send, method, url,
+                              content, callback, record, attempt + 1)
+
+        d.addCallbacks(succeeded, failed)
+        return d
+
+
+    def _send_limited(self, method, url, content, callback, record):
+        if self.limiter is None:
+            return self._send_once(method, url, content, callback, record)
+
+        def admit():
+            admitted.callback(None)
+
+        def withdraw(_):
+            if waiting.active():
+                waiting.cancel()
+            else:
+                self.limiter.withdraw(admit)
+
+        admitted = Deferred(withdraw)
+        delay = self.limiter.reserve(method, url)
+        waiting = reactor.callLater(delay, self.limiter.admit, admit)
+
+        @admitted.addCallback
+        def send(_):
+            started = reactor.seconds()
+            d = self._send_once(method, url, content, callback, record)
+
+            def finished(result):
+                latency = reactor.seconds() - started
+                error = None
+                if isinstance(result, Failure):
+                    if result.check(CancelledError):
+                        # Cut short, so its latency measures nothing.
+                        latency = None
+                    error = result.value
+                self.limiter.release(latency, error)
+                return result
+
+            d.addBoth(finished)
+            return d
+
+        return admitted
+
+
+    def _send_once(self, method, url, content, callback, record=None):
+        body = None
+
+        started = time.time()
+        if content is not None:
+            data = self.codec.dumps(content)
+            body = StringProducer(data)
+        encoded = time.time()
+
         log.msg("Sending request to %s %s %s" % (url, self.headers, body),
                 system="Gentleman")
 
-        d = self._agent.request(method, url, headers=self.headers,
-                                bodyProducer=body)
+        self._timer.record = record
+        try:
+            d = self._agent.request(method, url, headers=self.headers,
+                                    bodyProducer=body)
+        finally:
+            self._timer.record = None
+
+        protocol = JsonResponseProtocol(d, callback, self.codec.loads)
+
+        if record is not None:
+            record.encode = encoded - started
+            if body is not None:
+                record.bytes_out = body.length
 
-        protocol = JsonResponseProtocol(d)
+            @d.addCallback
+            def responded(response):
+                record.status = response.code
+                record.ttfb = time.time() - encoded - record.connect
+                protocol.responded = time.time()
+                return response
 
         @d.addErrback
         def connectionFailed(failure):
-            failure.trap(ConnectionRefusedError)
-            raise GanetiApiError("Connection refused!")
+            failure.trap(ConnectError, ResponseNeverReceived)
+            if failure.check(ResponseNeverReceived):
+                for reason in failure.value.reasons:
+                    # The master's certificate failed verification.
+                    if reason.check(CertificateError):
+                        reason.raiseException()
+            if failure.check(ConnectionRefusedError):
+                raise GanetiApiError("Connection refused!")
+            raise GanetiApiError("Couldn't connect to %s" % self._base_url)
 
         @d.addCallback
         def cb(response):
             if response.code != 200:
-                raise NotOkayError(code=response.code)
+                retry_after = response.headers.getRawHeaders("retry-after",
+                                                             [None])[0]
+                retry_after = parse_retry_after(retry_after)
+                error = NotOkayError(code=response.code,
+                                     retry_after=retry_after)
+
+                # Read the body, so that the connection goes back to the
+                # pool instead of hanging on to it.
+                def read(_):
+                    raise error
+
+                return readBody(response).addBoth(read)
             response.deliverBody(protocol)
 
-        return protocol.getData()
+        d = protocol.getData()
+
+        if record is not None:
+            @d.addBoth
+            def received(result):
+                if protocol.responded is not None:
+                    record.bytes_in = protocol.received
+                    record.decode = protocol.decoding
+                    record.transfer = (time.time() - protocol.responded -
+                                       protocol.decoding)
+                return result
+
+        return d
 
 
     @staticmethod
@@ -189,6 +866,9 @@ class TwistedRapiClient(object):
         return d
 
 
+    succeed = staticmethod(succeed)
+
+
     @inlineCallbacks
     def start(self):
         """
@@ -218,3 +898,380 @@ class TwistedRapiClient(object):
 
         log.msg("RAPI features: %r" % (features,), system="Gentleman")
         self.features = features
+
+        if self.warm > 1:
+            yield self._warm(self.warm)
+
+
+    def _warm(self, count):
+        """
+        Open connections ahead of time, by sending requests side by side.
+
+        The connection used to start is already open, and with L{TLSOptions}
+        the rest resume its TLS session.
+        """
+
+        url = self._url("/version", None)
+        ds = [self._send("get", url, None) for i in range(count)]
+        d = DeferredList(ds, consumeErrors=True)
+
+        @d.addCallback
+        def warmed(results):
+            failures = [result for success, result in results if not success]
+            if failures:
+                log.msg("Couldn't open %d of %d connections: %s" %
+                        (len(failures), count, failures[0].getErrorMessage()),
+                        system="Gentleman")
+
+        return d
+
+
+    def pool_stats(self):
+        """
+        Report on connections to this cluster.
+
+        @rtype: dict
+        @return: number of connections open, idle in the pool, and in use;
+                 and of connections created, and requests which reused a
+                 connection; or None if the pool doesn't keep count
+        """
+
+        if not isinstance(self.pool, StatsConnectionPool):
+            return None
+        return self.pool.stats(self._key)
+
+
+    def tls_stats(self):
+        """
+        Report on TLS handshakes with this cluster, by every client sharing
+        its L{TLSOptions}.
+
+        @rtype: dict
+        @return: the number of handshakes, and of those which resumed an
+                 earlier session; or None if no L{TLSOptions} were given
+        """
+
+        if self.tls is None:
+            return None
+        policy = _policy(self.tls)
+        return {"handshakes": policy.handshakes, "resumed": policy.resumed}
+
+
+class TwistedJobWaiter(object):
+    """
+    Wait for many jobs at once, using the Twisted client.
+
+    At most C{max_connections} long-polls are outstanding at any time; jobs
+    take turns, and each job is reported as soon as it is finalized. If the
+    RAPI lacks C{/wait}, jobs are polled with GetJobStatus every
+    C{poll_interval} seconds; any other error from C{/wait} fails only the
+    job it concerns.
+    """
+
+    def __init__(self, r, max_connections=4, poll_interval=1.0,
+                 callback=None):
+        """
+        @type r: L{TwistedRapiClient}
+        @param r: the client to wait with
+        @type max_connections: int
+        @param max_connections: the number of concurrent requests to send
+        @type poll_interval: float
+        @param poll_interval: seconds between polls when C{/wait} is missing
+        @type callback: callable or None
+        @param callback: called with the job id, the job status (or None) and
+                         the error (or None) as each job finishes
+        """
+
+        self._r = r
+        self._semaphore = DeferredSemaphore(max_connections)
+        self.poll_interval = poll_interval
+        self.callback = callback
+
+        self.use_wait = True
+
+
+    def _step(self, tracker):
+        if not self.use_wait:
+            d = GetJobStatus(self._r, tracker.job_id)
+            d.addCallback(self._polled, tracker)
+            return d
+
+        d = WaitForJobChange(self._r, tracker.job_id, tracker.fields,
+                             tracker.job_info, tracker.log_serial)
+
+        def waited(result):
+            if tracker.changed(result):
+                return GetJobStatus(self._r, tracker.job_id)
+
+        def noWait(failure):
+            failure.trap(NotOkayError)
+            if failure.value.code not in NO_WAIT_CODES:
+                return failure
+            # Either the job doesn't exist, or the RAPI can't wait for it.
+            # If polling works, it was the latter.
+            d = GetJobStatus(self._r, tracker.job_id)
+
+            @d.addCallback
+            def cb(job):
+                if self.use_wait:
+                    log.msg("RAPI cannot wait for jobs, polling",
+                            system="Gentleman")
+                    self.use_wait = False
+                return self._polled(job, tracker)
+
+            return d
+
+        d.addCallbacks(waited, noWait)
+        return d
+
+
+    def _polled(self, job, tracker):
+        if tracker.polled(job, self.poll_interval):
+            return job
+
+
+    def _follow(self, tracker):
+        delay = 0
+        if not self.use_wait:
+            delay = max(tracker.next_poll - reactor.seconds(), 0)
+
+        d = deferLater(reactor, delay, self._semaphore.run, self._step,
+                       tracker)
+
+        @d.addCallback
+        def cb(job):
+            if job is None:
+                return self._follow(tracker)
+            return job
+
+        return d
+
+
+    def wait(self, job_ids):
+        """
+        Wait for all of the jobs to be finalized.
+
+        @type job_ids: list
+        @param job_ids: the jobs to wait for
+
+        @rtype: L{Deferred} firing with a two-tuple of dicts
+        @return: the final status of each job, and the error for each job
+                 which could not be waited for, both keyed by job id
+        """
+
+        results = {}
+        errors = {}
+        ds = []
+
+        for job_id in job_ids:
+            d = self._follow(JobTracker(job_id))
+            d.addCallbacks(self._finished, self._failed,
+                           callbackArgs=(job_id, results),
+                           errbackArgs=(job_id, errors))
+            ds.append(d)
+
+        d = DeferredList(ds)
+        d.addCallback(lambda _: (results, errors))
+        return d
+
+
+    def _finished(self, job, job_id, results):
+        results[job_id] = job
+        if self.callback is not None:
+            self.callback(job_id, job, None)
+
+
+    def _failed(self, failure, job_id, errors):
+        errors[job_id] = failure.value
+        if self.callback is not None:
+            self.callback(job_id, None, failure.value)
+
+
+class TwistedBulkTagger(BulkTagger):
+    """
+    Add or delete tags of many resources, using the Twisted client.
+
+    Up to C{max_connections} jobs are submitted at once, and as many
+    long-polls are used to wait for them. L{add_tags} and L{delete_tags}
+    return L{Deferred}s firing with the L{BulkJobs}.
+    """
+
+    waiter = TwistedJobWaiter
+
+
+    def _submit(self, function, names, tags, dry_run):
+        semaphore = DeferredSemaphore(self.max_connections)
+        job_ids = {}
+        errors = {}
+        ds = []
+
+        for name in names:
+            d = semaphore.run(function, self._r, name, tags, dry_run=dry_run)
+            d.addCallbacks(self._submitted, self._failed,
+                           callbackArgs=(name, job_ids),
+                           errbackArgs=(name, errors))
+            ds.append(d)
+
+        d = DeferredList(ds)
+        d.addCallback(lambda _: BulkJobs(self._r, self._waiter, job_ids,
+                                         errors))
+        return d
+
+
+    def _submitted(self, job_id, name, job_ids):
+        job_ids[name] = job_id
+
+
+    def _failed(self, failure, name, errors):
+        errors[name] = failure.value
+
+
+class TwistedFleet(object):
+    """
+    A set of clusters, each with its own L{TwistedRapiClient}.
+
+    All of the clients share one connection pool. Calls run on every cluster
+    concurrently; a cluster which is slow or down only delays its own
+    result, up to the fleet's timeout, after which its request is cancelled.
+    """
+
+    def __init__(self, timeout=None, pool=None):
+        """
+        @type timeout: float or None
+        @param timeout: seconds to wait for each cluster before giving up on
+                        it; None to wait as long as it takes
+        @type pool: L{HTTPConnectionPool} or None
+        @param pool: the connection pool for every client
+        """
+
+        if pool is None:
+            pool = StatsConnectionPool(reactor, persistent=True)
+        self.pool = pool
+        self.timeout = timeout
+        self.clients = {}
+
+
+    def add(self, name, host, **kwargs):
+        """
+        Add a cluster to the fleet.
+
+        Keyword arguments are passed on to L{TwistedRapiClient}.
+
+        @type name: str
+        @param name: what to call the cluster in results
+        @type host: str
+        @param host: the cluster master
+        @rtype: L{TwistedRapiClient}
+        @return: the new client
+        """
+
+        client = TwistedRapiClient(host, pool=self.pool, **kwargs)
+        self.clients[name] = client
+        return client
+
+
+    def remove(self, name):
+        """
+        Remove a cluster from the fleet.
+
+        @type name: str
+        @param name: the cluster's name
+        """
+
+        del self.clients[name]
+
+
+    def _gather(self, ds):
+        results = {}
+        errors = {}
+        gathered = []
+
+        for name, d in ds.iteritems():
+            if self.timeout is not None:
+                call = reactor.callLater(self.timeout, d.cancel)
+                d.addBoth(self._disarm, call)
+
+            d.addCallbacks(self._finished, self._failed,
+                           callbackArgs=(name, results),
+                           errbackArgs=(name, errors))
+            gathered.append(d)
+
+        d = DeferredList(gathered)
+        d.addCallback(lambda _: (results, errors))
+        return d
+
+
+    def _disarm(self, result, call):
+        if call.active():
+            call.cancel()
+        return result
+
+
+    def _finished(self, result, name, results):
+        results[name] = result
+
+
+    def _failed(self, failure, name, errors):
+        if failure.check(CancelledError):
+            errors[name] = GanetiApiError("Timed out waiting for %s" % name)
+        else:
+            errors[name] = failure.value
+
+
+    def run_on(self, names, base_function, *args, **kwargs):
+        """
+        Call a function from L{gentleman.base} on some of the clusters.
+
+        @type names: iterable of str
+        @param names: the clusters to call it on
+        @type base_function: callable
+        @param base_function: the function to call, such as C{GetInstances}
+
+        @rtype: L{Deferred} firing with a two-tuple of dicts
+        @return: the result from each cluster which answered, and the error
+                 from each cluster which didn't, both keyed by cluster name
+        """
+
+        ds = {}
+        for name in names:
+            try:
+                ds[name] = base_function(self.clients[name], *args, **kwargs)
+            except Exception:
+                ds[name] = fail()
+
+        return self._gather(ds)
+
+
+    def run(self, base_function, *args, **kwargs):
+        """
+        Call a function from L{gentleman.base} on every cluster.
+
+        @see: L{run_on}
+        """
+
+        return self.run_on(list(self.clients), base_function, *args,
+                           **kwargs)
+
+
+    def start(self):
+        """
+        Confirm that we may access every cluster.
+
+        @rtype: L{Deferred} firing with a two-tuple of dicts
+        @return: None for each cluster which could be accessed, and the error
+                 for each which couldn't, both keyed by cluster name
+        """
+
+        ds = dict((name, client.start())
+                  for name, client in self.clients.iteritems())
+        return self._gather(ds)
+
+
+    def close(self):
+        """
+        Close all pooled connections.
+
+        @rtype: L{Deferred}
+        """
+
+        return self.pool.closeCachedConnections()
@@ -4,8 +4,9 @@ Base functionality for the Ganeti RAPI, client-side.
 This module provides combinators which are used to provide a full RAPI client.
 """
 
-from gentleman.errors import GanetiApiError
+from gentleman.errors import GanetiApiError, NotOkayError
 from gentleman.helpers import itemgetters
+from gentleman.query import columnar
 
 REPLACE_DISK_PRI = "replace_on_primary"
 REPLACE_DISK_SECONDARY = "replace_on_secondary"
@@ -54,6 +55,34 @@ NODE_MIGRATE_REQV1 = "node-migrate-reqv1"
 NODE_EVAC_RES1 = "node-evac-res1"
 
 
+def _BulkQuery(fields):
+    """
+    Build the query arguments for a bulk listing.
+    """
+
+    query = {"bulk": 1}
+
+    if fields is not None:
+        query["fields"] = ",".join(fields)
+
+    return query
+
+
+def _QueryOne(r, what, name, fields):
+    """
+    Gets some fields of a single resource through /2/query.
+    """
+
+    def first(result):
+        rows = columnar(result).rows()
+        for row in rows:
+            return row
+        raise NotOkayError("No %s named %s" % (what, name), code=404)
+
+    result = Query(r, what, fields, qfilter=["=", "name", name])
+    return r.applier(first, result)
+
+
 def GetOperatingSystems(r):
     """
     Gets the Operating Systems running in the Ganeti cluster.
@@ -149,35 +178,65 @@ def DeleteClusterTags(r, tags, dry_run=False):
     return r.request("delete", "/2/tags", query=query)
 
 
-def GetInstances(r, bulk=False):
+def GetInstances(r, bulk=False, fields=None):
     """
     Gets information about instances on the cluster.
 
     @type bulk: bool
     @param bulk: whether to return all information about all instances
+    @type fields: list of str or None
+    @param fields: if given, only return these fields about each instance;
+                   implies bulk
 
     @rtype: list of dict or list of str
     @return: if bulk is True, info about the instances, else a list of instances
     """
 
-    if bulk:
-        return r.request("get", "/2/instances", query={"bulk": 1})
+    if bulk or fields is not None:
+        return r.request("get", "/2/instances", query=_BulkQuery(fields))
     else:
         instances = r.request("get", "/2/instances")
         return r.applier(itemgetters("id"), instances)
 
 
-def GetInstance(r, instance):
+def IterInstances(r, callback=None, fields=None):
+    """
+    Streams information about all instances on the cluster.
+
+    Instances are handed out one at a time as soon as they are decoded, so
+    that large clusters can be processed in constant memory.
+
+    @type callback: callable or None
+    @param callback: called with info about each instance; required by
+                     asynchronous clients
+    @type fields: list of str or None
+    @param fields: if given, only return these fields about each instance
+
+    @rtype: iterator of dict, or int if a callback was given
+    @return: info about each instance, or the number of instances
+    """
+
+    return r.stream("get", "/2/instances", query=_BulkQuery(fields),
+                    callback=callback)
+
+
+def GetInstance(r, instance, fields=None):
     """
     Gets information about an instance.
 
     @type instance: str
     @param instance: instance whose info to return
+    @type fields: list of str or None
+    @param fields: if given, only return these fields, as named by
+                   /2/query; fields without data are left out
 
     @rtype: dict
     @return: info about the instance
     """
 
+    if fields is not None:
+        return _QueryOne(r, "instance", instance, fields)
+
     return r.request("get", "/2/instances/%s" % instance)
 
 
@@ -786,36 +845,63 @@ def CancelJob(r, job_id, dry_run=False):
                              query={"dry-run": dry_run})
 
 
-def GetNodes(r, bulk=False):
+def GetNodes(r, bulk=False, fields=None):
     """
     Gets all nodes in the cluster.
 
     @type bulk: bool
     @param bulk: whether to return all information about all instances
+    @type fields: list of str or None
+    @param fields: if given, only return these fields about each node;
+                   implies bulk
 
     @rtype: list of dict or str
     @return: if bulk is true, info about nodes in the cluster,
             else list of nodes in the cluster
     """
 
-    if bulk:
-        return r.request("get", "/2/nodes", query={"bulk": 1})
+    if bulk or fields is not None:
+        return r.request("get", "/2/nodes", query=_BulkQuery(fields))
     else:
         nodes = r.request("get", "/2/nodes")
         return r.applier(itemgetters("id"), nodes)
 
 
-def GetNode(r, node):
+def IterNodes(r, callback=None, fields=None):
+    """
+    Streams information about all nodes in the cluster.
+
+    @type callback: callable or None
+    @param callback: called with info about each node; required by
+                     asynchronous clients
+    @type fields: list of str or None
+    @param fields: if given, only return these fields about each node
+
+    @rtype: iterator of dict, or int if a callback was given
+    @return: info about each node, or the number of nodes
+    """
+
+    return r.stream("get", "/2/nodes", query=_BulkQuery(fields),
+                    callback=callback)
+
+
+def GetNode(r, node, fields=None):
     """
     Gets information about a node.
 
     @type node: str
     @param node: node whose info to return
+    @type fields: list of str or None
+    @param fields: if given, only return these fields, as named by
+                   /2/query; fields without data are left out
 
     @rtype: dict
     @return: info about the node
     """
 
+    if fields is not None:
+        return _QueryOne(r, "node", node, fields)
+
     return r.request("get", "/2/nodes/%s" % node)
 
 
@@ -1158,36 +1244,63 @@ def DeleteNodeTags(r, node, tags, dry_run=False):
     return r.request("delete", "/2/nodes/%s/tags" % node, query=query)
 
 
-def GetGroups(r, bulk=False):
+def GetGroups(r, bulk=False, fields=None):
     """
     Gets all node groups in the cluster.
 
     @type bulk: bool
     @param bulk: whether to return all information about the groups
+    @type fields: list of str or None
+    @param fields: if given, only return these fields about each group;
+                   implies bulk
 
     @rtype: list of dict or str
     @return: if bulk is true, a list of dictionaries with info about all node
             groups in the cluster, else a list of names of those node groups
     """
 
-    if bulk:
-        return r.request("get", "/2/groups", query={"bulk": 1})
+    if bulk or fields is not None:
+        return r.request("get", "/2/groups", query=_BulkQuery(fields))
     else:
         groups = r.request("get", "/2/groups")
         return r.applier(itemgetters("name"), groups)
 
 
-def GetGroup(r, group):
+def IterGroups(r, callback=None, fields=None):
+    """
+    Streams information about all node groups in the cluster.
+
+    @type callback: callable or None
+    @param callback: called with info about each node group; required by
+                     asynchronous clients
+    @type fields: list of str or None
+    @param fields: if given, only return these fields about each group
+
+    @rtype: iterator of dict, or int if a callback was given
+    @return: info about each node group, or the number of node groups
+    """
+
+    return r.stream("get", "/2/groups", query=_BulkQuery(fields),
+                    callback=callback)
+
+
+def GetGroup(r, group, fields=None):
     """
     Gets information about a node group.
 
     @type group: str
     @param group: name of the node group whose info to return
+    @type fields: list of str or None
+    @param fields: if given, only return these fields, as named by
+                   /2/query; fields without data are left out
 
     @rtype: dict
     @return: info about the node group
     """
 
+    if fields is not None:
+        return _QueryOne(r, "group", group, fields)
+
     return r.request("get", "/2/groups/%s" % group)
 
 
@@ -1364,6 +1477,8 @@ def Query(r, what, fields, qfilter=None):
     """
     Retrieves information about resources.
 
+    Results can be turned into columns with L{gentleman.query.columnar}.
+
     @type what: string
     @param what: Resource name, one of L{constants.QR_VIA_RAPI}
     @type fields: list of string
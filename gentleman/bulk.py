@@ -0,0 +1,200 @@
+"""
+Tagging many objects at once.
+
+Targets are chosen with a C{/2/query} filter, so that only their names are
+fetched. Each target still needs a job of its own, but the jobs are
+submitted a few at a time rather than one after another, and are then
+waited for together, with one report of how every target fared.
+"""
+
+from Queue import Empty, Queue
+from threading import Thread
+
+from gentleman.base import (AddGroupTags, AddInstanceTags, AddNodeTags,
+                            DeleteGroupTags, DeleteInstanceTags,
+                            DeleteNodeTags, JOB_STATUS_SUCCESS, Query)
+from gentleman.errors import ClientError, JobFailedError
+from gentleman.jobs import JobWaiter
+
+# The functions which add and delete the tags of each kind of resource, by
+# the resource's name in queries.
+_tag_functions = {
+    "instance": (AddInstanceTags, DeleteInstanceTags),
+    "node": (AddNodeTags, DeleteNodeTags),
+    "group": (AddGroupTags, DeleteGroupTags),
+}
+
+
+def _names(result):
+    return [row[0][1] for row in result["data"]]
+
+
+def select(r, what, qfilter):
+    """
+    Find the names of the resources which match a query filter.
+
+    @type what: str
+    @param what: the kind of resource, such as "instance"
+    @type qfilter: list or None
+    @param qfilter: the query filter, or None to select everything
+
+    @rtype: list of str
+    """
+
+    return r.applier(_names, Query(r, what, ["name"], qfilter))
+
+
+class BulkJobs(object):
+    """
+    The jobs submitted by a bulk operation, one per target.
+    """
+
+    def __init__(self, r, waiter, job_ids, errors):
+        """
+        @param r: the client which submitted the jobs
+        @param waiter: a L{JobWaiter}, or like waiter, to wait with
+        @type job_ids: dict
+        @param job_ids: the job submitted for each target, keyed by name
+        @type errors: dict
+        @param errors: the error for each target whose job couldn't be
+                       submitted, keyed by name
+        """
+
+        self._r = r
+        self._waiter = waiter
+        self.job_ids = job_ids
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.job_ids) + len(self.errors)
+
+    def wait(self):
+        """
+        Wait for every job to be finalized.
+
+        @rtype: two-tuple of dicts
+        @return: the final status of the job for each target which succeeded,
+                 and the error for each target which didn't, both keyed by
+                 name
+        """
+
+        waited = self._waiter.wait(self.job_ids.values())
+        return self._r.applier(self._report, waited)
+
+    def _report(self, waited):
+        jobs, job_errors = waited
+        names = dict((job_id, name)
+                     for name, job_id in self.job_ids.iteritems())
+
+        results = {}
+        errors = dict(self.errors)
+
+        for job_id, job in jobs.iteritems():
+            name = names[job_id]
+            if job["status"] == JOB_STATUS_SUCCESS:
+                results[name] = job
+            else:
+                errors[name] = JobFailedError("Job %s for %s ended with "
+                                              "status %s" % (job_id, name,
+                                                             job["status"]),
+                                              job=job)
+
+        for job_id, error in job_errors.iteritems():
+            errors[names[job_id]] = error
+
+        return results, errors
+
+
+class BulkTagger(object):
+    """
+    Add or delete tags of many resources, using a blocking client from
+    several threads.
+
+    Up to C{max_connections} jobs are submitted at once, and as many
+    long-polls are used to wait for them.
+    """
+
+    waiter = JobWaiter
+
+    def __init__(self, r, max_connections=4, poll_interval=1.0):
+        """
+        @param r: a RAPI client which may be shared between threads
+        @type max_connections: int
+        @param max_connections: the number of concurrent requests to send
+        @type poll_interval: float
+        @param poll_interval: seconds between polls when C{/wait} is missing
+        """
+
+        self._r = r
+        self.max_connections = max_connections
+        self._waiter = self.waiter(r, max_connections, poll_interval)
+
+    def add_tags(self, what, qfilter, tags, dry_run=False):
+        """
+        Add tags to every resource which matches a query filter.
+
+        @type what: str
+        @param what: "instance", "node" or "group"
+        @type qfilter: list or None
+        @param qfilter: the query filter, or None to tag everything
+        @type tags: list of str
+        @param tags: tags to add
+        @type dry_run: bool
+        @param dry_run: whether to perform a dry run
+
+        @rtype: L{BulkJobs}
+        @return: the submitted jobs
+        """
+
+        return self._tag(what, qfilter, tags, dry_run, 0)
+
+    def delete_tags(self, what, qfilter, tags, dry_run=False):
+        """
+        Delete tags from every resource which matches a query filter.
+
+        @see: L{add_tags}
+        """
+
+        return self._tag(what, qfilter, tags, dry_run, 1)
+
+    def _tag(self, what, qfilter, tags, dry_run, index):
+        if what not in _tag_functions:
+            raise ClientError("Can't tag resources of kind %r" % what)
+
+        function = _tag_functions[what][index]
+
+        def submit(names):
+            return self._submit(function, names, tags, dry_run)
+
+        return self._r.applier(submit, select(self._r, what, qfilter))
+
+    def _submit(self, function, names, tags, dry_run):
+        todo = Queue()
+        for name in names:
+            todo.put(name)
+
+        job_ids = {}
+        errors = {}
+
+        def work():
+            while True:
+                try:
+                    name = todo.get_nowait()
+                except Empty:
+                    return
+
+                try:
+                    job_ids[name] = function(self._r, name, tags,
+                                             dry_run=dry_run)
+                except Exception, e:
+                    errors[name] = e
+
+        workers = [Thread(target=work)
+                   for i in range(min(self.max_connections, len(names)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        return BulkJobs(self._r, self._waiter, job_ids, errors)
@@ -0,0 +1,167 @@
+"""
+Caching of read-mostly RAPI endpoints.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+import time
+
+from gentleman.helpers import path_resource, path_template
+
+# Seconds to cache each endpoint for, keyed by path template.
+DEFAULT_TTLS = {
+    "/2/info": 60,
+    "/2/os": 300,
+    "/2/nodes": 30,
+    "/2/nodes/*": 30,
+    "/2/groups": 60,
+    "/2/groups/*": 60,
+    "/2/instances/*": 10,
+}
+
+
+def _freeze(query):
+    if not query:
+        return ()
+    return tuple(sorted((k, tuple(v) if isinstance(v, list) else v)
+                        for k, v in query.iteritems()))
+
+
+class CachingRapiClient(object):
+    """
+    Wrap any RAPI client, caching GET responses.
+
+    Only endpoints listed in the TTL table are cached. Any mutating request
+    sent through this wrapper evicts the cached data for the resource it
+    acts on, along with the listing of that resource's collection. Note
+    that mutations are jobs, so the cache may be refilled with old data
+    before the job has run.
+
+    Cached objects are shared between callers and must not be modified.
+    """
+
+    def __init__(self, r, ttls=None, max_entries=1024):
+        """
+        @param r: the client to wrap
+        @type ttls: dict or None
+        @param ttls: seconds to cache each endpoint for, keyed by path
+                     template (see L{gentleman.helpers.path_template});
+                     defaults to L{DEFAULT_TTLS}
+        @type max_entries: int
+        @param max_entries: the most responses to hold; the least recently
+                            used responses are evicted first
+        """
+
+        self._r = r
+        self.ttls = DEFAULT_TTLS.copy() if ttls is None else ttls
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __getattr__(self, name):
+        return getattr(self._r, name)
+
+    def request(self, method, path, query=None, content=None):
+        """
+        Sends an HTTP request, or answers it from the cache.
+
+        @see: the wrapped client's C{request}
+        """
+
+        if method.lower() != "get":
+            # Queries are the one kind of PUT that changes nothing.
+            if not path.startswith("/2/query/"):
+                self.invalidate(path)
+            return self._r.request(method, path, query=query,
+                                   content=content)
+
+        ttl = self.ttls.get(path_template(path))
+        if ttl is None or content is not None:
+            return self._r.request(method, path, query=query,
+                                   content=content)
+
+        key = path, _freeze(query)
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                self._entries[key] = entry
+                self.hits += 1
+                return self._r.succeed(entry[1])
+
+            self.misses += 1
+            generation = self._generation
+
+        def store(value):
+            with self._lock:
+                # Don't cache responses which raced with an invalidation.
+                if generation == self._generation:
+                    self._entries.pop(key, None)
+                    self._entries[key] = time.time() + ttl, value
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+            return value
+
+        d = self._r.request(method, path, query=query, content=content)
+        return self._r.applier(store, d)
+
+    def invalidate(self, path):
+        """
+        Evict everything cached about the resource that a path acts on.
+
+        @type path: str
+        @param path: a RAPI path
+        """
+
+        collection, resource = path_resource(path)
+
+        if resource is None:
+            if collection == "/2":
+                stale = lambda p: p in ("/2/info", "/2/tags")
+            else:
+                stale = lambda p: p == collection
+        else:
+            prefix = resource + "/"
+            stale = lambda p: (p == collection or p == resource or
+                               p.startswith(prefix))
+
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._entries if stale(key[0])]:
+                del self._entries[key]
+                self.invalidations += 1
+
+    def clear(self):
+        """
+        Evict everything.
+        """
+
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def cache_stats(self):
+        """
+        Report on cache effectiveness.
+
+        @rtype: dict
+        @return: hits, misses, LRU evictions, invalidated entries, and the
+                 number of entries currently held
+        """
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+            }
@@ -0,0 +1,125 @@
+"""
+Encoding and decoding of JSON bodies.
+
+Several JSON libraries can do the job, at very different speeds; on large
+bulk listings, decoding is most of the client's work. A L{Codec} wraps the
+fastest one installed, falling back to the standard library.
+"""
+
+# Backends, fastest first.
+BACKENDS = "orjson", "ujson", "simplejson", "json"
+
+
+def _orjson(sort_keys):
+    import orjson
+
+    option = orjson.OPT_SORT_KEYS if sort_keys else 0
+
+    def dumps(obj):
+        return orjson.dumps(obj, option=option)
+
+    return dumps, orjson.loads
+
+
+def _ujson(sort_keys):
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, sort_keys=sort_keys,
+                           escape_forward_slashes=False)
+
+    return dumps, ujson.loads
+
+
+def _simplejson(sort_keys):
+    import simplejson
+
+    encoder = simplejson.JSONEncoder(sort_keys=sort_keys)
+    return encoder.encode, simplejson.loads
+
+
+def _json(sort_keys):
+    import json
+
+    encoder = json.JSONEncoder(sort_keys=sort_keys)
+    return encoder.encode, json.loads
+
+
+_factories = {
+    "orjson": _orjson,
+    "ujson": _ujson,
+    "simplejson": _simplejson,
+    "json": _json,
+}
+
+
+class Codec(object):
+    """
+    A JSON encoder and decoder.
+
+    C{loads} takes the raw bytes of a response body; orjson and ujson decode
+    them directly, without first copying them into a text string.
+    """
+
+    def __init__(self, backend=None, sort_keys=True):
+        """
+        @type backend: str or None
+        @param backend: the library to use, from L{BACKENDS}; None to use the
+                        fastest one installed
+        @type sort_keys: bool
+        @param sort_keys: whether to sort the keys of encoded objects; sorted
+                          bodies are easier to read in logs, but slower to
+                          encode
+
+        @raises ImportError: if the requested backend isn't installed
+        """
+
+        if backend is None:
+            for backend in BACKENDS:
+                try:
+                    self.dumps, self.loads = _factories[backend](sort_keys)
+                except ImportError:
+                    continue
+                break
+        else:
+            self.dumps, self.loads = _factories[backend](sort_keys)
+
+        self.backend = backend
+        self.sort_keys = sort_keys
+
+    def __repr__(self):
+        return "<Codec %s%s>" % (self.backend,
+                                 " sorted" if self.sort_keys else "")
+
+
+def available():
+    """
+    List the backends which are installed.
+
+    @rtype: list of str
+    """
+
+    names = []
+    for backend in BACKENDS:
+        try:
+            _factories[backend](False)
+        except ImportError:
+            continue
+        names.append(backend)
+    return names
+
+
+_default = None
+
+
+def default_codec():
+    """
+    Get the codec shared by clients which weren't given one.
+
+    @rtype: L{Codec}
+    """
+
+    global _default
+    if _default is None:
+        _default = Codec()
+    return _default
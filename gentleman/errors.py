@@ -24,9 +24,32 @@ class NotOkayError(GanetiApiError):
     Specifically, we received a response from the RAPI that is not okay.
     """
 
-    def __init__(self, code=None, *args, **kwargs):
+    def __init__(self, *args, **kwargs):
+        self.code = kwargs.pop("code", None)
+        self.retry_after = kwargs.pop("retry_after", None)
         super(NotOkayError, self).__init__(*args, **kwargs)
-        self.code = code
+
+
+class CircuitOpenError(GanetiApiError):
+    """
+    The RAPI has been failing, so the request was not even sent.
+    """
+
+
+class DeadlineError(GanetiApiError):
+    """
+    The RAPI didn't finish answering a request before its deadline.
+    """
+
+
+class JobFailedError(GentleError):
+    """
+    A job was finalized without succeeding.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.job = kwargs.pop("job", None)
+        super(JobFailedError, self).__init__(*args, **kwargs)
 
 
 class ClientError(GentleError):
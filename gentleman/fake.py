@@ -0,0 +1,1449 @@
+"""
+A fake Ganeti RAPI, for testing and load-testing without a real cluster.
+
+L{FakeCluster} keeps a synthetic cluster in memory and answers every
+endpoint which L{gentleman.base} uses. Mutating calls submit jobs, which
+wait in the queue, run, and then succeed or fail, with configurable delays;
+a successful job's changes show up in the cluster once it finishes.
+
+L{FakeRapiServer} serves a cluster over HTTPS from a background thread, and
+can inject latency and errors:
+
+    >>> server = FakeRapiServer(FakeCluster(instances=1000)).start()
+    >>> r = RequestsRapiClient("localhost", server.port)
+    >>> server.inject("/2/instances/*", code=503, count=2)
+
+It can also be run on its own:
+
+    $ python -m gentleman.fake --instances 10000 --port 5080
+"""
+
+from __future__ import print_function
+
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+import json
+import os
+import random
+import re
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+from threading import Condition, Lock, Thread
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlsplit
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlsplit
+
+from gentleman.base import (JOB_STATUS_CANCELED, JOB_STATUS_ERROR,
+                            JOB_STATUS_QUEUED, JOB_STATUS_RUNNING,
+                            JOB_STATUS_SUCCESS)
+from gentleman.helpers import path_template
+from gentleman.query import RS_NORMAL, RS_UNKNOWN
+
+FEATURES = [
+    "instance-create-reqv1",
+    "instance-reinstall-reqv1",
+    "node-migrate-reqv1",
+    "node-evac-res1",
+]
+
+_roles = {
+    "M": "master",
+    "C": "master-candidate",
+    "R": "regular",
+    "D": "drained",
+    "O": "offline",
+}
+
+
+def make_instance(i, nodes=40):
+    """
+    Make up an instance, shaped like those in a bulk listing.
+
+    @type i: int
+    @param i: the instance's number, which also seeds its details
+    @type nodes: int
+    @param nodes: how many nodes to spread instances over
+    @rtype: dict
+    """
+
+    rng = random.Random(i)
+    name = "inst%05d.example.com" % i
+    pnode = make_node_name(rng.randrange(nodes))
+    snode = make_node_name(rng.randrange(nodes))
+    disks = [rng.choice([10240, 20480, 51200, 102400])
+             for _ in range(rng.randint(1, 3))]
+    mem = rng.choice([1024, 2048, 4096, 8192])
+    vcpus = rng.choice([1, 2, 4, 8])
+    mac = "aa:00:00:%02x:%02x:%02x" % (i >> 16 & 0xff, i >> 8 & 0xff,
+                                       i & 0xff)
+    running = rng.random() < 0.9
+
+    instance = {
+        "name": name,
+        "uuid": "%08x-0000-4000-8000-%012x" % (i, rng.getrandbits(48)),
+        "admin_state_source": "admin",
+        "os": "debootstrap+default",
+        "pnode": pnode,
+        "snodes": [snode],
+        "disk_template": "drbd",
+        "disk_usage": sum(disks) + 128 * len(disks),
+        "disk.sizes": disks,
+        "disk.spindles": [None] * len(disks),
+        "network_port": 11000 + i % 10000,
+        "nic.bridges": ["br0"],
+        "nic.ips": ["10.%d.%d.%d" % (i >> 16 & 0xff, i >> 8 & 0xff,
+                                     i & 0xff)],
+        "nic.links": ["br0"],
+        "nic.macs": [mac],
+        "nic.modes": ["bridged"],
+        "nic.names": [None],
+        "nic.networks": [None],
+        "nic.uuids": ["%08x-0000-4000-9000-%012x" % (i, rng.getrandbits(48))],
+        "beparams": {
+            "always_failover": False,
+            "auto_balance": True,
+            "maxmem": mem,
+            "minmem": mem,
+            "spindle_use": 1,
+            "vcpus": vcpus,
+        },
+        "hvparams": {
+            "acpi": True,
+            "boot_order": "disk",
+            "cdrom_image_path": "",
+            "disk_cache": "default",
+            "kernel_path": "",
+            "kvm_flag": "",
+            "nic_type": "paravirtual",
+            "root_path": "/dev/vda1",
+            "serial_console": True,
+            "use_chroot": False,
+            "vnc_bind_address": "0.0.0.0",
+        },
+        "custom_beparams": {"maxmem": mem, "minmem": mem, "vcpus": vcpus},
+        "custom_hvparams": {},
+        "custom_nicparams": [{"link": "br0", "mode": "bridged"}],
+        "ctime": 1300000000.0 + i * 3600.123,
+        "mtime": 1400000000.0 + i * 60.456,
+        "serial_no": rng.randint(1, 500),
+        "tags": ["service:%s" % rng.choice(["web", "db", "cache", "queue"])],
+    }
+
+    _set_running(instance, running)
+    return instance
+
+
+def make_node_name(i):
+    return "node%03d.example.com" % i
+
+
+def make_node(i, group_uuid=None):
+    """
+    Make up a node, shaped like those in a bulk listing.
+
+    @type i: int
+    @param i: the node's number; node 0 is the master
+    @rtype: dict
+    """
+
+    rng = random.Random(-i)
+
+    return {
+        "name": make_node_name(i),
+        "uuid": "%08x-0000-4000-a000-%012x" % (i, rng.getrandbits(48)),
+        "pip": "192.0.2.%d" % (i % 250 + 1),
+        "sip": "198.51.100.%d" % (i % 250 + 1),
+        "group.uuid": group_uuid or make_group(0)["uuid"],
+        "master_candidate": i < 10,
+        "master_capable": True,
+        "vm_capable": True,
+        "drained": False,
+        "offline": False,
+        "role": "M" if i == 0 else ("C" if i < 10 else "R"),
+        "ctotal": 32,
+        "cnodes": 2,
+        "csockets": 2,
+        "mtotal": 262144,
+        "mnode": 4096,
+        "mfree": rng.randrange(8192, 131072),
+        "dtotal": 4194304,
+        "dfree": rng.randrange(65536, 2097152),
+        "pinst_cnt": 0,
+        "sinst_cnt": 0,
+        "pinst_list": [],
+        "sinst_list": [],
+        "ctime": 1300000000.0 + i,
+        "mtime": 1400000000.0 + i,
+        "serial_no": rng.randint(1, 50),
+        "tags": [],
+    }
+
+
+def make_group(i, name=None):
+    """
+    Make up a node group.
+
+    @rtype: dict
+    """
+
+    return {
+        "name": name or ("default" if i == 0 else "group%02d" % i),
+        "uuid": "%08x-0000-4000-b000-000000000001" % i,
+        "alloc_policy": "preferred",
+        "node_cnt": 0,
+        "node_list": [],
+        "ctime": 1300000000.0 + i,
+        "mtime": 1400000000.0 + i,
+        "serial_no": 1,
+        "tags": [],
+    }
+
+
+def _set_running(instance, running):
+    mem = instance["beparams"]["maxmem"]
+    vcpus = instance["beparams"]["vcpus"]
+
+    instance["admin_state"] = "up" if running else "down"
+    instance["oper_state"] = running
+    instance["status"] = "running" if running else "ADMIN_down"
+    instance["oper_ram"] = mem if running else None
+    instance["oper_vcpus"] = vcpus if running else None
+
+
+def _timestamp(t):
+    if t is None:
+        return None
+    return [int(t), int((t % 1) * 1000000)]
+
+
+def _kind(name, value):
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, float) and name.endswith("time"):
+        return "timestamp"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, (list, dict)) or value is None:
+        return "other"
+    return "text"
+
+
+def _flag(query, name):
+    return query.get(name, ["0"])[-1].lower() in ("1", "true", "yes")
+
+
+class HttpError(Exception):
+    """
+    An error response from the fake RAPI.
+    """
+
+    def __init__(self, code, message, explain=""):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+        self.explain = explain
+
+
+class OpError(Exception):
+    """
+    The reason that a fake job failed.
+    """
+
+
+class FakeJob(object):
+    """
+    A job in the fake cluster's queue.
+
+    A job's progress follows from the clock: it waits in the queue, runs,
+    and is finalized at fixed times from when it was submitted.
+    """
+
+    def __init__(self, job_id, summary, effect, received, queued_for,
+                 runs_for, error=None):
+        self.id = job_id
+        self.summary = summary
+        self.effect = effect
+        self.received = received
+        self.started = received + queued_for
+        self.ended = self.started + runs_for
+        self.error = error
+        self.result = None
+        self.canceled = None
+        self.settled = False
+
+    def status(self, now):
+        if self.canceled is not None:
+            return JOB_STATUS_CANCELED
+        if now < self.started:
+            return JOB_STATUS_QUEUED
+        if now < self.ended:
+            return JOB_STATUS_RUNNING
+        if self.error is not None:
+            return JOB_STATUS_ERROR
+        return JOB_STATUS_SUCCESS
+
+    def next_change(self, now):
+        """
+        @rtype: float or None
+        @return: when the job's status will next change, if ever
+        """
+
+        if self.canceled is not None or now >= self.ended:
+            return None
+        if now < self.started:
+            return self.started
+        return self.ended
+
+    def describe(self, now):
+        status = self.status(now)
+        finalized = status in (JOB_STATUS_SUCCESS, JOB_STATUS_ERROR,
+                               JOB_STATUS_CANCELED)
+        started = self.started if status != JOB_STATUS_QUEUED else None
+        if self.canceled is not None:
+            started = None
+
+        if status == JOB_STATUS_ERROR:
+            result = ["OpExecError", [self.error, "ecode_fault"]]
+        else:
+            result = self.result
+
+        if self.canceled is not None:
+            ended = self.canceled
+        elif finalized:
+            ended = self.ended
+        else:
+            ended = None
+
+        return {
+            "id": self.id,
+            "status": status,
+            "summary": [self.summary],
+            "ops": [{"OP_ID": "OP_" + self.summary.split("(")[0]}],
+            "opstatus": [status],
+            "opresult": [result if finalized else None],
+            "oplog": [[]],
+            "received_ts": _timestamp(self.received),
+            "start_ts": _timestamp(started),
+            "end_ts": _timestamp(ended),
+        }
+
+
+class FakeCluster(object):
+    """
+    An in-memory Ganeti cluster, answering RAPI requests.
+
+    All state is guarded by one lock, so a cluster may be shared by any
+    number of server threads.
+    """
+
+    def __init__(self, instances=10, nodes=4, groups=1, jobs=0,
+                 queue_delay=0.0, run_delay=0.1, job_error_rate=0.0,
+                 wait_timeout=10.0, seed=None):
+        """
+        @type instances: int
+        @param instances: how many instances to make up
+        @type nodes: int
+        @param nodes: how many nodes to make up
+        @type groups: int
+        @param groups: how many node groups to spread the nodes over
+        @type jobs: int
+        @param jobs: how many finished jobs to start the queue with
+        @type queue_delay: float
+        @param queue_delay: seconds each job waits in the queue
+        @type run_delay: float
+        @param run_delay: seconds each job runs for
+        @type job_error_rate: float
+        @param job_error_rate: the fraction of jobs which fail
+        @type wait_timeout: float
+        @param wait_timeout: seconds that a job long-poll waits for a change
+                             before giving up
+        @type seed: int or None
+        @param seed: seed for deciding which jobs fail
+        """
+
+        self.queue_delay = queue_delay
+        self.run_delay = run_delay
+        self.job_error_rate = job_error_rate
+        self.wait_timeout = wait_timeout
+
+        self.name = "cluster.example.com"
+        self.tags = []
+        self.info = {
+            "name": self.name,
+            "software_version": "2.16.0",
+            "protocol_version": 2160000,
+            "os_api_version": 20,
+            "export_version": 0,
+            "architecture": ["64bit", "x86_64"],
+            "master": make_node_name(0),
+            "default_hypervisor": "kvm",
+            "enabled_hypervisors": ["kvm"],
+            "ctime": 1300000000.0,
+            "mtime": 1400000000.0,
+        }
+        self.os = ["debootstrap+default", "image+default"]
+
+        self.groups = OrderedDict()
+        for i in range(max(groups, 1)):
+            group = make_group(i)
+            self.groups[group["name"]] = group
+
+        group_list = list(self.groups.values())
+        self.nodes = OrderedDict()
+        for i in range(max(nodes, 1)):
+            group = group_list[i % len(group_list)]
+            node = make_node(i, group["uuid"])
+            self.nodes[node["name"]] = node
+            group["node_list"].append(node["name"])
+            group["node_cnt"] += 1
+
+        self.instances = OrderedDict()
+        for i in range(instances):
+            instance = make_instance(i, len(self.nodes))
+            self.instances[instance["name"]] = instance
+            self.nodes[instance["pnode"]]["pinst_cnt"] += 1
+
+        self.jobs = OrderedDict()
+        self._next_job = 1
+        self._unsettled = []
+        self._fail_next = 0
+        self._random = random.Random(seed)
+
+        # Bumped whenever the cluster changes, for caching responses.
+        self.version = 0
+
+        self._lock = Lock()
+        self._changed = Condition(self._lock)
+
+        with self._lock:
+            for i in range(jobs):
+                job = self._submit("TEST_DELAY", None, lambda: None)
+                job.started = job.ended = job.received
+
+    def fail_next_jobs(self, count=1):
+        """
+        Make the next few jobs fail.
+        """
+
+        with self._lock:
+            self._fail_next += count
+
+    # Jobs
+
+    def _submit(self, op, name, effect, dry_run=False):
+        now = time.time()
+
+        error = None
+        if self._fail_next:
+            self._fail_next -= 1
+            error = "Injected failure"
+        elif self.job_error_rate and self._random.random() < \
+                self.job_error_rate:
+            error = "Injected failure"
+
+        summary = op if name is None else "%s(%s)" % (op, name)
+        job = FakeJob(self._next_job, summary, None if dry_run else effect,
+                      now, self.queue_delay, self.run_delay, error)
+        self._next_job += 1
+
+        self.jobs[job.id] = job
+        self._unsettled.append(job)
+        self._changed.notify_all()
+        return job
+
+    def _settle(self, now):
+        """
+        Apply the changes of every job which has finished by now, in order.
+        """
+
+        while self._unsettled and self._unsettled[0].ended <= now:
+            job = self._unsettled.pop(0)
+            job.settled = True
+
+            if job.canceled is not None or job.error is not None:
+                continue
+            if job.effect is None:
+                continue
+
+            try:
+                job.result = job.effect()
+            except OpError as e:
+                job.error = str(e)
+            else:
+                self.version += 1
+
+        # Jobs canceled before running never settle in order.
+        self._unsettled = [job for job in self._unsettled
+                           if job.canceled is None]
+
+    def settle(self):
+        """
+        Apply the changes of every job which has finished by now.
+
+        @rtype: int
+        @return: the version of the cluster, once they are applied
+        """
+
+        with self._lock:
+            self._settle(time.time())
+            return self.version
+
+    def _job(self, job_id):
+        try:
+            return self.jobs[int(job_id)]
+        except (KeyError, ValueError):
+            raise HttpError(404, "Not Found", "Job %s not found" % job_id)
+
+    # Requests
+
+    def handle(self, method, path, query=None, body=None):
+        """
+        Answer a RAPI request.
+
+        @type method: str
+        @param method: HTTP method
+        @type path: str
+        @param path: path, without the query string
+        @type query: dict of lists
+        @param query: query arguments, as from C{parse_qs}
+        @param body: the decoded request body
+        @rtype: two-tuple
+        @return: the HTTP status, and the object to send back
+        """
+
+        method = method.upper()
+        query = query or {}
+
+        for route_method, pattern, name in _routes:
+            if route_method != method:
+                continue
+            match = pattern.match(path)
+            if match is None:
+                continue
+
+            with self._lock:
+                self._settle(time.time())
+                try:
+                    return 200, getattr(self, name)(query, body,
+                                                    *match.groups())
+                except HttpError as e:
+                    return e.code, {"code": e.code, "message": e.message,
+                                    "explain": e.explain}
+
+        allowed = [m for m, pattern, name in _routes if pattern.match(path)]
+        if allowed:
+            return 501, {"code": 501, "message": "Method not implemented",
+                         "explain": "%s on %s" % (method, path)}
+        return 404, {"code": 404, "message": "Not Found", "explain": path}
+
+    def _lookup(self, kind, name):
+        collection = getattr(self, kind)
+        if name not in collection:
+            raise HttpError(404, "Not Found", "%s %s not found" %
+                            (kind[:-1].capitalize(), name))
+        return collection[name]
+
+    def _listing(self, kind, query):
+        collection = getattr(self, kind)
+        if _flag(query, "bulk"):
+            fields = query.get("fields")
+            if fields:
+                fields = fields[-1].split(",")
+                return [dict((f, item.get(f)) for f in fields)
+                        for item in collection.values()]
+            return list(collection.values())
+        return [{"id": name, "uri": "/2/%s/%s" % (kind, name)}
+                for name in collection]
+
+    def _job_for(self, op, name, query, effect):
+        return self._submit(op, name, effect, _flag(query, "dry-run")).id
+
+    def _touch(self, item):
+        item["serial_no"] += 1
+        item["mtime"] = time.time()
+
+    # Cluster
+
+    def version_(self, query, body):
+        return 2
+
+    def features(self, query, body):
+        return FEATURES
+
+    def get_info(self, query, body):
+        info = dict(self.info)
+        info["tags"] = list(self.tags)
+        return info
+
+    def modify_cluster(self, query, body):
+        def effect():
+            self.info.update(body or {})
+        return self._job_for("CLUSTER_SET_PARAMS", None, query, effect)
+
+    def redistribute_config(self, query, body):
+        return self._job_for("CLUSTER_REDIST_CONF", None, query,
+                             lambda: None)
+
+    def get_os(self, query, body):
+        return self.os
+
+    # Tags, on the cluster or on anything in it
+
+    def _tagged(self, kind, name):
+        if kind is None:
+            return self
+        return self._lookup(kind, name)
+
+    def _tags(self, item):
+        return item.tags if item is self else item["tags"]
+
+    def get_tags(self, query, body, kind=None, name=None):
+        return list(self._tags(self._tagged(kind, name)))
+
+    def add_tags(self, query, body, kind=None, name=None):
+        item = self._tagged(kind, name)
+        tags = query.get("tag", [])
+
+        def effect():
+            current = self._tags(item)
+            current.extend(tag for tag in tags if tag not in current)
+            if item is not self:
+                self._touch(item)
+
+        return self._job_for("TAGS_SET", name, query, effect)
+
+    def delete_tags(self, query, body, kind=None, name=None):
+        item = self._tagged(kind, name)
+        tags = query.get("tag", [])
+
+        def effect():
+            current = self._tags(item)
+            current[:] = [tag for tag in current if tag not in tags]
+            if item is not self:
+                self._touch(item)
+
+        return self._job_for("TAGS_DEL", name, query, effect)
+
+    # Instances
+
+    def get_instances(self, query, body):
+        return self._listing("instances", query)
+
+    def get_instance(self, query, body, name):
+        return self._lookup("instances", name)
+
+    def _instance_effect(self, name, f):
+        def effect():
+            instance = self.instances.get(name)
+            if instance is None:
+                raise OpError("Instance '%s' not known" % name)
+            result = f(instance)
+            self._touch(instance)
+            return result
+        return effect
+
+    def _instance_job(self, op, name, query, f=lambda instance: None):
+        return self._job_for(op, name, query, self._instance_effect(name, f))
+
+    def create_instance(self, query, body):
+        body = body or {}
+        name = body.get("name") or body.get("instance_name")
+        if not name:
+            raise HttpError(400, "Bad Request", "Missing instance name")
+
+        def effect():
+            if name in self.instances:
+                raise OpError("Instance '%s' is already in the cluster" %
+                              name)
+
+            instance = make_instance(len(self.instances), len(self.nodes))
+            instance["name"] = name
+            instance["disk_template"] = body.get("disk_template", "plain")
+            disks = [d.get("size", 1024) for d in body.get("disks", [])]
+            instance["disk.sizes"] = disks
+            instance["disk.spindles"] = [None] * len(disks)
+            instance["disk_usage"] = sum(disks)
+            instance["os"] = body.get("os_type") or body.get("os") or \
+                instance["os"]
+            for field in "pnode", "beparams", "hvparams":
+                if field in body:
+                    instance[field] = body[field]
+            instance["tags"] = list(body.get("tags", []))
+            instance["ctime"] = instance["mtime"] = time.time()
+            _set_running(instance, body.get("start", True))
+            self.instances[name] = instance
+
+        return self._job_for("INSTANCE_CREATE", name, query, effect)
+
+    def delete_instance(self, query, body, name):
+        def effect():
+            if self.instances.pop(name, None) is None:
+                raise OpError("Instance '%s' not known" % name)
+        return self._job_for("INSTANCE_REMOVE", name, query, effect)
+
+    def instance_info(self, query, body, name):
+        return self._instance_job("INSTANCE_QUERY_DATA", name, query,
+                                  lambda instance: {name: dict(instance)})
+
+    def instance_console(self, query, body, name):
+        instance = self._lookup("instances", name)
+        if not instance["oper_state"]:
+            raise HttpError(503, "Service Unavailable",
+                            "Instance %s is not running" % name)
+        port = instance["network_port"]
+        return {"instance": name, "kind": "vnc", "host": instance["pnode"],
+                "port": port, "display": port - 5900}
+
+    def startup(self, query, body, name):
+        return self._instance_job("INSTANCE_STARTUP", name, query,
+                                  lambda i: _set_running(i, True))
+
+    def shutdown(self, query, body, name):
+        return self._instance_job("INSTANCE_SHUTDOWN", name, query,
+                                  lambda i: _set_running(i, False))
+
+    def rename_instance(self, query, body, name):
+        new_name = (body or {}).get("new_name")
+        if not new_name:
+            raise HttpError(400, "Bad Request", "Missing new_name")
+
+        def effect():
+            if name not in self.instances:
+                raise OpError("Instance '%s' not known" % name)
+            if new_name in self.instances:
+                raise OpError("Instance '%s' is already in the cluster" %
+                              new_name)
+            instance = self.instances.pop(name)
+            instance["name"] = new_name
+            self._touch(instance)
+            self.instances[new_name] = instance
+
+        return self._job_for("INSTANCE_RENAME", name, query, effect)
+
+    def modify_instance(self, query, body, name):
+        body = body or {}
+
+        def modify(instance):
+            for field in "beparams", "hvparams", "osparams":
+                if field in body:
+                    instance.setdefault(field, {}).update(body[field])
+            if "os_name" in body:
+                instance["os"] = body["os_name"]
+
+        return self._instance_job("INSTANCE_SET_PARAMS", name, query, modify)
+
+    def move_instance(self, query, body, name):
+        def move(instance):
+            if instance["snodes"]:
+                instance["pnode"], instance["snodes"][0] = \
+                    instance["snodes"][0], instance["pnode"]
+        return self._instance_job("INSTANCE_MIGRATE", name, query, move)
+
+    def grow_disk(self, query, body, name, disk):
+        amount = int((body or {}).get("amount", 0))
+
+        def grow(instance):
+            sizes = instance["disk.sizes"]
+            index = int(disk)
+            if index >= len(sizes):
+                raise OpError("Invalid disk index %s" % disk)
+            sizes[index] += amount
+            instance["disk_usage"] += amount
+
+        return self._instance_job("INSTANCE_GROW_DISK", name, query, grow)
+
+    def instance_op(self, query, body, name, action):
+        op = "INSTANCE_" + action.upper().replace("-", "_")
+        return self._instance_job(op, name, query)
+
+    # Nodes
+
+    def get_nodes(self, query, body):
+        return self._listing("nodes", query)
+
+    def get_node(self, query, body, name):
+        return self._lookup("nodes", name)
+
+    def get_role(self, query, body, name):
+        return _roles[self._lookup("nodes", name)["role"]]
+
+    def set_role(self, query, body, name):
+        node = self._lookup("nodes", name)
+        letters = dict((v, k) for k, v in _roles.items())
+        if body not in letters:
+            raise HttpError(400, "Bad Request", "Unknown role %s" % body)
+
+        def effect():
+            node["role"] = letters[body]
+            node["master_candidate"] = body == "master-candidate"
+            node["drained"] = body == "drained"
+            node["offline"] = body == "offline"
+            self._touch(node)
+
+        return self._job_for("NODE_SET_PARAMS", name, query, effect)
+
+    def modify_node(self, query, body, name):
+        node = self._lookup("nodes", name)
+        changes = dict((k, v) for k, v in (body or {}).items()
+                       if k in ("drained", "offline", "master_candidate",
+                                "master_capable", "vm_capable"))
+
+        def effect():
+            node.update(changes)
+            self._touch(node)
+
+        return self._job_for("NODE_SET_PARAMS", name, query, effect)
+
+    def node_op(self, query, body, name, action):
+        self._lookup("nodes", name)
+        op = "NODE_" + action.upper().replace("/", "_")
+        return self._job_for(op, name, query, lambda: None)
+
+    # Groups
+
+    def get_groups(self, query, body):
+        return self._listing("groups", query)
+
+    def get_group(self, query, body, name):
+        return self._lookup("groups", name)
+
+    def create_group(self, query, body):
+        body = body or {}
+        name = body.get("name") or body.get("group_name")
+        if not name:
+            raise HttpError(400, "Bad Request", "Missing group name")
+
+        def effect():
+            if name in self.groups:
+                raise OpError("Group '%s' already exists" % name)
+            group = make_group(len(self.groups) + 1, name)
+            group["alloc_policy"] = body.get("alloc_policy") or "preferred"
+            group["ctime"] = group["mtime"] = time.time()
+            self.groups[name] = group
+
+        return self._job_for("GROUP_ADD", name, query, effect)
+
+    def _group_effect(self, name, f):
+        def effect():
+            group = self.groups.get(name)
+            if group is None:
+                raise OpError("Group '%s' not found" % name)
+            f(group)
+        return effect
+
+    def delete_group(self, query, body, name):
+        def remove(group):
+            if group["node_list"]:
+                raise OpError("Group '%s' not empty" % name)
+            del self.groups[name]
+        return self._job_for("GROUP_REMOVE", name, query,
+                             self._group_effect(name, remove))
+
+    def modify_group(self, query, body, name):
+        def modify(group):
+            if "alloc_policy" in (body or {}):
+                group["alloc_policy"] = body["alloc_policy"]
+            self._touch(group)
+        return self._job_for("GROUP_SET_PARAMS", name, query,
+                             self._group_effect(name, modify))
+
+    def rename_group(self, query, body, name):
+        new_name = (body or {}).get("new_name")
+
+        def rename(group):
+            if new_name in self.groups:
+                raise OpError("Group '%s' already exists" % new_name)
+            del self.groups[name]
+            group["name"] = new_name
+            self._touch(group)
+            self.groups[new_name] = group
+
+        return self._job_for("GROUP_RENAME", name, query,
+                             self._group_effect(name, rename))
+
+    def assign_nodes(self, query, body, name):
+        nodes = (body or {}).get("nodes", [])
+
+        def assign(group):
+            for node_name in nodes:
+                node = self.nodes.get(node_name)
+                if node is None:
+                    raise OpError("Node '%s' not known" % node_name)
+            for node_name in nodes:
+                node = self.nodes[node_name]
+                for old in self.groups.values():
+                    if node_name in old["node_list"]:
+                        old["node_list"].remove(node_name)
+                        old["node_cnt"] -= 1
+                node["group.uuid"] = group["uuid"]
+                group["node_list"].append(node_name)
+                group["node_cnt"] += 1
+            self._touch(group)
+
+        return self._job_for("GROUP_ASSIGN_NODES", name, query,
+                             self._group_effect(name, assign))
+
+    # Jobs
+
+    def get_jobs(self, query, body):
+        if _flag(query, "bulk"):
+            now = time.time()
+            return [job.describe(now) for job in self.jobs.values()]
+        return [{"id": job_id, "uri": "/2/jobs/%s" % job_id}
+                for job_id in self.jobs]
+
+    def get_job(self, query, body, job_id):
+        return self._job(job_id).describe(time.time())
+
+    def cancel_job(self, query, body, job_id):
+        job = self._job(job_id)
+        now = time.time()
+
+        if job.status(now) != JOB_STATUS_QUEUED:
+            return [False, "Job %s is no longer waiting in the queue" %
+                    job.id]
+
+        if not _flag(query, "dry-run"):
+            job.canceled = now
+            self._changed.notify_all()
+        return [True, "Job %s canceled" % job.id]
+
+    def wait_job(self, query, body, job_id):
+        """
+        Long-poll for a change in a job's status.
+
+        Returns None if nothing changed before the wait timed out.
+        """
+
+        job = self._job(job_id)
+        body = body or {}
+        fields = body.get("fields") or ["status"]
+        previous = body.get("previous_job_info")
+        deadline = time.time() + self.wait_timeout
+
+        while True:
+            now = time.time()
+            self._settle(now)
+            description = job.describe(now)
+            info = [description.get(field) for field in fields]
+
+            if info != previous:
+                return {"job_info": info, "log_entries": []}
+
+            if now >= deadline:
+                return None
+
+            wake = job.next_change(now)
+            timeout = deadline - now
+            if wake is not None:
+                timeout = min(timeout, wake - now)
+            self._changed.wait(max(timeout, 0.001))
+
+    # Queries
+
+    def _resources(self, what):
+        if what == "instance":
+            return list(self.instances.values())
+        if what == "node":
+            return list(self.nodes.values())
+        if what == "group":
+            return list(self.groups.values())
+        if what == "job":
+            now = time.time()
+            return [job.describe(now) for job in self.jobs.values()]
+        raise HttpError(400, "Bad Request",
+                        "Resource '%s' can not be queried" % what)
+
+    def _field_definitions(self, resources, fields):
+        sample = resources[0] if resources else {}
+        return [{"name": field, "title": field.capitalize(),
+                 "kind": _kind(field, sample.get(field)),
+                 "doc": field} for field in fields]
+
+    def query(self, query, body, what):
+        body = body or {}
+        fields = body.get("fields") or ["name"]
+        qfilter = body.get("qfilter", body.get("filter"))
+
+        resources = self._resources(what)
+        if qfilter:
+            resources = [item for item in resources
+                         if _matches(qfilter, item)]
+
+        data = [[[RS_NORMAL, item[field]] if field in item
+                 else [RS_UNKNOWN, None] for field in fields]
+                for item in resources]
+
+        return {"fields": self._field_definitions(resources, fields),
+                "data": data}
+
+    def query_fields(self, query, body, what):
+        resources = self._resources(what)
+        fields = query.get("fields")
+        if fields:
+            fields = fields[-1].split(",")
+        elif resources:
+            fields = sorted(resources[0])
+        else:
+            fields = ["name"]
+        return self._field_definitions(resources, fields)
+
+
+def _matches(qfilter, item):
+    """
+    Evaluate a query filter against a resource.
+    """
+
+    op = qfilter[0]
+
+    if op == "&":
+        return all(_matches(f, item) for f in qfilter[1:])
+    if op == "|":
+        return any(_matches(f, item) for f in qfilter[1:])
+    if op == "!":
+        return not _matches(qfilter[1], item)
+    if op == "?":
+        return bool(item.get(qfilter[1]))
+
+    field, value = qfilter[1], qfilter[2]
+    actual = item.get(field)
+
+    if op in ("=", "=="):
+        return actual == value
+    if op == "!=":
+        return actual != value
+    if op == "=~":
+        return actual is not None and re.search(value, str(actual)) is not None
+    if op == "=[]":
+        return actual is not None and value in actual
+    if op == "<":
+        return actual is not None and actual < value
+    if op == "<=":
+        return actual is not None and actual <= value
+    if op == ">":
+        return actual is not None and actual > value
+    if op == ">=":
+        return actual is not None and actual >= value
+
+    raise HttpError(400, "Bad Request", "Unknown filter operator %s" % op)
+
+
+_name = r"([^/]+)"
+_tagged = r"/2/(instances|nodes|groups)/%s/tags$" % _name
+
+_routes = [(method, re.compile(pattern), name) for method, pattern, name in [
+    ("GET", r"/version$", "version_"),
+    ("GET", r"/2/features$", "features"),
+    ("GET", r"/2/info$", "get_info"),
+    ("PUT", r"/2/modify$", "modify_cluster"),
+    ("PUT", r"/2/redistribute-config$", "redistribute_config"),
+    ("GET", r"/2/os$", "get_os"),
+    ("GET", r"/2/tags$", "get_tags"),
+    ("PUT", r"/2/tags$", "add_tags"),
+    ("DELETE", r"/2/tags$", "delete_tags"),
+    ("GET", _tagged, "get_tags"),
+    ("PUT", _tagged, "add_tags"),
+    ("DELETE", _tagged, "delete_tags"),
+
+    ("GET", r"/2/instances$", "get_instances"),
+    ("POST", r"/2/instances$", "create_instance"),
+    ("GET", r"/2/instances/%s$" % _name, "get_instance"),
+    ("DELETE", r"/2/instances/%s$" % _name, "delete_instance"),
+    ("GET", r"/2/instances/%s/info$" % _name, "instance_info"),
+    ("GET", r"/2/instances/%s/console$" % _name, "instance_console"),
+    ("PUT", r"/2/instances/%s/startup$" % _name, "startup"),
+    ("PUT", r"/2/instances/%s/shutdown$" % _name, "shutdown"),
+    ("PUT", r"/2/instances/%s/rename$" % _name, "rename_instance"),
+    ("PUT", r"/2/instances/%s/modify$" % _name, "modify_instance"),
+    ("PUT", r"/2/instances/%s/(?:failover|migrate)$" % _name,
+     "move_instance"),
+    ("POST", r"/2/instances/%s/disk/(\d+)/grow$" % _name, "grow_disk"),
+    ("POST", r"/2/instances/%s/(reboot|reinstall|recreate-disks|"
+     r"replace-disks)$" % _name, "instance_op"),
+    ("PUT", r"/2/instances/%s/(activate-disks|deactivate-disks|export|"
+     r"prepare-export)$" % _name, "instance_op"),
+
+    ("GET", r"/2/nodes$", "get_nodes"),
+    ("GET", r"/2/nodes/%s$" % _name, "get_node"),
+    ("GET", r"/2/nodes/%s/role$" % _name, "get_role"),
+    ("PUT", r"/2/nodes/%s/role$" % _name, "set_role"),
+    ("POST", r"/2/nodes/%s/modify$" % _name, "modify_node"),
+    ("POST", r"/2/nodes/%s/(evacuate|migrate|powercycle)$" % _name,
+     "node_op"),
+    ("GET", r"/2/nodes/%s/(storage)$" % _name, "node_op"),
+    ("PUT", r"/2/nodes/%s/(storage/modify|storage/repair)$" % _name,
+     "node_op"),
+
+    ("GET", r"/2/groups$", "get_groups"),
+    ("POST", r"/2/groups$", "create_group"),
+    ("GET", r"/2/groups/%s$" % _name, "get_group"),
+    ("DELETE", r"/2/groups/%s$" % _name, "delete_group"),
+    ("PUT", r"/2/groups/%s/modify$" % _name, "modify_group"),
+    ("PUT", r"/2/groups/%s/rename$" % _name, "rename_group"),
+    ("PUT", r"/2/groups/%s/assign-nodes$" % _name, "assign_nodes"),
+
+    ("GET", r"/2/jobs$", "get_jobs"),
+    ("GET", r"/2/jobs/(\d+)$", "get_job"),
+    ("DELETE", r"/2/jobs/(\d+)$", "cancel_job"),
+    ("GET", r"/2/jobs/(\d+)/wait$", "wait_job"),
+
+    ("PUT", r"/2/query/%s$" % _name, "query"),
+    ("GET", r"/2/query/%s/fields$" % _name, "query_fields"),
+]]
+
+# Responses to these are cached until the cluster next changes.
+_cacheable = frozenset([
+    "/version", "/2/features", "/2/info", "/2/os", "/2/tags",
+    "/2/instances", "/2/instances/*", "/2/instances/*/tags",
+    "/2/nodes", "/2/nodes/*", "/2/nodes/*/tags", "/2/nodes/*/role",
+    "/2/groups", "/2/groups/*", "/2/groups/*/tags",
+])
+
+
+class Fault(object):
+    """
+    Latency or errors to inject into matching requests.
+    """
+
+    def __init__(self, path="*", method=None, delay=0.0, code=None,
+                 retry_after=None, count=None, rate=1.0):
+        self.path = path
+        self.method = method.upper() if method else None
+        self.delay = delay
+        self.code = code
+        self.retry_after = retry_after
+        self.count = count
+        self.rate = rate
+
+    def matches(self, method, path):
+        if self.count is not None and self.count <= 0:
+            return False
+        if self.method is not None and self.method != method.upper():
+            return False
+        return fnmatchcase(path, self.path)
+
+
+def make_certificate(directory):
+    """
+    Create a self-signed certificate for localhost with openssl.
+
+    @rtype: two-tuple of str
+    @return: paths of the certificate and its key
+    """
+
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call([
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", key, "-out", cert, "-days", "7",
+            "-subj", "/CN=localhost",
+            "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+        ], stdout=devnull, stderr=devnull)
+
+    return cert, key
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; don't let them sit waiting
+    # for a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self):
+        length = int(self.headers.get("content-length") or 0)
+        raw = self.rfile.read(length) if length else b""
+
+        parts = urlsplit(self.path)
+        path = parts.path
+        code, body = self.server.fake.respond(self.command, path,
+                                              parts.query, raw)
+
+        self.send_response(code)
+        for name, value in body[1]:
+            self.send_header(name, value)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body[0])))
+        self.end_headers()
+        self.wfile.write(body[0])
+
+    # Methods are dispatched case-sensitively, and the Twisted client sends
+    # them in lowercase.
+    do_GET = do_PUT = do_POST = do_DELETE = respond
+    do_get = do_put = do_post = do_delete = respond
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on their keep-alive connections all the time.
+        pass
+
+
+class FakeRapiServer(object):
+    """
+    Serve a L{FakeCluster} over HTTPS, from a background thread.
+    """
+
+    def __init__(self, cluster=None, host="127.0.0.1", port=0, cert=None,
+                 key=None):
+        """
+        @type cluster: L{FakeCluster} or None
+        @param cluster: the cluster to serve; defaults to a small one
+        @type port: int
+        @param port: the port to listen on; 0 to pick a free one
+        @type cert: str or None
+        @param cert: path of the certificate to serve; if None, a
+                     self-signed one is made with openssl
+        @type key: str or None
+        @param key: path of the certificate's key
+        """
+
+        self.cluster = cluster if cluster is not None else FakeCluster()
+        self.host = host
+        self.port = port
+        self.cert = cert
+        self.key = key
+
+        self.faults = []
+        self.requests = 0
+
+        self._server = None
+        self._directory = None
+        self._cache = {}
+        self._lock = Lock()
+        self._random = random.Random()
+
+    def start(self):
+        """
+        Start serving.
+
+        @rtype: L{FakeRapiServer}
+        @return: this server, with C{port} set to the port it listens on
+        """
+
+        if self.cert is None:
+            self._directory = tempfile.mkdtemp(prefix="gentleman-fake-")
+            self.cert, self.key = make_certificate(self._directory)
+
+        server = _Server((self.host, self.port), _Handler)
+        server.fake = self
+
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(self.cert, self.key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+
+        self._server = server
+        self.port = server.server_address[1]
+
+        # Check often for shutdown, so that stopping doesn't hold up tests
+        # which start a server each.
+        thread = Thread(target=server.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+        return self
+
+    def stop(self):
+        """
+        Stop serving, and remove any certificate made for this server.
+        """
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+        if self._directory is not None:
+            shutil.rmtree(self._directory, True)
+            self._directory = None
+            self.cert = self.key = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def inject(self, path="*", method=None, delay=0.0, code=None,
+               retry_after=None, count=None, rate=1.0):
+        """
+        Inject latency or errors into requests.
+
+        @type path: str
+        @param path: glob matching the paths to affect, such as
+                     "/2/instances/*"
+        @type method: str or None
+        @param method: the HTTP method to affect; None for all
+        @type delay: float
+        @param delay: seconds to wait before answering
+        @type code: int or None
+        @param code: an HTTP status to answer with instead of the real
+                     answer, such as 503
+        @type retry_after: int or None
+        @param retry_after: a Retry-After header to send with errors
+        @type count: int or None
+        @param count: how many requests to affect; None for all of them
+        @type rate: float
+        @param rate: the fraction of matching requests to affect
+        @rtype: L{Fault}
+        @return: the fault, which may be removed with L{clear}
+        """
+
+        fault = Fault(path, method, delay, code, retry_after, count, rate)
+        with self._lock:
+            self.faults.append(fault)
+        return fault
+
+    def clear(self, fault=None):
+        """
+        Remove one injected fault, or all of them.
+        """
+
+        with self._lock:
+            if fault is None:
+                del self.faults[:]
+            elif fault in self.faults:
+                self.faults.remove(fault)
+
+    def _fault(self, method, path):
+        delay = 0.0
+        error = None
+
+        with self._lock:
+            self.requests += 1
+            for fault in self.faults:
+                if not fault.matches(method, path):
+                    continue
+                if fault.rate < 1.0 and self._random.random() >= fault.rate:
+                    continue
+                if fault.count is not None:
+                    fault.count -= 1
+                delay += fault.delay
+                if fault.code is not None and error is None:
+                    error = fault
+
+        return delay, error
+
+    def respond(self, method, path, query_string, raw):
+        """
+        Answer a request.
+
+        @rtype: two-tuple
+        @return: the HTTP status, and a two-tuple of the encoded body and
+                 any extra headers
+        """
+
+        delay, error = self._fault(method, path)
+        if delay:
+            time.sleep(delay)
+
+        if error is not None:
+            headers = []
+            if error.retry_after is not None:
+                headers.append(("retry-after", str(error.retry_after)))
+            return error.code, (_encode({"code": error.code,
+                                         "message": "Injected error",
+                                         "explain": path}), headers)
+
+        key = None
+        if method.upper() == "GET" and path_template(path) in _cacheable:
+            # Jobs which have finished since the last request change the
+            # version, so settle them before looking for a cached answer.
+            key = self.cluster.settle(), path, query_string
+            body = self._cache.get(key)
+            if body is not None:
+                return 200, (body, [])
+
+        try:
+            body = json.loads(raw.decode("utf-8")) if raw else None
+        except ValueError:
+            return 400, (_encode({"code": 400, "message": "Bad Request",
+                                  "explain": "Invalid JSON body"}), [])
+
+        query = parse_qs(query_string, keep_blank_values=True)
+        code, result = self.cluster.handle(method, path, query, body)
+        encoded = _encode(result)
+
+        if key is not None and code == 200:
+            with self._lock:
+                if len(self._cache) > 256:
+                    self._cache.clear()
+                self._cache[key] = encoded
+
+        return code, (encoded, [])
+
+
+def _encode(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a fake Ganeti RAPI.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--cert")
+    parser.add_argument("--key")
+    parser.add_argument("--instances", type=int, default=1000)
+    parser.add_argument("--nodes", type=int, default=40)
+    parser.add_argument("--groups", type=int, default=1)
+    parser.add_argument("--jobs", type=int, default=0,
+                        help="finished jobs to start the queue with")
+    parser.add_argument("--queue-delay", type=float, default=0.0)
+    parser.add_argument("--run-delay", type=float, default=0.1)
+    parser.add_argument("--job-error-rate", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds to delay every request")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests to answer with 503")
+    args = parser.parse_args(argv)
+
+    cluster = FakeCluster(instances=args.instances, nodes=args.nodes,
+                          groups=args.groups, jobs=args.jobs,
+                          queue_delay=args.queue_delay,
+                          run_delay=args.run_delay,
+                          job_error_rate=args.job_error_rate)
+    server = FakeRapiServer(cluster, args.host, args.port, args.cert,
+                            args.key)
+
+    if args.latency:
+        server.inject(delay=args.latency)
+    if args.error_rate:
+        server.inject(code=503, rate=args.error_rate)
+
+    server.start()
+
+    # Whoever started us reads these to find the server; stop by closing
+    # our stdin.
+    print(server.port)
+    print(server.cert)
+    sys.stdout.flush()
+
+    try:
+        sys.stdin.read()
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Talking to many clusters at once.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from threading import Lock
+
+from gentleman.errors import GanetiApiError
+from gentleman.futures import FuturesRapiClient
+
+
+class _ClusterExecutor(object):
+    """
+    Run one cluster's requests on the fleet's thread pool, at most C{limit}
+    of them at a time.
+
+    Requests beyond the limit wait in line without taking a thread, so a
+    cluster which hangs ties up no more than C{limit} of the fleet's threads,
+    however many calls time out waiting for it.
+    """
+
+    def __init__(self, executor, limit):
+        self._executor = executor
+        self.limit = limit
+
+        self._running = 0
+        self._queue = deque()
+        self._lock = Lock()
+
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        with self._lock:
+            self._queue.append((future, fn, args, kwargs))
+        self._next()
+        return future
+
+
+    def _next(self):
+        with self._lock:
+            if self._running >= self.limit or not self._queue:
+                return
+            self._running += 1
+            task = self._queue.popleft()
+
+        try:
+            self._executor.submit(self._run, *task)
+        except RuntimeError, e:
+            # The fleet has been closed.
+            with self._lock:
+                self._running -= 1
+            task[0].set_exception(e)
+
+
+    def _run(self, future, fn, args, kwargs):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception, e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            with self._lock:
+                self._running -= 1
+            self._next()
+
+
+    def shutdown(self):
+        """
+        Cancel the requests still waiting in line.
+        """
+
+        with self._lock:
+            queued = list(self._queue)
+            self._queue.clear()
+
+        for task in queued:
+            task[0].cancel()
+
+
+class Fleet(object):
+    """
+    A set of clusters, each with its own L{FuturesRapiClient}.
+
+    All of the clients send their requests from one shared thread pool, so
+    the fleet as a whole never has more than C{max_workers} requests in
+    flight, and no cluster has more than C{per_cluster} of them. Calls run
+    on every cluster concurrently; a cluster which is slow or down only
+    delays its own result, up to the fleet's timeout, and can't take the
+    threads which the other clusters need.
+    """
+
+    def __init__(self, max_workers=32, timeout=None, per_cluster=None):
+        """
+        @type max_workers: int
+        @param max_workers: the most requests to have in flight, fleet-wide
+        @type timeout: float or None
+        @param timeout: seconds to wait for each cluster before giving up on
+                        it; None to wait as long as it takes
+        @type per_cluster: int or None
+        @param per_cluster: the most requests to have in flight to any one
+                            cluster; defaults to a quarter of C{max_workers}
+        """
+
+        if per_cluster is None:
+            per_cluster = max(max_workers // 4, 1)
+
+        self._executor = ThreadPoolExecutor(max_workers)
+        self.max_workers = max_workers
+        self.per_cluster = per_cluster
+        self.timeout = timeout
+        self.clients = {}
+        self._executors = {}
+
+
+    def add(self, name, host, **kwargs):
+        """
+        Add a cluster to the fleet.
+
+        Keyword arguments are passed on to L{FuturesRapiClient}.
+
+        @type name: str
+        @param name: what to call the cluster in results
+        @type host: str
+        @param host: the cluster master
+        @rtype: L{FuturesRapiClient}
+        @return: the new client
+        """
+
+        kwargs.setdefault("max_workers", self.per_cluster)
+        executor = _ClusterExecutor(self._executor, kwargs["max_workers"])
+        client = FuturesRapiClient(host, executor=executor, **kwargs)
+        self.clients[name] = client
+        self._executors[name] = executor
+        return client
+
+
+    def remove(self, name):
+        """
+        Remove a cluster from the fleet, closing its connections.
+
+        @type name: str
+        @param name: the cluster's name
+        """
+
+        self._executors.pop(name).shutdown()
+        self.clients.pop(name).close()
+
+
+    def _gather(self, futures):
+        done, pending = wait(futures.values(), timeout=self.timeout)
+
+        results = {}
+        errors = {}
+
+        for name, future in futures.iteritems():
+            if future in pending:
+                errors[name] = GanetiApiError("Timed out waiting for %s" %
+                                              name)
+            elif future.exception() is not None:
+                errors[name] = future.exception()
+            else:
+                results[name] = future.result()
+
+        return results, errors
+
+
+    def run_on(self, names, base_function, *args, **kwargs):
+        """
+        Call a function from L{gentleman.base} on some of the clusters.
+
+        @type names: iterable of str
+        @param names: the clusters to call it on
+        @type base_function: callable
+        @param base_function: the function to call, such as C{GetInstances}
+
+        @rtype: two-tuple of dicts
+        @return: the result from each cluster which answered, and the error
+                 from each cluster which didn't, both keyed by cluster name
+        """
+
+        futures = {}
+        errors = {}
+
+        for name in names:
+            try:
+                futures[name] = base_function(self.clients[name], *args,
+                                              **kwargs)
+            except Exception, e:
+                errors[name] = e
+
+        results, more_errors = self._gather(futures)
+        errors.update(more_errors)
+        return results, errors
+
+
+    def run(self, base_function, *args, **kwargs):
+        """
+        Call a function from L{gentleman.base} on every cluster.
+
+        @see: L{run_on}
+        """
+
+        return self.run_on(list(self.clients), base_function, *args,
+                           **kwargs)
+
+
+    def start(self):
+        """
+        Confirm that we may access every cluster.
+
+        @rtype: two-tuple of dicts
+        @return: None for each cluster which could be accessed, and the error
+                 for each which couldn't, both keyed by cluster name
+        """
+
+        futures = dict((name, client.start())
+                       for name, client in self.clients.iteritems())
+        return self._gather(futures)
+
+
+    def close(self):
+        """
+        Stop the thread pool and close all connections.
+        """
+
+        for executor in self._executors.itervalues():
+            executor.shutdown()
+        self._executor.shutdown(wait=False)
+        for client in self.clients.itervalues():
+            client.close()
@@ -0,0 +1,242 @@
+"""
+Concurrent RAPI requests from plain synchronous code.
+
+This module provides a RAPI client whose requests run on a pool of threads
+and return futures, so that many requests can be in flight at once.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import BoundedSemaphore
+
+from gentleman.sync import RequestsRapiClient
+
+
+def _settle(source, target):
+    """
+    Copy the outcome of one finished future onto another.
+    """
+
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def chain(future, f):
+    """
+    Apply a function to the result of a future.
+
+    If the function returns another future, that future is waited on
+    first, so that chains compose the same way Deferreds do in the Twisted
+    client. The function runs on whichever thread finished the future, and
+    must not block on other futures.
+
+    @type future: L{Future}
+    @param future: the future to chain onto
+    @type f: callable
+    @param f: called with the result of C{future}
+
+    @rtype: L{Future}
+    @return: a future for the result of C{f}
+    """
+
+    result = Future()
+
+    def done(fut):
+        if fut.cancelled() or fut.exception() is not None:
+            _settle(fut, result)
+            return
+
+        try:
+            value = f(fut.result())
+        except Exception, e:
+            result.set_exception(e)
+            return
+
+        if isinstance(value, Future):
+            value.add_done_callback(lambda v: _settle(v, result))
+        else:
+            result.set_result(value)
+
+    future.add_done_callback(done)
+    return result
+
+
+class FuturesRapiClient(object):
+    """
+    Ganeti RAPI client which sends requests from a pool of threads.
+
+    Requests are sent with a L{RequestsRapiClient}; each one returns a
+    L{Future} for its response.
+    """
+
+    def __init__(self, host, port=5080, username=None, password=None,
+                 timeout=60, max_workers=10, executor=None, client=None,
+                 **kwargs):
+        """
+        Initializes this class.
+
+        Any other keyword arguments are passed on to L{RequestsRapiClient}.
+
+        @type host: string
+        @param host: the ganeti cluster master to interact with
+        @type port: int
+        @param port: the port on which the RAPI is running (default is 5080)
+        @type username: string
+        @param username: the username to connect with
+        @type password: string
+        @param password: the password to connect with
+        @type max_workers: int
+        @param max_workers: the number of threads, and of pooled connections
+        @type executor: L{concurrent.futures.Executor} or None
+        @param executor: an executor to send requests from, instead of a new
+                         pool of C{max_workers} threads; it is left running
+                         when this client is closed
+        @type client: L{RequestsRapiClient} or None
+        @param client: the client to send requests with, instead of a new
+                       one
+        """
+
+        if client is None:
+            kwargs.setdefault("pool_size", max_workers)
+            client = RequestsRapiClient(host, port, username, password,
+                                        timeout, **kwargs)
+        self._client = client
+
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers)
+        self._executor = executor
+        self.max_workers = max_workers
+
+
+    @property
+    def version(self):
+        return self._client.version
+
+
+    @property
+    def features(self):
+        return self._client.features
+
+
+    def request(self, method, path, query=None, content=None):
+        """
+        Sends an HTTP request from the thread pool.
+
+        @see: L{RequestsRapiClient.request}
+
+        @rtype: L{Future}
+        @return: JSON-Decoded response
+        """
+
+        record = self._client._record(method, path)
+        return self._executor.submit(self._client._request, method, path,
+                                     query, content, record)
+
+
+    def stream(self, method, path, query=None, content=None, callback=None):
+        """
+        Sends an HTTP request from the thread pool, decoding a JSON array
+        response as it arrives.
+
+        @see: L{RequestsRapiClient.stream}
+
+        @rtype: L{Future}
+        """
+
+        record = self._client._record(method, path)
+        return self._executor.submit(self._client._stream, method, path,
+                                     query, content, callback, record)
+
+
+    @staticmethod
+    def applier(f, future):
+        return chain(future, f)
+
+
+    @staticmethod
+    def succeed(value):
+        future = Future()
+        future.set_result(value)
+        return future
+
+
+    def start(self):
+        """
+        Confirm that we may access the target cluster.
+
+        @rtype: L{Future}
+        """
+
+        return self._executor.submit(self._client.start)
+
+
+    def pool_stats(self):
+        return self._client.pool_stats()
+
+
+    def close(self):
+        """
+        Stop the thread pool, unless it was given to this client, and close
+        all pooled connections.
+        """
+
+        if self._owns_executor:
+            self._executor.shutdown()
+        self._client.close()
+
+
+    def fan_out(self, base_function, args_list, max_workers=None,
+                return_exceptions=False):
+        """
+        Call a function from L{gentleman.base} once for each set of
+        arguments, concurrently, and wait for all of the results.
+
+            >>> c.fan_out(GetInstance, ["web01", "web02"])
+
+        @type base_function: callable
+        @param base_function: the function to call, such as C{GetInstance}
+        @type args_list: iterable
+        @param args_list: arguments for each call, as a tuple, or as a single
+                          value for functions taking a single argument
+        @type max_workers: int or None
+        @param max_workers: the most calls to have in flight at once;
+                            defaults to the size of the thread pool
+        @type return_exceptions: bool
+        @param return_exceptions: whether to return errors in place of
+                                  results, instead of raising the first one
+
+        @rtype: list
+        @return: the result of each call, in order
+        """
+
+        semaphore = BoundedSemaphore(max_workers or self.max_workers)
+        futures = []
+
+        for args in args_list:
+            if not isinstance(args, tuple):
+                args = args,
+
+            semaphore.acquire()
+            try:
+                future = base_function(self, *args)
+            except Exception, e:
+                if not return_exceptions:
+                    raise
+                future = Future()
+                future.set_exception(e)
+            future.add_done_callback(lambda f: semaphore.release())
+            futures.append(future)
+
+        results = []
+
+        for future in futures:
+            if return_exceptions and future.exception() is not None:
+                results.append(future.exception())
+            else:
+                results.append(future.result())
+
+        return results
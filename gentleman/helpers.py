@@ -4,6 +4,10 @@ Some utility units.
 
 from operator import itemgetter
 
+# Collections whose third path component names a single resource.
+_named_collections = frozenset(["groups", "instances", "jobs", "networks",
+                                "nodes"])
+
 def prepare_query(query):
     """
     Prepare a query object for the RAPI.
@@ -45,3 +49,48 @@ def itemgetters(*args):
         return [f(x) for x in l]
 
     return inner
+
+def path_template(path):
+    """
+    Reduce a RAPI path to the endpoint it addresses.
+
+    Resource names are replaced with "*", so that, for example,
+    "/2/instances/web01/tags" becomes "/2/instances/*/tags".
+
+    @type path: str
+    @param path: RAPI path, without query string
+    @rtype: str
+    @return: the path with resource names masked
+    """
+
+    parts = path.split("/")
+
+    if len(parts) > 3 and parts[1] == "2" and parts[2] in _named_collections:
+        parts[3] = "*"
+        # Disks are numbered: /2/instances/<name>/disk/<index>/grow
+        if len(parts) > 5 and parts[4] == "disk":
+            parts[5] = "*"
+
+    return "/".join(parts)
+
+def path_resource(path):
+    """
+    Find the resource that a RAPI path acts on.
+
+    @type path: str
+    @param path: RAPI path, without query string
+    @rtype: two-tuple of str
+    @return: the path of the collection, such as "/2/instances", and of the
+             resource within it, such as "/2/instances/web01"; the resource
+             is None if the path acts on the collection or the cluster
+    """
+
+    parts = path.split("/")
+
+    if len(parts) > 2 and parts[1] == "2" and parts[2] in _named_collections:
+        collection = "/".join(parts[:3])
+        if len(parts) > 3 and parts[3]:
+            return collection, "/".join(parts[:4])
+        return collection, None
+
+    return "/2", None
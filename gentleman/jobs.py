@@ -0,0 +1,219 @@
+"""
+Waiting for many jobs at once.
+
+Mutating RAPI calls return job ids; the waiters here follow many of those
+jobs concurrently over a bounded number of connections, reporting each job
+as soon as it is finalized.
+"""
+
+import logging
+from Queue import Queue
+from threading import Lock, Thread
+import time
+
+from gentleman.base import (GetJobStatus, JOB_STATUS_FINALIZED,
+                            WaitForJobChange)
+from gentleman.errors import NotOkayError
+
+# Statuses with which a RAPI answers /wait when it can't wait for jobs at
+# all; any other error is a failure of that one request.
+NO_WAIT_CODES = frozenset([404, 405, 501])
+
+
+class JobTracker(object):
+    """
+    The state of a single job being waited upon.
+    """
+
+    fields = ["status"]
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.job_info = None
+        self.log_serial = None
+        self.status = None
+        self.next_poll = 0
+
+    def changed(self, result):
+        """
+        Record the result of a WaitForJobChange long-poll.
+
+        @type result: dict or None
+        @param result: the long-poll result, or None if nothing changed
+
+        @rtype: bool
+        @return: whether the job is now finalized
+        """
+
+        if result:
+            self.job_info = result["job_info"]
+            self.status = self.job_info[0]
+
+            serials = [entry[0] for entry in result.get("log_entries", [])]
+            if serials:
+                self.log_serial = max(serials)
+
+        return self.status in JOB_STATUS_FINALIZED
+
+    def polled(self, job, interval):
+        """
+        Record the result of a GetJobStatus poll.
+
+        @type job: dict
+        @param job: the job status
+        @type interval: float
+        @param interval: seconds to wait before polling again
+
+        @rtype: bool
+        @return: whether the job is now finalized
+        """
+
+        self.status = job["status"]
+        self.next_poll = time.time() + interval
+
+        return self.status in JOB_STATUS_FINALIZED
+
+
+class JobWaiter(object):
+    """
+    Wait for many jobs at once, using a blocking client from several threads.
+
+    Each of up to C{max_connections} threads takes the next unfinished job,
+    sends one long-poll for it, and puts it back in line unless it has been
+    finalized, so that every job gets a turn. If the RAPI lacks C{/wait},
+    jobs are polled with GetJobStatus every C{poll_interval} seconds; other
+    errors from C{/wait}, such as a 503 while the master fails over, are
+    left to the client's retry policy, and fail only the job concerned.
+    """
+
+    def __init__(self, r, max_connections=4, poll_interval=1.0,
+                 callback=None):
+        """
+        @param r: a blocking RAPI client which may be shared between threads
+        @type max_connections: int
+        @param max_connections: the number of concurrent requests to send
+        @type poll_interval: float
+        @param poll_interval: seconds between polls when C{/wait} is missing
+        @type callback: callable or None
+        @param callback: called with the job id, the job status (or None) and
+                         the error (or None) as each job finishes
+        """
+
+        self._r = r
+        self.max_connections = max_connections
+        self.poll_interval = poll_interval
+        self.callback = callback
+
+        self.use_wait = True
+        self._lock = Lock()
+
+    def _step(self, tracker):
+        """
+        Check on a job once.
+
+        @rtype: dict or None
+        @return: the final job status, or None if the job isn't done yet
+        """
+
+        if self.use_wait:
+            try:
+                result = WaitForJobChange(self._r, tracker.job_id,
+                                          tracker.fields, tracker.job_info,
+                                          tracker.log_serial)
+            except NotOkayError, noe:
+                if noe.code not in NO_WAIT_CODES:
+                    raise
+                # Either the job doesn't exist, or the RAPI can't wait for
+                # it. If polling works, it was the latter.
+                job = GetJobStatus(self._r, tracker.job_id)
+                with self._lock:
+                    if self.use_wait:
+                        logging.info("RAPI cannot wait for jobs, polling")
+                        self.use_wait = False
+            else:
+                if tracker.changed(result):
+                    return GetJobStatus(self._r, tracker.job_id)
+                return None
+        else:
+            delay = tracker.next_poll - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            job = GetJobStatus(self._r, tracker.job_id)
+
+        if tracker.polled(job, self.poll_interval):
+            return job
+        return None
+
+    def _work(self, todo, done):
+        while True:
+            tracker = todo.get()
+            if tracker is None:
+                return
+
+            try:
+                job = self._step(tracker)
+            except Exception, e:
+                done.put((tracker.job_id, None, e))
+            else:
+                if job is None:
+                    todo.put(tracker)
+                else:
+                    done.put((tracker.job_id, job, None))
+
+    def iter(self, job_ids):
+        """
+        Wait for jobs, yielding each one as soon as it is finalized.
+
+        @type job_ids: list
+        @param job_ids: the jobs to wait for
+
+        @rtype: iterator of three-tuples
+        @return: the job id, the job status (or None) and the error which
+                 prevented it from being waited for (or None)
+        """
+
+        job_ids = list(job_ids)
+        todo = Queue()
+        done = Queue()
+
+        for job_id in job_ids:
+            todo.put(JobTracker(job_id))
+
+        workers = [Thread(target=self._work, args=(todo, done))
+                   for i in range(min(self.max_connections, len(job_ids)))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        try:
+            for i in range(len(job_ids)):
+                job_id, job, error = done.get()
+                if self.callback is not None:
+                    self.callback(job_id, job, error)
+                yield job_id, job, error
+        finally:
+            for worker in workers:
+                todo.put(None)
+
+    def wait(self, job_ids):
+        """
+        Wait for all of the jobs to be finalized.
+
+        @type job_ids: list
+        @param job_ids: the jobs to wait for
+
+        @rtype: two-tuple of dicts
+        @return: the final status of each job, and the error for each job
+                 which could not be waited for, both keyed by job id
+        """
+
+        results = {}
+        errors = {}
+
+        for job_id, job, error in self.iter(job_ids):
+            if error is None:
+                results[job_id] = job
+            else:
+                errors[job_id] = error
+
+        return results, errors
@@ -0,0 +1,325 @@
+"""
+Limiting the load that clients put on a cluster.
+
+The RAPI daemon, and the master daemon behind it, slow down badly when
+flooded with requests. A L{Limiter} caps the rate of requests with a token
+bucket for each class of endpoint, and optionally caps how many requests
+are in flight at once with an L{AdaptiveConcurrency}, which looks for the
+most concurrency the cluster can take before it starts to slow down.
+"""
+
+from collections import deque
+import math
+from threading import Event, Lock
+import time
+
+from gentleman.retry import unhealthy
+
+READ = "read"
+JOB = "job"
+
+
+def endpoint_class(method, path):
+    """
+    Classify a request as a read or a job submission.
+
+    Anything other than a GET submits a job, except for queries, which are
+    sent with PUT but only read.
+
+    @type method: str
+    @param method: HTTP method of the request
+    @type path: str
+    @param path: path, or full URL, of the request
+    @rtype: str
+    @return: L{READ} or L{JOB}
+    """
+
+    if method.lower() == "get" or "/2/query/" in path:
+        return READ
+    return JOB
+
+
+class TokenBucket(object):
+    """
+    A token bucket, allowing C{rate} requests per second on average, and
+    bursts of up to C{burst} requests.
+
+    Tokens are reserved rather than waited for, so that the bucket can be
+    shared by threads and by Twisted alike: whoever takes a token is told how
+    long to wait before using it, and requests go out in the order they
+    took their tokens.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        @type rate: float
+        @param rate: tokens added per second
+        @type burst: float or None
+        @param burst: the most tokens the bucket holds; defaults to C{rate},
+                      or 1, whichever is more
+        """
+
+        self.rate = float(rate)
+        self.burst = max(rate, 1) if burst is None else burst
+
+        self.tokens = self.burst
+        self._stamp = time.time()
+        self._lock = Lock()
+
+    def reserve(self):
+        """
+        Take a token.
+
+        @rtype: float
+        @return: seconds to wait before the token may be used
+        """
+
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+class AdaptiveConcurrency(object):
+    """
+    A limit on concurrent requests which follows the cluster's latency.
+
+    Each finished request reports how long it took. While latency stays near
+    the lowest seen, the limit grows by about the square root of itself for
+    each limit's worth of requests; once latency climbs past C{tolerance}
+    times that baseline, the limit shrinks in proportion. Failures which show
+    that the cluster is in trouble halve the limit at once.
+
+    The baseline creeps up towards the current latency, so that a cluster
+    which has become slower for good is not throttled forever.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, tolerance=1.5,
+                 smoothing=0.2, drift=0.01):
+        """
+        @type initial: int
+        @param initial: the limit to start with
+        @type minimum: int
+        @param minimum: the lowest the limit may go
+        @type maximum: int
+        @param maximum: the highest the limit may go
+        @type tolerance: float
+        @param tolerance: how much latency may grow past the baseline before
+                          the limit shrinks
+        @type smoothing: float
+        @param smoothing: weight given to each new latency measurement
+        @type drift: float
+        @param drift: how quickly the baseline follows latency upwards
+        """
+
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.drift = drift
+
+        self.inflight = 0
+        self.latency = None
+        self.baseline = None
+
+        self._waiters = deque()
+        self._lock = Lock()
+
+    def acquire(self, callback=None):
+        """
+        Take a slot for a request.
+
+        @type callback: callable or None
+        @param callback: called with no arguments once a slot is free,
+                         possibly right away; if None, block until then
+        """
+
+        with self._lock:
+            if not self._waiters and self.inflight < int(self.limit):
+                self.inflight += 1
+                event = None
+            elif callback is None:
+                event = Event()
+                self._waiters.append(event.set)
+            else:
+                self._waiters.append(callback)
+                return
+
+        if event is not None:
+            event.wait()
+        elif callback is not None:
+            callback()
+
+    def withdraw(self, callback):
+        """
+        Stop waiting for a slot.
+
+        @type callback: callable
+        @param callback: a callback passed to L{acquire}
+        @rtype: bool
+        @return: whether the callback was still waiting; if not, it has been
+                 given a slot, which must be released as usual
+        """
+
+        with self._lock:
+            try:
+                self._waiters.remove(callback)
+            except ValueError:
+                return False
+            return True
+
+    def release(self, latency, error=None):
+        """
+        Give back a slot, adjusting the limit.
+
+        @type latency: float or None
+        @param latency: how long the request took, in seconds; None if it
+                        was cancelled, which says nothing about the cluster
+        @type error: Exception or None
+        @param error: why the request failed, or None if it succeeded
+        """
+
+        with self._lock:
+            busy = self.inflight >= self.limit / 2
+            self.inflight -= 1
+
+            if latency is None:
+                pass
+            elif error is not None and unhealthy(error):
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self._measure(latency, busy)
+
+            ready = []
+            while self._waiters and self.inflight < int(self.limit):
+                self.inflight += 1
+                ready.append(self._waiters.popleft())
+
+        for callback in ready:
+            callback()
+
+    def _measure(self, latency, busy):
+        if self.latency is None:
+            self.latency = self.baseline = latency
+            return
+
+        self.latency += (latency - self.latency) * self.smoothing
+
+        if latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline += (self.latency - self.baseline) * self.drift
+
+        gradient = self.tolerance * self.baseline / max(self.latency, 1e-6)
+        gradient = max(0.5, min(1.0, gradient))
+
+        # Only grow if we're actually using the limit we've got.
+        headroom = math.sqrt(self.limit) if busy else 0
+        target = self.limit * gradient + headroom
+
+        limit = self.limit + (target - self.limit) * self.smoothing
+        self.limit = max(self.minimum, min(self.maximum, limit))
+
+    def stats(self):
+        """
+        @rtype: dict
+        @return: the current limit, requests in flight and waiting, and the
+                 smoothed and baseline latencies
+        """
+
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "inflight": self.inflight,
+                "waiting": len(self._waiters),
+                "latency": self.latency,
+                "baseline": self.baseline,
+            }
+
+
+class Limiter(object):
+    """
+    Limit the requests sent to one cluster.
+
+    Pass a limiter to a client's C{limiter} argument. Limits are meant to
+    protect a cluster, so one limiter should be shared by all clients
+    talking to the same cluster.
+    """
+
+    def __init__(self, reads=None, jobs=None, concurrency=None):
+        """
+        @type reads: L{TokenBucket} or None
+        @param reads: the rate limit for reads
+        @type jobs: L{TokenBucket} or None
+        @param jobs: the rate limit for job submissions
+        @type concurrency: L{AdaptiveConcurrency} or None
+        @param concurrency: the limit on requests in flight
+        """
+
+        self.buckets = {READ: reads, JOB: jobs}
+        self.concurrency = concurrency
+
+    def reserve(self, method, path):
+        """
+        Take a token for a request.
+
+        @rtype: float
+        @return: seconds to wait before sending the request
+        """
+
+        bucket = self.buckets[endpoint_class(method, path)]
+        if bucket is None:
+            return 0
+        return bucket.reserve()
+
+    def admit(self, callback=None):
+        """
+        Take a slot for a request which has waited out its token.
+
+        @type callback: callable or None
+        @param callback: called with no arguments once the request may be
+                         sent; if None, block until then
+        """
+
+        if self.concurrency is not None:
+            self.concurrency.acquire(callback)
+        elif callback is not None:
+            callback()
+
+    def withdraw(self, callback):
+        """
+        Give up on a request which is waiting to be admitted.
+
+        @see: L{AdaptiveConcurrency.withdraw}
+        """
+
+        if self.concurrency is not None:
+            return self.concurrency.withdraw(callback)
+        return False
+
+    def acquire(self, method, path):
+        """
+        Block until a request may be sent.
+        """
+
+        delay = self.reserve(method, path)
+        if delay:
+            time.sleep(delay)
+        self.admit()
+
+    def release(self, latency, error=None):
+        """
+        Report that a request has finished.
+
+        @see: L{AdaptiveConcurrency.release}
+        """
+
+        if self.concurrency is not None:
+            self.concurrency.release(latency, error)
@@ -0,0 +1,301 @@
+"""
+Instrumentation of RAPI requests.
+
+Clients take a list of hooks, each of which is called with a
+L{RequestRecord} as every call finishes. L{MetricsAggregator} is a hook which
+keeps latency histograms for each endpoint.
+"""
+
+from bisect import bisect_left
+import logging
+import sys
+from threading import Lock
+import time
+
+from gentleman.helpers import path_template
+
+log = logging.getLogger(__name__)
+
+# Phases of a request which are timed, in order.
+PHASES = "encode", "connect", "ttfb", "transfer", "decode"
+
+
+def calling_function():
+    """
+    Find the function in L{gentleman.base} which is making a request.
+
+    Functions in L{gentleman.base} call each other, such as C{GetInstance}
+    asking for some fields through C{Query}, so the outermost one is the
+    one which was called.
+
+    @rtype: str or None
+    @return: the function's name, or None if the request didn't come from
+             L{gentleman.base}
+    """
+
+    name = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_globals.get("__name__") == "gentleman.base":
+            name = frame.f_code.co_name
+        frame = frame.f_back
+    return name
+
+
+class RequestRecord(object):
+    """
+    What happened during one call to a client.
+
+    Timings are in seconds, and describe the last attempt if the request
+    was retried:
+
+     - C{encode}: encoding the request body
+     - C{connect}: opening a new connection, if one was needed
+     - C{ttfb}: waiting for the response headers, after connecting
+     - C{transfer}: receiving the response body
+     - C{decode}: decoding the response body
+
+    Streamed responses are decoded as they arrive; their decoding time is
+    not counted as transfer time. Calls which shared the response of an
+    identical call in flight are marked as C{coalesced}, and have only a
+    total time.
+    """
+
+    def __init__(self, method, path, function=None):
+        """
+        @type method: str
+        @param method: HTTP method of the request
+        @type path: str
+        @param path: path of the request
+        @type function: str or None
+        @param function: the L{gentleman.base} function which made the call
+        """
+
+        self.function = function
+        self.method = method.upper()
+        self.path = path_template(path)
+
+        self.status = None
+        self.error = None
+        self.attempts = 0
+        self.coalesced = False
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+        self.encode = 0.0
+        self.connect = 0.0
+        self.ttfb = 0.0
+        self.transfer = 0.0
+        self.decode = 0.0
+
+        self.started = time.time()
+        self.total = None
+
+    def __repr__(self):
+        return "<RequestRecord %s %s %s %.3fs>" % (self.method, self.path,
+                                                   self.status, self.total or 0)
+
+    def attempt(self):
+        """
+        Start timing another attempt.
+        """
+
+        self.attempts += 1
+        self.status = None
+        self.bytes_in = 0
+        for phase in PHASES:
+            setattr(self, phase, 0.0)
+
+    def finish(self, hooks, error=None):
+        """
+        Stop timing, and pass the record to each hook.
+
+        Hooks which raise are logged, and never break the request.
+
+        @type hooks: list of callables
+        @type error: Exception or None
+        @param error: why the call failed, or None if it succeeded
+        """
+
+        self.total = time.time() - self.started
+        self.error = error
+
+        if error is not None and self.status is None:
+            self.status = getattr(error, "code", None)
+
+        for hook in hooks:
+            try:
+                hook(self)
+            except Exception:
+                log.exception("Request hook %r failed", hook)
+
+
+class LatencyHistogram(object):
+    """
+    A histogram of latencies, with buckets growing by powers of two from
+    one millisecond to about a minute.
+    """
+
+    bounds = [0.001 * 2 ** i for i in range(17)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, p):
+        """
+        Estimate a percentile, as the upper bound of its bucket.
+
+        @type p: float
+        @param p: the percentile, from 0 to 100
+        @rtype: float or None
+        """
+
+        if not self.count:
+            return None
+
+        wanted = self.count * p / 100.0
+        seen = 0
+
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= wanted:
+                return min(bound, self.max)
+
+        return self.max
+
+    def buckets(self):
+        """
+        @rtype: list of two-tuples
+        @return: the upper bound and count of each bucket; the last bucket
+                 has no upper bound
+        """
+
+        return zip(self.bounds + [None], self.counts)
+
+
+class EndpointMetrics(object):
+    """
+    Everything recorded about one endpoint.
+    """
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.phases = dict((phase, 0.0) for phase in PHASES)
+        self.statuses = {}
+        self.functions = {}
+        self.errors = 0
+        self.coalesced = 0
+        self.attempts = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def add(self, record):
+        self.latency.add(record.total)
+        self.attempts += record.attempts
+        self.bytes_in += record.bytes_in
+        self.bytes_out += record.bytes_out
+
+        for phase in PHASES:
+            self.phases[phase] += getattr(record, phase)
+
+        self.statuses[record.status] = self.statuses.get(record.status, 0) + 1
+        if record.function is not None:
+            self.functions[record.function] = (
+                self.functions.get(record.function, 0) + 1)
+
+        if record.error is not None:
+            self.errors += 1
+        if record.coalesced:
+            self.coalesced += 1
+
+
+class MetricsAggregator(object):
+    """
+    A hook which keeps latency histograms for each endpoint, keyed by method
+    and path template.
+
+        >>> metrics = MetricsAggregator()
+        >>> r = RequestsRapiClient("cluster", hooks=[metrics])
+        >>> ...
+        >>> metrics.report()[0]
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self._lock = Lock()
+
+    def __call__(self, record):
+        key = record.method, record.path
+
+        with self._lock:
+            metrics = self.endpoints.get(key)
+            if metrics is None:
+                metrics = self.endpoints[key] = EndpointMetrics()
+            metrics.add(record)
+
+    def report(self):
+        """
+        Summarize each endpoint, slowest first.
+
+        @rtype: list of dicts
+        @return: for each endpoint, the method and path template; the number
+                 of calls, errors and coalesced calls; mean, median, 95th and
+                 99th percentile, and maximum latency; the mean time spent
+                 in each phase; total bytes in and out; and the number of
+                 calls made by each L{gentleman.base} function
+        """
+
+        rows = []
+
+        with self._lock:
+            for (method, path), metrics in self.endpoints.iteritems():
+                latency = metrics.latency
+                row = {
+                    "method": method,
+                    "path": path,
+                    "count": latency.count,
+                    "errors": metrics.errors,
+                    "coalesced": metrics.coalesced,
+                    "mean": latency.mean(),
+                    "p50": latency.percentile(50),
+                    "p95": latency.percentile(95),
+                    "p99": latency.percentile(99),
+                    "max": latency.max,
+                    "bytes_in": metrics.bytes_in,
+                    "bytes_out": metrics.bytes_out,
+                    "statuses": metrics.statuses.copy(),
+                    "functions": metrics.functions.copy(),
+                }
+                for phase in PHASES:
+                    row[phase] = metrics.phases[phase] / latency.count
+                rows.append(row)
+
+        rows.sort(key=lambda row: row["p95"], reverse=True)
+        return rows
+
+    def reset(self):
+        """
+        Forget everything recorded so far.
+        """
+
+        with self._lock:
+            self.endpoints.clear()
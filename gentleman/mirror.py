@@ -0,0 +1,192 @@
+"""
+An incrementally updated copy of a cluster's inventory.
+
+Polling the bulk listings to spot changes fetches every record of every
+object each time. An L{InventoryMirror} instead asks C{/2/query} for each
+object's name, serial number and modification time, and then fetches full
+records for just the objects which are new or have changed, so that the
+cost of a refresh follows how much has changed rather than how big the
+cluster is.
+
+Live state, such as whether an instance is running or how much memory a
+node has free, changes without bumping the serial number, so it would go
+stale unnoticed; those L{RUNTIME_FIELDS} aren't mirrored unless asked for.
+"""
+
+from gentleman.base import Query
+from gentleman.query import columnar
+
+ADDED = "added"
+CHANGED = "changed"
+REMOVED = "removed"
+
+_common_fields = ["ctime", "mtime", "uuid", "serial_no", "tags"]
+
+# The fields of each kind of resource which the RAPI's bulk listings return,
+# less the L{RUNTIME_FIELDS}.
+DEFAULT_FIELDS = {
+    "instance": [
+        "name", "admin_state", "os", "pnode", "snodes", "disk_template",
+        "nic.ips", "nic.macs", "nic.modes", "nic.uuids", "nic.names",
+        "nic.links", "nic.networks", "nic.networks.names", "nic.bridges",
+        "network_port", "disk.sizes", "disk.spindles", "disk_usage",
+        "disk.uuids", "disk.names", "beparams", "hvparams",
+        "custom_hvparams", "custom_beparams", "custom_nicparams",
+    ] + _common_fields,
+    "node": [
+        "name", "offline", "master_candidate", "drained", "dtotal",
+        "sptotal", "mtotal", "mnode", "ctotal", "cnos", "cnodes",
+        "csockets", "pip", "sip", "role", "master_capable", "vm_capable",
+        "ndparams", "group.uuid",
+    ] + _common_fields,
+    "group": [
+        "name", "alloc_policy", "node_cnt", "node_list", "ipolicy",
+        "custom_ipolicy", "diskparams", "custom_diskparams", "ndparams",
+        "custom_ndparams",
+    ] + _common_fields,
+}
+
+# Fields which change without the object's serial number changing: the live
+# state of instances, and what nodes have free and host. A mirror asked for
+# them only has them as they were when each object was last fetched.
+RUNTIME_FIELDS = {
+    "instance": ["oper_state", "oper_ram", "oper_vcpus", "status"],
+    "node": ["dfree", "mfree", "spfree", "pinst_cnt", "sinst_cnt",
+             "pinst_list", "sinst_list"],
+    "group": [],
+}
+
+# The fields which tell whether an object has changed.
+STAMP_FIELDS = ["name", "serial_no", "mtime"]
+
+
+class InventoryMirror(object):
+    """
+    A copy of the instances, nodes and groups of a cluster, kept up to date
+    by L{refresh}.
+
+    Works with any client; with the Twisted or futures clients, L{refresh}
+    returns a Deferred or a future. Refreshes must not overlap.
+    """
+
+    def __init__(self, r, kinds=("instance", "node", "group"), fields=None,
+                 callback=None):
+        """
+        @param r: the client to poll with
+        @type kinds: iterable of str
+        @param kinds: the kinds of resource to mirror
+        @type fields: dict or None
+        @param fields: the fields to fetch for each kind; defaults to
+                       L{DEFAULT_FIELDS}. Only changes to an object's
+                       serial number or modification time are noticed, so
+                       any of the L{RUNTIME_FIELDS} asked for here are only
+                       as fresh as the last time their object was fetched
+        @type callback: callable or None
+        @param callback: called with the event, the kind, the name and the
+                         record (the last one known, for removals) for
+                         every change seen
+        """
+
+        self._r = r
+        self.kinds = list(kinds)
+        self.fields = dict(DEFAULT_FIELDS)
+        if fields is not None:
+            self.fields.update(fields)
+        self.callback = callback
+
+        self.records = dict((kind, {}) for kind in self.kinds)
+        self._stamps = dict((kind, {}) for kind in self.kinds)
+
+        self.polls = 0
+        self.fetched = 0
+
+    def __getitem__(self, kind):
+        return self.records[kind]
+
+    def load(self, kind, records):
+        """
+        Start from records kept from earlier, such as in a snapshot, so that
+        the next refresh only fetches what has changed since.
+
+        @type kind: str
+        @param kind: the kind of resource
+        @type records: dict
+        @param records: the records, keyed by name; each must have its
+                        C{serial_no} and C{mtime}
+        """
+
+        self.records[kind] = dict(records)
+        self._stamps[kind] = dict(
+            (name, (record.get("serial_no"), record.get("mtime")))
+            for name, record in records.iteritems())
+
+    def refresh(self):
+        """
+        Bring the mirror up to date.
+
+        @rtype: list of four-tuples
+        @return: the event, kind, name and record of every change seen,
+                 which are also passed to the callback
+        """
+
+        return self._refresh(list(self.kinds), [])
+
+    def _refresh(self, kinds, events):
+        if not kinds:
+            return self._r.succeed(events)
+
+        kind = kinds.pop(0)
+        d = Query(self._r, kind, STAMP_FIELDS)
+        d = self._r.applier(lambda result: self._compare(kind, result, events),
+                            d)
+        return self._r.applier(lambda _: self._refresh(kinds, events), d)
+
+    def _compare(self, kind, result, events):
+        self.polls += 1
+
+        columns = columnar(result)
+        stamps = dict((name, (serial_no, mtime)) for name, serial_no, mtime
+                      in zip(columns["name"], columns["serial_no"],
+                             columns["mtime"]))
+
+        known = self._stamps[kind]
+        for name in set(known) - set(stamps):
+            del known[name]
+            self._emit(events, REMOVED, kind, name,
+                       self.records[kind].pop(name))
+
+        stale = [name for name, stamp in stamps.iteritems()
+                 if known.get(name) != stamp]
+        if not stale:
+            return None
+
+        if len(stale) > len(stamps) / 2:
+            # Most of it, so fetching everything is cheaper than a filter
+            # naming each object.
+            qfilter = None
+        else:
+            qfilter = ["|"] + [["=", "name", name] for name in stale]
+
+        d = Query(self._r, kind, self.fields[kind], qfilter)
+        return self._r.applier(
+            lambda result: self._update(kind, result, set(stale), events), d)
+
+    def _update(self, kind, result, stale, events):
+        known = self._stamps[kind]
+        records = self.records[kind]
+
+        for record in columnar(result).rows():
+            name = record["name"]
+            if name not in stale:
+                continue
+
+            self.fetched += 1
+            event = CHANGED if name in records else ADDED
+            known[name] = record.get("serial_no"), record.get("mtime")
+            records[name] = record
+            self._emit(events, event, kind, name, record)
+
+    def _emit(self, events, event, kind, name, record):
+        events.append((event, kind, name, record))
+        if self.callback is not None:
+            self.callback(event, kind, name, record)
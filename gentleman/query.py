@@ -0,0 +1,145 @@
+"""
+Decoding of /2/query results.
+
+Query results are a list of rows, each of which is a list of
+[status, value] cells. This module turns them around into one compact
+column per field, along with a mask holding the status of every cell.
+"""
+
+from array import array
+
+# Result status of each cell; only RS_NORMAL cells carry a value.
+RS_NORMAL = 0
+RS_UNKNOWN = 1
+RS_NODATA = 2
+RS_UNAVAIL = 3
+RS_OFFLINE = 4
+
+# Typecodes for field kinds which can be packed into arrays.
+_kind_typecodes = {
+    "bool": "b",
+    "number": "l",
+    "unit": "l",
+    "timestamp": "d",
+}
+
+
+class QueryColumns(object):
+    """
+    A query result, stored column by column.
+
+    Numeric, unit, timestamp and boolean fields are packed into arrays, in
+    which cells that have no value hold zero; all other fields are lists, in
+    which cells that have no value hold None. The status of every cell is
+    kept in a bytearray per field.
+    """
+
+    def __init__(self, fields, columns, masks, length):
+        """
+        @type fields: list of dict
+        @param fields: field definitions, as returned by the RAPI
+        @type columns: dict
+        @param columns: values of each field, keyed by field name
+        @type masks: dict of bytearray
+        @param masks: status of each cell, keyed by field name
+        @type length: int
+        @param length: number of rows
+        """
+
+        self.fields = fields
+        self.names = [field["name"] for field in fields]
+        self.columns = columns
+        self.masks = masks
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def valid(self, name):
+        """
+        Get the values of a field which have a normal status.
+
+        @type name: str
+        @param name: field name
+        @rtype: list
+        """
+
+        mask = self.masks[name]
+        column = self.columns[name]
+
+        if not mask.strip(b"\x00"):
+            return list(column)
+        return [value for status, value in zip(mask, column)
+                if status == RS_NORMAL]
+
+    def row(self, index):
+        """
+        Get a single row as a dict.
+
+        Cells without a normal status are left out.
+
+        @type index: int
+        @param index: row number
+        @rtype: dict
+        """
+
+        return dict((name, self.columns[name][index]) for name in self.names
+                    if self.masks[name][index] == RS_NORMAL)
+
+    def rows(self):
+        """
+        Iterate over all rows as dicts.
+
+        @see: L{row}
+        """
+
+        for index in range(self._length):
+            yield self.row(index)
+
+
+def columnar(result):
+    """
+    Decode a /2/query result into columns.
+
+    @type result: dict
+    @param result: a result from L{gentleman.base.Query}
+    @rtype: L{QueryColumns}
+    """
+
+    fields = result["fields"]
+    data = result["data"]
+    columns = {}
+    masks = {}
+
+    if data:
+        transposed = zip(*data)
+    else:
+        transposed = [()] * len(fields)
+
+    for field, cells in zip(fields, transposed):
+        name = field["name"]
+        mask = bytearray(cell[0] for cell in cells)
+        values = [cell[1] for cell in cells]
+
+        typecode = _kind_typecodes.get(field.get("kind"))
+
+        if typecode is not None:
+            try:
+                if mask.strip(b"\x00"):
+                    values = [value if status == RS_NORMAL else 0
+                              for status, value in zip(mask, values)]
+                values = array(typecode, values)
+            except (TypeError, OverflowError):
+                # Not what it said on the tin; keep it as a list.
+                pass
+        elif mask.strip(b"\x00"):
+            values = [value if status == RS_NORMAL else None
+                      for status, value in zip(mask, values)]
+
+        columns[name] = values
+        masks[name] = mask
+
+    return QueryColumns(fields, columns, masks, len(data))
@@ -0,0 +1,231 @@
+"""
+Retrying requests, and failing fast while the RAPI is unhealthy.
+"""
+
+import random
+from threading import Lock
+import time
+
+from gentleman.errors import GanetiApiError, NotOkayError
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header.
+
+    @type value: str or None
+    @param value: the header, either in seconds or as an HTTP date
+    @rtype: float or None
+    @return: seconds to wait, or None if there was no usable header
+    """
+
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    # The email package is slow to import, and dates are rare here.
+    from email.utils import mktime_tz, parsedate_tz
+
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+
+    return max(mktime_tz(date) - time.time(), 0)
+
+
+def unhealthy(error):
+    """
+    Decide whether an error means that the RAPI itself is in trouble.
+
+    Failing to connect, and server errors, count; other responses, such as
+    404, show that the RAPI is up and answering.
+
+    @type error: Exception
+    @rtype: bool
+    """
+
+    if isinstance(error, NotOkayError):
+        return error.code is None or error.code >= 500
+
+    return isinstance(error, GanetiApiError)
+
+
+class RetryPolicy(object):
+    """
+    When and how long to wait before retrying a failed request.
+
+    Only idempotent requests are retried, and only when the RAPI could not
+    be reached or answered with one of the retryable status codes, as it
+    does while the master is failing over or restarting.
+    """
+
+    def __init__(self, attempts=4, backoff=0.5, max_backoff=30, jitter=0.5,
+                 codes=(502, 503, 504), methods=("get",)):
+        """
+        @type attempts: int
+        @param attempts: how many times to try a request, including the first
+        @type backoff: float
+        @param backoff: seconds to wait before the first retry; doubled for
+                        each retry after that
+        @type max_backoff: float
+        @param max_backoff: the longest to wait before any retry
+        @type jitter: float
+        @param jitter: the fraction of each wait which is randomized, so
+                       that many clients don't retry in lockstep
+        @type codes: iterable of int
+        @param codes: HTTP status codes worth retrying
+        @type methods: iterable of str
+        @param methods: HTTP methods which are safe to retry
+        """
+
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.codes = frozenset(codes)
+        self.methods = frozenset(method.lower() for method in methods)
+
+    def retryable(self, method, error, attempt):
+        """
+        Decide whether to retry a failed request.
+
+        @type method: str
+        @param method: HTTP method of the request
+        @type error: Exception
+        @param error: why the request failed
+        @type attempt: int
+        @param attempt: how many times the request has been tried
+        @rtype: bool
+        """
+
+        if attempt >= self.attempts or method.lower() not in self.methods:
+            return False
+
+        if isinstance(error, NotOkayError):
+            return error.code in self.codes
+
+        # Couldn't connect at all.
+        return isinstance(error, GanetiApiError)
+
+    def delay(self, attempt, error=None):
+        """
+        Compute how long to wait before the next try.
+
+        @type attempt: int
+        @param attempt: how many times the request has been tried
+        @type error: Exception or None
+        @param error: why the request failed; a Retry-After time on it is
+                      honored, up to the maximum backoff
+        @rtype: float
+        @return: seconds to wait
+        """
+
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+
+class CircuitBreaker(object):
+    """
+    Fail fast while a cluster's RAPI is unhealthy.
+
+    After C{threshold} consecutive unhealthy failures the circuit opens and
+    requests are refused without being sent. Once C{reset_timeout} seconds
+    have passed, a single request is let through as a probe; if it works,
+    the circuit closes again, and if not, it stays open for another
+    C{reset_timeout} seconds.
+
+    One breaker should be shared by all clients talking to the same cluster.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        """
+        @type threshold: int
+        @param threshold: consecutive failures before the circuit opens
+        @type reset_timeout: float
+        @param reset_timeout: seconds to wait before probing an open circuit
+        """
+
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened = None
+        self._lock = Lock()
+
+    def allow(self):
+        """
+        Decide whether a request may be sent.
+
+        @rtype: bool
+        """
+
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if (self.state == self.OPEN and
+                time.time() >= self._opened + self.reset_timeout):
+                self.state = self.HALF_OPEN
+                return True
+
+            return False
+
+    def success(self):
+        """
+        Record that the RAPI answered.
+        """
+
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def failure(self):
+        """
+        Record that the RAPI could not be reached or failed.
+        """
+
+        with self._lock:
+            self.failures += 1
+
+            if (self.state == self.HALF_OPEN or
+                self.failures >= self.threshold):
+                self.state = self.OPEN
+                self._opened = time.time()
+
+    def abandon(self):
+        """
+        Record that a request was given up on before the RAPI answered.
+
+        This says nothing about the RAPI; but if the request was the probe,
+        another request may probe in its place.
+        """
+
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def record(self, error=None):
+        """
+        Record the outcome of a request.
+
+        @type error: Exception or None
+        @param error: why the request failed, or None if it succeeded
+        """
+
+        if error is not None and unhealthy(error):
+            self.failure()
+        else:
+            self.success()
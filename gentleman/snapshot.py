@@ -0,0 +1,281 @@
+"""
+Cluster inventory saved on disk.
+
+Tools which only read, such as one answering which node an instance is on,
+shouldn't have to download a cluster's whole inventory every time they run.
+An L{InventorySnapshot} keeps the instances, nodes and groups of a cluster
+in an SQLite database, along with the cluster's identity and every object's
+serial number, and answers lookups straight from it.
+
+L{InventorySnapshot.revalidate} applies a freshness policy: a snapshot
+younger than C{max_age} is used as it is; an older one is still used, but
+brought up to date in the background, unless it is older than
+C{max_stale}, in which case it is brought up to date first. A tool which
+exits before a background refresh is done leaves it to its next run.
+Bringing it up to date only fetches what has changed, with an
+L{gentleman.mirror.InventoryMirror}.
+"""
+
+import logging
+import sqlite3
+from threading import Thread
+import time
+
+from gentleman.base import GetInfo
+from gentleman.codec import default_codec
+from gentleman.mirror import REMOVED, InventoryMirror
+
+# Bumped whenever the tables change, which throws away older snapshots.
+SCHEMA_VERSION = 1
+
+_schema = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS objects (
+    kind TEXT,
+    name TEXT,
+    serial_no INTEGER,
+    mtime REAL,
+    record BLOB,
+    PRIMARY KEY (kind, name)
+);
+"""
+
+KINDS = ("instance", "node", "group")
+
+
+def identity(info):
+    """
+    Tell clusters apart by the information from L{GetInfo}.
+
+    A cluster which is torn down and set up again under the same name is a
+    different cluster, with a different UUID and creation time.
+
+    @type info: dict
+    @rtype: list
+    """
+
+    return [info.get("name"), info.get("uuid"), info.get("ctime")]
+
+
+class InventorySnapshot(object):
+    """
+    The inventory of one cluster, in an SQLite database.
+
+    Each snapshot object holds its own connection to the database, so it
+    must only be used from the thread which made it; background
+    revalidation opens a connection of its own.
+    """
+
+    def __init__(self, path, codec=None):
+        """
+        @type path: str
+        @param path: where to keep the database
+        @type codec: L{gentleman.codec.Codec} or None
+        @param codec: the JSON codec for stored records
+        """
+
+        self.path = path
+        self.codec = codec or default_codec()
+
+        self._db = sqlite3.connect(path, timeout=30)
+        # Readers carry on while another process or thread writes.
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_schema)
+
+        if self.meta("schema") != SCHEMA_VERSION:
+            with self._db:
+                self._db.execute("DELETE FROM objects")
+                self._db.execute("DELETE FROM meta")
+                self._set_meta("schema", SCHEMA_VERSION)
+
+    def close(self):
+        self._db.close()
+
+    def meta(self, key):
+        """
+        Get something known about the snapshot as a whole.
+
+        @type key: str
+        @param key: "cluster" for the identity of the cluster, or "saved" for
+                    when the snapshot was last brought up to date
+        @return: the value, or None if there is none
+        """
+
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?",
+                               (key,)).fetchone()
+        if row is None:
+            return None
+        return self.codec.loads(row[0])
+
+    def _set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                         (key, self.codec.dumps(value)))
+
+    def age(self):
+        """
+        @rtype: float or None
+        @return: seconds since the snapshot was last brought up to date, or
+                 None if it never has been
+        """
+
+        saved = self.meta("saved")
+        if saved is None:
+            return None
+        return max(time.time() - saved, 0)
+
+    def get(self, kind, name):
+        """
+        Look up one object.
+
+        @type kind: str
+        @param kind: "instance", "node" or "group"
+        @type name: str
+        @param name: the object's name
+        @rtype: dict or None
+        @return: the object's record, or None if there's no such object
+        """
+
+        row = self._db.execute("SELECT record FROM objects "
+                               "WHERE kind = ? AND name = ?",
+                               (kind, name)).fetchone()
+        if row is None:
+            return None
+        return self.codec.loads(str(row[0]))
+
+    def names(self, kind):
+        """
+        @type kind: str
+        @rtype: list of str
+        @return: the names of every object of a kind
+        """
+
+        return [row[0] for row in
+                self._db.execute("SELECT name FROM objects WHERE kind = ? "
+                                 "ORDER BY name", (kind,))]
+
+    def records(self, kind):
+        """
+        @type kind: str
+        @rtype: dict
+        @return: the record of every object of a kind, keyed by name
+        """
+
+        return dict((name, self.codec.loads(str(record))) for name, record in
+                    self._db.execute("SELECT name, record FROM objects "
+                                     "WHERE kind = ?", (kind,)))
+
+    def _stamps(self, kind):
+        return dict((name, {"name": name, "serial_no": serial_no,
+                            "mtime": mtime})
+                    for name, serial_no, mtime in
+                    self._db.execute("SELECT name, serial_no, mtime "
+                                     "FROM objects WHERE kind = ?", (kind,)))
+
+    def update(self, r, kinds=KINDS):
+        """
+        Bring the snapshot up to date.
+
+        If the snapshot is of the same cluster, only objects which have
+        changed are fetched; otherwise, it is replaced.
+
+        @param r: a blocking client
+        @type kinds: iterable of str
+        @param kinds: the kinds of resource to keep; objects of any other
+                      kind are dropped from the snapshot
+        @rtype: list of four-tuples
+        @return: the changes found, as from
+                 L{gentleman.mirror.InventoryMirror.refresh}; the records of
+                 removed objects only hold their name, serial number and
+                 modification time
+        """
+
+        cluster = identity(GetInfo(r))
+        same = cluster == self.meta("cluster")
+
+        mirror = InventoryMirror(r, kinds)
+        if same:
+            for kind in mirror.kinds:
+                # Telling what has changed only takes the stamps, which are
+                # much cheaper to load than whole records.
+                mirror.load(kind, self._stamps(kind))
+
+        events = mirror.refresh()
+
+        with self._db:
+            if same:
+                for event, kind, name, record in events:
+                    if event == REMOVED:
+                        self._db.execute("DELETE FROM objects "
+                                         "WHERE kind = ? AND name = ?",
+                                         (kind, name))
+                    else:
+                        self._store(kind, name, record)
+                # Kinds which are no longer kept would otherwise look as
+                # fresh as the rest.
+                self._db.execute("DELETE FROM objects WHERE kind NOT IN "
+                                 "(%s)" % ", ".join("?" * len(mirror.kinds)),
+                                 mirror.kinds)
+            else:
+                self._db.execute("DELETE FROM objects")
+                for kind in mirror.kinds:
+                    for name, record in mirror[kind].iteritems():
+                        self._store(kind, name, record)
+
+            self._set_meta("cluster", cluster)
+            self._set_meta("saved", time.time())
+
+        return events
+
+    def _store(self, kind, name, record):
+        self._db.execute("INSERT OR REPLACE INTO objects VALUES "
+                         "(?, ?, ?, ?, ?)",
+                         (kind, name, record.get("serial_no"),
+                          record.get("mtime"),
+                          buffer(self.codec.dumps(record))))
+
+    def revalidate(self, r, max_age=60, max_stale=3600, kinds=KINDS):
+        """
+        Bring the snapshot up to date as far as the freshness policy asks.
+
+        @param r: a blocking client which may be shared between threads
+        @type max_age: float
+        @param max_age: seconds for which a snapshot is used as it is
+        @type max_stale: float
+        @param max_stale: seconds for which a snapshot is used while it is
+                          brought up to date in the background
+        @type kinds: iterable of str
+        @param kinds: the kinds of resource to keep
+
+        @rtype: L{Thread} or None
+        @return: the thread bringing the snapshot up to date, if any. It's
+                 a daemon, so a tool which exits first doesn't wait for the
+                 RAPI; the refresh is then dropped without saving anything,
+                 and the next run, finding the snapshot just as old, tries
+                 again. Join the thread to wait for it instead.
+        """
+
+        age = self.age()
+
+        if age is not None and age < max_age:
+            return None
+
+        if age is None or age >= max_stale:
+            self.update(r, kinds)
+            return None
+
+        thread = Thread(target=self._revalidate, args=(r, kinds))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _revalidate(self, r, kinds):
+        snapshot = InventorySnapshot(self.path, self.codec)
+        try:
+            snapshot.update(r, kinds)
+        except Exception:
+            logging.exception("Couldn't bring %s up to date" % self.path)
+        finally:
+            snapshot.close()
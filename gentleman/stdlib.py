@@ -0,0 +1,556 @@
+"""
+Ganeti RAPI client using only the standard library.
+
+This client keeps one persistent HTTPS connection to the cluster master, and
+needs nothing beyond Python itself, which suits small agents which poll the
+RAPI often, such as those running on every node.
+"""
+
+from base64 import b64encode
+from httplib import HTTPException, HTTPSConnection
+import logging
+import socket
+from threading import Lock
+import time
+from urllib import urlencode
+
+from gentleman.codec import default_codec
+from gentleman.errors import (CertificateError, CircuitOpenError,
+                              ClientError, GanetiApiError, NotOkayError)
+from gentleman.helpers import prepare_query
+from gentleman.metrics import RequestRecord, calling_function
+from gentleman.retry import parse_retry_after
+from gentleman.stream import JsonStreamDecoder
+from gentleman.tls import options_for
+
+headers = [
+    ("accept", "application/json"),
+    ("content-type", "application/json"),
+    ("user-agent", "Ganeti RAPI Client (stdlib)"),
+]
+
+_stream_chunk_size = 64 * 1024
+
+
+class _Stale(Exception):
+    """
+    A reused connection failed before the request could have been acted on.
+
+    The master most likely closed it while it sat idle, and the request can
+    safely be sent again on a new connection: either it failed before it was
+    all sent, or it was a GET.
+    """
+
+
+class StdlibRapiClient(object):
+    """
+    Ganeti RAPI client using httplib as its backend.
+
+    The client may be shared between threads, which take turns using its
+    connection.
+    """
+
+    version = None
+    features = []
+
+    def __init__(self, host, port=5080, username=None, password=None,
+                 timeout=60, idle_timeout=None, retry=None, breaker=None,
+                 limiter=None, hooks=None, codec=None, tls=None):
+        """
+        Initializes this class.
+
+        @type host: string
+        @param host: the ganeti cluster master to interact with
+        @type port: int
+        @param port: the port on which the RAPI is running (default is 5080)
+        @type username: string
+        @param username: the username to connect with
+        @type password: string
+        @param password: the password to connect with
+        @type idle_timeout: float or None
+        @param idle_timeout: seconds after which an idle connection is closed
+                             instead of reused (None to always reuse it)
+        @type retry: L{gentleman.retry.RetryPolicy} or None
+        @param retry: when to retry failed requests
+        @type breaker: L{gentleman.retry.CircuitBreaker} or None
+        @param breaker: the circuit breaker for this cluster
+        @type limiter: L{gentleman.limit.Limiter} or None
+        @param limiter: the limiter for this cluster
+        @type hooks: list of callables
+        @param hooks: called with a L{gentleman.metrics.RequestRecord} as
+                      each request finishes
+        @type codec: L{gentleman.codec.Codec} or None
+        @param codec: the JSON codec for bodies; defaults to the fastest
+                      installed
+        @type tls: L{gentleman.tls.TLSOptions} or None
+        @param tls: how to secure connections; defaults to the cluster's
+                    shared options, which don't verify certificates
+        """
+
+        if username is not None and password is None:
+            raise ClientError("Password not specified")
+        elif password is not None and username is None:
+            raise ClientError("Specified password without username")
+
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        try:
+            socket.inet_pton(socket.AF_INET6, host)
+            address = "[%s]:%s" % (host, port)
+        except (socket.error, ValueError):
+            address = "%s:%s" % (host, port)
+
+        self._base_url = "https://%s" % address
+
+        self.idle_timeout = idle_timeout
+        self.retry = retry
+        self.breaker = breaker
+        self.limiter = limiter
+        self.hooks = list(hooks or [])
+        self.codec = codec or default_codec()
+
+        # Every header but the content length is the same for every request,
+        # so they are all put together once, here.
+        self._headers = [("host", address)] + headers
+        if username and password:
+            encoded = b64encode("%s:%s" % (username, password))
+            self._headers.append(("authorization", "Basic %s" % encoded))
+
+        self.tls = tls or options_for(host, port)
+
+        self._lock = Lock()
+        self._connection = None
+        self._last_used = None
+        self._requests = 0
+        self._created = 0
+        self._reconnects = 0
+
+
+    def request(self, method, path, query=None, content=None):
+        """
+        Sends an HTTP request.
+
+        This constructs a full URL, encodes and decodes HTTP bodies, and
+        handles invalid responses in a pythonic way.
+
+        @type method: string
+        @param method: HTTP method to use
+        @type path: string
+        @param path: HTTP URL path
+        @type query: dict
+        @param query: query arguments
+        @type content: str or None
+        @param content: HTTP body content
+
+        @rtype: object
+        @return: JSON-Decoded response
+
+        @raises GanetiApiError: If an invalid response is returned
+        """
+
+        return self._request(method, path, query, content,
+                             self._record(method, path))
+
+
+    def _record(self, method, path):
+        if self.hooks:
+            return RequestRecord(method, path, calling_function())
+
+
+    def _request(self, method, path, query, content, record):
+        try:
+            with self._lock:
+                body = self._send(method, path, query, content,
+                                  record=record)
+
+            started = time.time()
+            if body:
+                result = self.codec.loads(body)
+            else:
+                result = None
+            decoded = time.time()
+        except Exception, e:
+            if record is not None:
+                record.finish(self.hooks, e)
+            raise
+
+        if record is not None:
+            record.decode = decoded - started
+            record.finish(self.hooks)
+
+        return result
+
+
+    def stream(self, method, path, query=None, content=None, callback=None):
+        """
+        Sends an HTTP request, decoding a JSON array response as it arrives.
+
+        Without a callback, the connection is held by the returned iterator
+        until it is exhausted or closed.
+
+        @type method: string
+        @param method: HTTP method to use
+        @type path: string
+        @param path: HTTP URL path
+        @type query: dict
+        @param query: query arguments
+        @type content: str or None
+        @param content: HTTP body content
+        @type callback: callable or None
+        @param callback: if given, called with each element of the response
+
+        @rtype: iterator, or int if a callback was given
+        @return: the elements of the response, one at a time, or the number
+                 of elements passed to the callback
+
+        @raises GanetiApiError: If an invalid response is returned
+        """
+
+        return self._stream(method, path, query, content, callback,
+                            self._record(method, path))
+
+
+    def _stream(self, method, path, query, content, callback, record):
+        self._lock.acquire()
+
+        try:
+            response = self._send(method, path, query, content, stream=True,
+                                  record=record)
+        except Exception, e:
+            self._lock.release()
+            if record is not None:
+                record.finish(self.hooks, e)
+            raise
+
+        items = self._iter_response(response, record)
+        # Enter the iterator, so that the lock is released even if it is
+        # thrown away without being used.
+        next(items)
+
+        if callback is None:
+            return items
+
+        count = 0
+        for item in items:
+            callback(item)
+            count += 1
+        return count
+
+
+    def _iter_response(self, response, record=None):
+        pending = []
+        decoder = JsonStreamDecoder(pending.append, self.codec.loads)
+        error = None
+
+        try:
+            yield
+
+            while True:
+                started = time.time()
+                chunk = self._read(response, _stream_chunk_size)
+                if not chunk:
+                    break
+                received = time.time()
+
+                decoder.feed(chunk)
+
+                if record is not None:
+                    record.transfer += received - started
+                    record.decode += time.time() - received
+                    record.bytes_in += len(chunk)
+
+                for item in pending:
+                    yield item
+                del pending[:]
+
+            decoder.close()
+            for item in pending:
+                yield item
+        except Exception, e:
+            error = e
+            raise
+        finally:
+            if not response.isclosed():
+                # Abandoned part way through; the rest of the response is
+                # still on the wire.
+                self._disconnect()
+            elif response.will_close:
+                self._disconnect()
+            self._lock.release()
+            if record is not None:
+                record.finish(self.hooks, error)
+
+
+    def _send(self, method, path, query, content, stream=False, record=None):
+        attempt = 0
+
+        while True:
+            if self.breaker is not None and not self.breaker.allow():
+                raise CircuitOpenError("Not contacting %s while it is failing"
+                                       % self._base_url)
+
+            attempt += 1
+            if record is not None:
+                record.attempt()
+
+            try:
+                r = self._send_limited(method, path, query, content, stream,
+                                       record)
+            except GanetiApiError, e:
+                if self.breaker is not None:
+                    self.breaker.record(e)
+                if (self.retry is None or
+                    not self.retry.retryable(method, e, attempt)):
+                    raise
+                time.sleep(self.retry.delay(attempt, e))
+            except Exception:
+                if self.breaker is not None:
+                    self.breaker.failure()
+                raise
+            else:
+                if self.breaker is not None:
+                    self.breaker.record()
+                return r
+
+
+    def _send_limited(self, method, path, query, content, stream, record):
+        if self.limiter is None:
+            return self._send_once(method, path, query, content, stream,
+                                   record)
+
+        self.limiter.acquire(method, path)
+        started = time.time()
+
+        try:
+            r = self._send_once(method, path, query, content, stream, record)
+        except Exception, e:
+            self.limiter.release(time.time() - started, e)
+            raise
+
+        self.limiter.release(time.time() - started)
+        return r
+
+
+    def _send_once(self, method, path, query, content, stream, record=None):
+        started = time.time()
+        data = None
+        if content is not None:
+            data = self.codec.dumps(content)
+        encoded = time.time()
+
+        url = path
+        if query:
+            prepare_query(query)
+            url += "?" + urlencode(query, doseq=True)
+
+        try:
+            response, connect = self._exchange(method.upper(), url, data)
+        except _Stale:
+            self._reconnects += 1
+            response, connect = self._exchange(method.upper(), url, data)
+
+        received = time.time()
+
+        if record is not None:
+            record.status = response.status
+            record.bytes_out = len(data or "")
+            record.encode = encoded - started
+            record.connect = connect
+            record.ttfb = received - encoded - connect
+
+        if response.status != 200:
+            # Read the error body, so that the connection may be reused.
+            self._finish(response)
+            retry_after = parse_retry_after(response.getheader("retry-after"))
+            raise NotOkayError(str(response.status), code=response.status,
+                               retry_after=retry_after)
+
+        if stream:
+            return response
+
+        body = self._finish(response)
+
+        if record is not None:
+            record.transfer = time.time() - received
+            record.bytes_in = len(body)
+
+        return body
+
+
+    def _exchange(self, method, url, data):
+        """
+        Send a request on the connection, opening one if needed.
+
+        @rtype: two-tuple
+        @return: the response, with its headers read, and the time spent
+                 connecting
+
+        @raises _Stale: if a reused connection had gone stale, and the
+                        request may be sent again
+        """
+
+        now = time.time()
+        self._requests += 1
+
+        if (self._connection is not None and self.idle_timeout is not None
+            and now - self._last_used > self.idle_timeout):
+            self._disconnect()
+
+        self._last_used = now
+        connect = 0.0
+        reused = self._connection is not None
+
+        if not reused:
+            self._connection = HTTPSConnection(self.host, self.port,
+                                               timeout=self.timeout)
+            self._created += 1
+
+            try:
+                sock = socket.create_connection((self.host, self.port),
+                                                self.timeout)
+                # Requests are small and written all at once; don't wait on
+                # delayed ACKs for them.
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self._connection.sock = self.tls.wrap(sock)
+            except CertificateError:
+                self._disconnect()
+                raise
+            except socket.timeout:
+                self._disconnect()
+                raise GanetiApiError("Timed out connecting to %s" %
+                                     self._base_url)
+            except (socket.error, HTTPException):
+                self._disconnect()
+                raise GanetiApiError("Couldn't connect to %s" %
+                                     self._base_url)
+
+            connect = time.time() - now
+
+        connection = self._connection
+
+        try:
+            connection.putrequest(method, url, skip_host=True,
+                                  skip_accept_encoding=True)
+            for name, value in self._headers:
+                connection.putheader(name, value)
+            if data is not None:
+                connection.putheader("content-length", str(len(data)))
+            connection.endheaders(data)
+        except socket.timeout:
+            self._disconnect()
+            raise GanetiApiError("Timed out waiting for %s" % self._base_url)
+        except (socket.error, HTTPException):
+            self._disconnect()
+            if reused:
+                raise _Stale()
+            raise GanetiApiError("Couldn't connect to %s" % self._base_url)
+
+        try:
+            response = connection.getresponse()
+        except socket.timeout:
+            self._disconnect()
+            raise GanetiApiError("Timed out waiting for %s" % self._base_url)
+        except (socket.error, HTTPException):
+            self._disconnect()
+            # The master may already have acted on the request; only a GET
+            # is safe to send twice.
+            if reused and method == "GET":
+                raise _Stale()
+            raise GanetiApiError("Lost connection to %s before it answered" %
+                                 self._base_url)
+
+        return response, connect
+
+
+    def _read(self, response, amount=None):
+        try:
+            return response.read(amount)
+        except (socket.error, HTTPException):
+            self._disconnect()
+            raise GanetiApiError("Couldn't read response from %s" %
+                                 self._base_url)
+
+
+    def _finish(self, response):
+        """
+        Read the rest of a response, and give up the connection if the
+        master is closing it.
+        """
+
+        body = self._read(response)
+        if response.will_close:
+            self._disconnect()
+        return body
+
+
+    def _disconnect(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+    def pool_stats(self):
+        """
+        Report on connection reuse.
+
+        @rtype: dict
+        @return: number of requests sent, connections created, requests which
+                 reused a connection, idle connections currently open, and
+                 stale connections replaced
+        """
+
+        return {
+            "requests": self._requests,
+            "created": self._created,
+            "reused": max(self._requests - self._created, 0),
+            "idle": int(self._connection is not None),
+            "reconnects": self._reconnects,
+        }
+
+
+    def close(self):
+        """
+        Close the connection.
+        """
+
+        with self._lock:
+            self._disconnect()
+
+
+    @staticmethod
+    def applier(f, a):
+        return f(a)
+
+
+    @staticmethod
+    def succeed(a):
+        return a
+
+
+    def start(self):
+        """
+        Confirm that we may access the target cluster.
+        """
+
+        version = self.request("get", "/version")
+
+        if version != 2:
+            raise GanetiApiError("Can't work with Ganeti RAPI version %d" %
+                                 version)
+
+        logging.info("Accessing Ganeti RAPI, version %d" % version)
+        self.version = version
+
+        try:
+            features = self.request("get", "/2/features")
+        except NotOkayError, noe:
+            if noe.code == 404:
+                # Older RAPIs have no list of features.
+                features = []
+            else:
+                raise
+
+        logging.info("RAPI features: %r" % (features,))
+        self.features = features
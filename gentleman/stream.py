@@ -0,0 +1,242 @@
+"""
+Incremental decoding of JSON response bodies.
+"""
+
+import json
+import re
+
+_whitespace = re.compile(r"[ \t\n\r]*")
+# A scalar element ends where the next delimiter begins.
+_scalar_end = re.compile(r"[ \t\n\r,\]]")
+# Inside a compound element, everything up to the next bracket, or to the
+# quote opening a string which isn't all here yet.
+_skip = re.compile(r'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+# The rest of a string, up to its closing quote.
+_string_end = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+
+class JsonStreamDecoder(object):
+    """
+    Decode a JSON document as it arrives, chunk by chunk.
+
+    RAPI listings are JSON arrays, so if the document is an array, each
+    element is decoded as soon as it has been completely received and the
+    raw text is discarded. Any other document is buffered and decoded once
+    it is complete.
+
+    Elements are scanned once, chunk by chunk, keeping track of strings and
+    brackets, and each is decoded with C{loads} once it is complete;
+    decoding takes time linear in the size of the document, however it is
+    split.
+    """
+
+    def __init__(self, callback=None, loads=None):
+        """
+        @type callback: callable or None
+        @param callback: if given, called with each element of a top-level
+                         array instead of collecting the elements; the
+                         document must then be an array
+        @type loads: callable or None
+        @param loads: decodes each element of an array, or the whole
+                      document if it isn't one, such as a
+                      L{gentleman.codec.Codec}'s C{loads}
+        """
+
+        self.callback = callback
+        self.loads = loads or json.loads
+
+        self._offset = 0
+        self._chunks = None
+        self._array = None
+        self._count = 0
+        self._expect_value = True
+        self._done = False
+
+        # The element being received, while it spans chunks.
+        self._element = None
+        self._scalar = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, data):
+        """
+        Feed some more of the document to the decoder.
+
+        @type data: str
+        @param data: the next chunk of the document
+
+        @raises ValueError: if the document is not valid JSON
+        """
+
+        if self._chunks is not None:
+            self._chunks.append(data)
+            return
+
+        pos = 0
+
+        if self._array is None:
+            pos = _whitespace.match(data).end()
+            if pos == len(data):
+                self._offset += len(data)
+                return
+            if data[pos] != "[":
+                if self.callback is not None:
+                    raise ValueError("Expected a JSON array")
+                self._chunks = [data[pos:]]
+                return
+            self._array = []
+            pos += 1
+
+        self._scan(data, pos)
+        self._offset += len(data)
+
+    def _scan(self, buf, pos):
+        end = len(buf)
+
+        while True:
+            if self._element is not None:
+                element_end = self._continue(buf, pos)
+                if element_end is None:
+                    self._element.append(buf[pos:])
+                    return
+                self._element.append(buf[pos:element_end])
+                self._decoded("".join(self._element))
+                self._element = None
+                pos = element_end
+                continue
+
+            pos = _whitespace.match(buf, pos).end()
+            if pos == end:
+                return
+
+            if self._done:
+                raise ValueError("Extra data after JSON array at %d" %
+                                 (self._offset + pos))
+
+            c = buf[pos]
+
+            if c == "]":
+                if self._expect_value and self._count:
+                    raise ValueError("Expected a value at %d" %
+                                     (self._offset + pos))
+                self._done = True
+                pos += 1
+            elif not self._expect_value:
+                if c != ",":
+                    raise ValueError("Expected ',' or ']' at %d" %
+                                     (self._offset + pos))
+                self._expect_value = True
+                pos += 1
+            else:
+                pos = self._start(buf, pos)
+
+    def _start(self, buf, pos):
+        """
+        Start scanning the element starting at C{pos}.
+        """
+
+        c = buf[pos]
+        # Numbers could still be missing some digits, so scalars are only
+        # decoded once their delimiter has arrived.
+        self._scalar = c != "{" and c != "[" and c != "\""
+
+        self._element = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+        if c == "\"":
+            self._element.append(c)
+            self._in_string = True
+            return pos + 1
+        return pos
+
+    def _continue(self, buf, pos):
+        """
+        Scan some more of the element being received.
+
+        @rtype: int or None
+        @return: where the element ends in C{buf}, or None if it doesn't
+        """
+
+        if self._scalar:
+            m = _scalar_end.search(buf, pos)
+            if m is None:
+                return None
+            return m.start()
+
+        end = len(buf)
+
+        while True:
+            if self._escape:
+                if pos == end:
+                    return None
+                self._escape = False
+                pos += 1
+
+            if self._in_string:
+                m = _string_end.match(buf, pos)
+                if m is None:
+                    # The string goes on past this chunk; find out whether
+                    # it ends in the middle of an escape.
+                    rest = buf[pos:]
+                    backslashes = len(rest) - len(rest.rstrip("\\"))
+                    self._escape = backslashes % 2 == 1
+                    return None
+                pos = m.end()
+                self._in_string = False
+                if self._depth == 0:
+                    return pos
+                continue
+
+            pos = _skip.match(buf, pos).end()
+            if pos == end:
+                return None
+            c = buf[pos]
+            pos += 1
+
+            if c == "\"":
+                self._in_string = True
+            elif c == "{" or c == "[":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth <= 0:
+                    return pos
+
+    def _decoded(self, text):
+        self._emit(self.loads(text))
+
+    def _emit(self, obj):
+        self._expect_value = False
+        self._count += 1
+
+        if self.callback is None:
+            self._array.append(obj)
+        else:
+            self.callback(obj)
+
+    def close(self):
+        """
+        Finish decoding the document.
+
+        @rtype: object
+        @return: the decoded document; for arrays with a callback, the
+                 number of elements passed to the callback
+
+        @raises ValueError: if the document is incomplete or invalid
+        """
+
+        if self._chunks is not None:
+            return self.loads("".join(self._chunks))
+
+        if self._array is None:
+            raise ValueError("No JSON object could be decoded")
+
+        if not self._done:
+            raise ValueError("Unterminated JSON array")
+
+        if self.callback is None:
+            return self._array
+        return self._count
@@ -4,14 +4,20 @@ Base functionality for the Ganeti RAPI, client-side.
 This module provides combinators which are used to provide a full RAPI client.
 """
 
+from functools import partial
 import logging
-import simplejson as json
 import socket
+from threading import Lock, local
+import time
 
-import requests
-
-from gentleman.errors import ClientError, GanetiApiError, NotOkayError
+from gentleman.codec import default_codec
+from gentleman.errors import (CircuitOpenError, ClientError, GanetiApiError,
+                              NotOkayError)
 from gentleman.helpers import prepare_query
+from gentleman.metrics import RequestRecord, calling_function
+from gentleman.retry import parse_retry_after
+from gentleman.stream import JsonStreamDecoder
+from gentleman.tls import options_for
 
 headers = {
     "accept": "application/json",
@@ -19,22 +25,85 @@ headers = {
     "user-agent": "Ganeti RAPI Client (Requests)",
 }
 
+_stream_chunk_size = 64 * 1024
+
+# Time spent connecting during the current request, per thread.
+_timing = local()
+
+
+# requests takes far longer to import than the rest of gentleman, so it is
+# only imported once the first client is made; short-lived tools which never
+# make one don't pay for it.
+requests = None
+_TimedHTTPSConnectionPool = None
+
+
+def _import_requests():
+    global requests, _TimedHTTPSConnectionPool
+
+    if requests is not None:
+        return
+
+    import requests as _requests
+    from requests.packages.urllib3.connection import HTTPSConnection
+    from requests.packages.urllib3.connectionpool import HTTPSConnectionPool
+
+    class _TimedHTTPSConnection(HTTPSConnection):
+        """
+        A connection secured with the client's L{TLSOptions}, which times
+        how long it takes to connect, and tells the client each time it
+        does.
+
+        urllib3 would otherwise build a new TLS context for every connection.
+        A connection which is closed, rather than kept alive, connects again
+        for the next request.
+        """
+
+        def __init__(self, *args, **kwargs):
+            self.tls = kwargs.pop("tls")
+            self.on_connect = kwargs.pop("on_connect")
+            HTTPSConnection.__init__(self, *args, **kwargs)
+
+        def connect(self):
+            started = time.time()
+            try:
+                self.sock = self.tls.wrap(self._new_conn())
+                # Quiets urllib3's warnings about unverified requests.
+                self.is_verified = (self.tls.verify or
+                                    self.tls.fingerprint is not None)
+                self.on_connect()
+            finally:
+                _timing.connect = (getattr(_timing, "connect", 0.0) +
+                                   time.time() - started)
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+
+        ConnectionCls = _TimedHTTPSConnection
+
+    # Set last, since other threads only check whether requests is set.
+    _TimedHTTPSConnectionPool = TimedHTTPSConnectionPool
+    requests = _requests
+
 
 class RequestsRapiClient(object):
     """
     Ganeti RAPI client using the requests library as its backend.
     """
 
-    _json_encoder = json.JSONEncoder(sort_keys=True)
-
     version = None
     features = []
 
     def __init__(self, host, port=5080, username=None, password=None,
-                 timeout=60):
+                 timeout=60, pool_size=10, keep_alive=True, idle_timeout=None,
+                 retry=None, breaker=None, limiter=None, hooks=None,
+                 codec=None, tls=None):
         """
         Initializes this class.
 
+        The client owns a pool of persistent connections to the cluster
+        master, which is reused across calls and may be shared between
+        threads.
+
         @type host: string
         @param host: the ganeti cluster master to interact with
         @type port: int
@@ -43,7 +112,28 @@ class RequestsRapiClient(object):
         @param username: the username to connect with
         @type password: string
         @param password: the password to connect with
-        @param logger: Logging object
+        @type pool_size: int
+        @param pool_size: the maximum number of connections kept in the pool
+        @type keep_alive: bool
+        @param keep_alive: whether to keep connections open between requests
+        @type idle_timeout: float or None
+        @param idle_timeout: seconds after which an idle pool is discarded
+                             instead of reused (None to never discard)
+        @type retry: L{gentleman.retry.RetryPolicy} or None
+        @param retry: when to retry failed requests
+        @type breaker: L{gentleman.retry.CircuitBreaker} or None
+        @param breaker: the circuit breaker for this cluster
+        @type limiter: L{gentleman.limit.Limiter} or None
+        @param limiter: the limiter for this cluster
+        @type hooks: list of callables
+        @param hooks: called with a L{gentleman.metrics.RequestRecord} as
+                      each request finishes
+        @type codec: L{gentleman.codec.Codec} or None
+        @param codec: the JSON codec for bodies; defaults to the fastest
+                      installed
+        @type tls: L{gentleman.tls.TLSOptions} or None
+        @param tls: how to secure connections; defaults to the cluster's
+                    shared options, which don't verify certificates
         """
 
         if username is not None and password is None:
@@ -65,6 +155,37 @@ class RequestsRapiClient(object):
 
         self._base_url = "https://%s" % address
 
+        self.idle_timeout = idle_timeout
+        self.retry = retry
+        self.breaker = breaker
+        self.limiter = limiter
+        self.hooks = list(hooks or [])
+        self.codec = codec or default_codec()
+        self.tls = tls or options_for(host, port)
+
+        self._headers = headers.copy()
+        if not keep_alive:
+            self._headers["connection"] = "close"
+
+        _import_requests()
+
+        self._adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                      pool_maxsize=pool_size)
+        self._session = requests.Session()
+        self._session.mount("https://", self._adapter)
+
+        poolmanager = self._adapter.poolmanager
+        poolmanager.pool_classes_by_scheme = dict(
+            poolmanager.pool_classes_by_scheme,
+            https=partial(_TimedHTTPSConnectionPool, tls=self.tls,
+                          on_connect=self._connected))
+
+        self._lock = Lock()
+        self._last_used = None
+        self._requests = 0
+        self._created = 0
+        self._evictions = 0
+
 
     def request(self, method, path, query=None, content=None):
         """
@@ -88,17 +209,191 @@ class RequestsRapiClient(object):
         @raises GanetiApiError: If an invalid response is returned
         """
 
+        return self._request(method, path, query, content,
+                             self._record(method, path))
+
+
+    def _record(self, method, path):
+        if self.hooks:
+            return RequestRecord(method, path, calling_function())
+
+
+    def _request(self, method, path, query, content, record):
+        try:
+            r = self._send(method, path, query, content, record=record)
+
+            started = time.time()
+            if r.content:
+                result = self.codec.loads(r.content)
+            else:
+                result = None
+            decoded = time.time()
+        except Exception, e:
+            if record is not None:
+                record.finish(self.hooks, e)
+            raise
+
+        if record is not None:
+            record.decode = decoded - started
+            record.finish(self.hooks)
+
+        return result
+
+
+    def stream(self, method, path, query=None, content=None, callback=None):
+        """
+        Sends an HTTP request, decoding a JSON array response as it arrives.
+
+        @type method: string
+        @param method: HTTP method to use
+        @type path: string
+        @param path: HTTP URL path
+        @type query: list of two-tuples
+        @param query: query arguments to pass to urllib.urlencode
+        @type content: str or None
+        @param content: HTTP body content
+        @type callback: callable or None
+        @param callback: if given, called with each element of the response
+
+        @rtype: iterator, or int if a callback was given
+        @return: the elements of the response, one at a time, or the number
+                 of elements passed to the callback
+
+        @raises GanetiApiError: If an invalid response is returned
+        """
+
+        return self._stream(method, path, query, content, callback,
+                            self._record(method, path))
+
+
+    def _stream(self, method, path, query, content, callback, record):
+        try:
+            r = self._send(method, path, query, content, stream=True,
+                           record=record)
+        except Exception, e:
+            if record is not None:
+                record.finish(self.hooks, e)
+            raise
+
+        items = self._iter_response(r, record)
+
+        if callback is None:
+            return items
+
+        count = 0
+        for item in items:
+            callback(item)
+            count += 1
+        return count
+
+
+    def _iter_response(self, r, record=None):
+        pending = []
+        decoder = JsonStreamDecoder(pending.append, self.codec.loads)
+        chunks = r.iter_content(chunk_size=_stream_chunk_size)
+        error = None
+
+        try:
+            while True:
+                started = time.time()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+                received = time.time()
+
+                decoder.feed(chunk)
+
+                if record is not None:
+                    record.transfer += received - started
+                    record.decode += time.time() - received
+                    record.bytes_in += len(chunk)
+
+                for item in pending:
+                    yield item
+                del pending[:]
+
+            decoder.close()
+            for item in pending:
+                yield item
+        except Exception, e:
+            error = e
+            raise
+        finally:
+            r.close()
+            if record is not None:
+                record.finish(self.hooks, error)
+
+
+    def _send(self, method, path, query, content, stream=False, record=None):
+        attempt = 0
+
+        while True:
+            if self.breaker is not None and not self.breaker.allow():
+                raise CircuitOpenError("Not contacting %s while it is failing"
+                                       % self._base_url)
+
+            attempt += 1
+            if record is not None:
+                record.attempt()
+
+            try:
+                r = self._send_limited(method, path, query, content, stream,
+                                       record)
+            except GanetiApiError, e:
+                if self.breaker is not None:
+                    self.breaker.record(e)
+                if (self.retry is None or
+                    not self.retry.retryable(method, e, attempt)):
+                    raise
+                time.sleep(self.retry.delay(attempt, e))
+            except Exception:
+                if self.breaker is not None:
+                    self.breaker.failure()
+                raise
+            else:
+                if self.breaker is not None:
+                    self.breaker.record()
+                return r
+
+
+    def _send_limited(self, method, path, query, content, stream, record):
+        if self.limiter is None:
+            return self._send_once(method, path, query, content, stream,
+                                   record)
+
+        self.limiter.acquire(method, path)
+        started = time.time()
+
+        try:
+            r = self._send_once(method, path, query, content, stream, record)
+        except Exception, e:
+            self.limiter.release(time.time() - started, e)
+            raise
+
+        self.limiter.release(time.time() - started)
+        return r
+
+
+    def _send_once(self, method, path, query, content, stream, record=None):
+        # The body is always read separately, so that it can be timed.
         kwargs = {
-            "headers": headers,
+            "headers": self._headers,
             "timeout": self.timeout,
+            # Certificates are checked by self.tls as each connection is
+            # made.
             "verify": False,
+            "stream": True,
         }
 
         if self.username and self.password:
             kwargs["auth"] = self.username, self.password
 
+        started = time.time()
+        data = ""
         if content is not None:
-            kwargs["data"] = self._json_encoder.encode(content)
+            data = kwargs["data"] = self.codec.dumps(content)
+        encoded = time.time()
 
         if query:
             prepare_query(query)
@@ -108,21 +403,108 @@ class RequestsRapiClient(object):
 
         # print "Sending request to %s %s" % (url, kwargs)
 
+        self._check_idle()
+        _timing.connect = 0.0
+
         try:
-            r = requests.request(method, url, **kwargs)
+            r = self._session.request(method, url, **kwargs)
         except requests.ConnectionError:
             raise GanetiApiError("Couldn't connect to %s" % self._base_url)
         except requests.Timeout:
             raise GanetiApiError("Timed out connecting to %s" %
                                  self._base_url)
 
+        received = time.time()
+
+        if record is not None:
+            record.status = r.status_code
+            record.bytes_out = len(data)
+            record.encode = encoded - started
+            record.connect = _timing.connect
+            record.ttfb = received - encoded - _timing.connect
+
         if r.status_code != requests.codes.ok:
-            raise NotOkayError(str(r.status_code), code=r.status_code)
+            r.close()
+            retry_after = parse_retry_after(r.headers.get("retry-after"))
+            raise NotOkayError(str(r.status_code), code=r.status_code,
+                               retry_after=retry_after)
 
-        if r.content:
-            return json.loads(r.content)
-        else:
-            return None
+        if not stream:
+            try:
+                r.content
+            except requests.RequestException:
+                raise GanetiApiError("Couldn't read response from %s" %
+                                     self._base_url)
+
+            if record is not None:
+                record.transfer = time.time() - received
+                record.bytes_in = len(r.content)
+
+        return r
+
+
+    def _check_idle(self):
+        """
+        Account for a request, discarding the pool if it sat idle too long.
+        """
+
+        with self._lock:
+            now = time.time()
+
+            if (self.idle_timeout is not None and
+                self._last_used is not None and
+                now - self._last_used > self.idle_timeout):
+                # The master has probably hung up on us already; don't hand
+                # out connections which will fail on first use.
+                self._adapter.poolmanager.clear()
+                self._evictions += 1
+
+            self._last_used = now
+            self._requests += 1
+
+
+    def _connected(self):
+        with self._lock:
+            self._created += 1
+
+
+    def _pools(self):
+        pools = self._adapter.poolmanager.pools
+        return [pools[key] for key in pools.keys()]
+
+
+    def pool_stats(self):
+        """
+        Report on connection reuse.
+
+        @rtype: dict
+        @return: number of requests sent, connections created, requests which
+                 reused a connection, idle connections currently pooled, and
+                 idle evictions
+        """
+
+        with self._lock:
+            # Empty slots in urllib3's queue are filled with None, and
+            # connections which were closed are put back without a socket.
+            idle = sum(1 for pool in self._pools() if pool.pool is not None
+                       for conn in list(pool.pool.queue)
+                       if conn and conn.sock is not None)
+
+            return {
+                "requests": self._requests,
+                "created": self._created,
+                "reused": max(self._requests - self._created, 0),
+                "idle": idle,
+                "evictions": self._evictions,
+            }
+
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+
+        self._session.close()
 
 
     @staticmethod
@@ -130,6 +512,11 @@ class RequestsRapiClient(object):
         return f(a)
 
 
+    @staticmethod
+    def succeed(a):
+        return a
+
+
     def start(self):
         """
         Confirm that we may access the target cluster.
@@ -0,0 +1,72 @@
+"""
+Helpers shared by the tests.
+"""
+
+import atexit
+import shutil
+import tempfile
+from unittest import SkipTest
+
+from gentleman.codec import Codec
+from gentleman.fake import FakeCluster, FakeRapiServer, make_certificate
+
+_certificate = []
+
+def certificate():
+    """
+    Make one certificate for every fake server; openssl takes a while.
+
+    @rtype: two-tuple of str
+    @return: paths of the certificate and its key
+
+    @raises SkipTest: if openssl can't be run
+    """
+
+    if not _certificate:
+        directory = tempfile.mkdtemp(prefix="gentleman-test-")
+        atexit.register(shutil.rmtree, directory, True)
+        try:
+            _certificate.extend(make_certificate(directory))
+        except OSError:
+            raise SkipTest("openssl is needed to make a certificate")
+    return _certificate
+
+class FakeServerMixin(object):
+    """
+    Serve a fresh L{FakeCluster} to each test of a C{TestCase}.
+
+    C{cluster_options} are the arguments for the cluster, and L{client}
+    makes a C{client_class} for the server.
+    """
+
+    cluster_options = {"instances": 6, "nodes": 3, "queue_delay": 0,
+                       "run_delay": 0}
+    client_class = None
+
+    def setUp(self):
+        super(FakeServerMixin, self).setUp()
+
+        cert, key = certificate()
+        cluster = FakeCluster(**self.cluster_options)
+        self.server = FakeRapiServer(cluster, cert=cert, key=key).start()
+        self.addCleanup(self.server.stop)
+
+    def client(self, **kwargs):
+        r = self.client_class("localhost", self.server.port, **kwargs)
+        self.addCleanup(r.close)
+        return r
+
+class CountingCodec(Codec):
+    """
+    A codec which counts the documents it decodes.
+    """
+
+    def __init__(self, backend="json"):
+        Codec.__init__(self, backend)
+        self.decoded = 0
+        self._loads = self.loads
+        self.loads = self._counted
+
+    def _counted(self, data):
+        self.decoded += 1
+        return self._loads(data)
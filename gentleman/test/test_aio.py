@@ -0,0 +1,206 @@
+import socket
+import ssl
+from unittest import SkipTest, TestCase
+
+try:
+    import asyncio
+    import aiohttp
+except ImportError:
+    raise SkipTest("asyncio and aiohttp are needed for the asyncio client")
+
+from gentleman import base
+from gentleman.aio import AsyncioRapiClient
+from gentleman.errors import (CertificateError, CircuitOpenError,
+                              ClientError, GanetiApiError, NotOkayError)
+from gentleman.limit import AdaptiveConcurrency, Limiter
+from gentleman.retry import CircuitBreaker, RetryPolicy
+from gentleman.test.common import CountingCodec, FakeServerMixin
+from gentleman.tls import TLSOptions, fingerprint
+
+def unused_port():
+    s = socket.socket()
+    s.bind(("localhost", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+class TestAsyncioRapiClient(FakeServerMixin, TestCase):
+
+    client_class = AsyncioRapiClient
+
+    def setUp(self):
+        super(TestAsyncioRapiClient, self).setUp()
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+        # Closed SSL transports finish hanging up on the next turn.
+        self.addCleanup(lambda: self.wait(asyncio.sleep(0.01)))
+
+    def client(self, port=None, **kwargs):
+        r = self.client_class("localhost", port or self.server.port,
+                              **kwargs)
+        self.addCleanup(lambda: self.wait(r.close()))
+        return r
+
+    def wait(self, future):
+        return self.loop.run_until_complete(future)
+
+    def test_request(self):
+        r = self.client()
+        info = self.wait(r.request("get", "/2/info"))
+        self.assertEqual(info["name"], "cluster.example.com")
+
+    def test_query(self):
+        r = self.client()
+        instances = self.wait(base.GetInstances(r, bulk=True))
+        self.assertEqual(len(instances), 6)
+        self.assertEqual(instances[0]["name"], "inst00000.example.com")
+
+    def test_applier(self):
+        r = self.client()
+        count = self.wait(r.applier(len, r.request("get", "/2/instances")))
+        self.assertEqual(count, 6)
+
+    def test_succeed(self):
+        r = self.client()
+        self.assertEqual(self.wait(r.applier(str, r.succeed(5))), "5")
+
+    def test_start(self):
+        r = self.client()
+        self.wait(r.start())
+        self.assertEqual(r.version, 2)
+
+    def test_bad_path(self):
+        r = self.client()
+        self.assertRaises(ClientError, r.request, "get", "2/info")
+
+    def test_not_okay(self):
+        r = self.client()
+        self.server.inject("/2/info", code=503, count=1)
+        try:
+            self.wait(base.GetInfo(r))
+        except NotOkayError as e:
+            self.assertEqual(e.code, 503)
+        else:
+            self.fail("NotOkayError not raised")
+
+    def test_connection_failed(self):
+        r = self.client(port=unused_port())
+        self.assertRaises(GanetiApiError, self.wait, base.GetInfo(r))
+
+    def test_session_reused(self):
+        r = self.client()
+        self.wait(base.GetInfo(r))
+        session = r._session
+        self.wait(base.GetInstances(r))
+        self.assertTrue(r._session is session)
+        self.assertFalse(session.closed)
+
+    def test_close(self):
+        r = self.client()
+        self.wait(r.close())
+        self.wait(base.GetInfo(r))
+        session = r._session
+
+        self.wait(r.close())
+        self.assertTrue(session.closed)
+        self.wait(base.GetInfo(r))
+        self.assertFalse(r._session is session)
+
+    def test_iter_instances(self):
+        codec = CountingCodec()
+        r = self.client(codec=codec)
+        instances = []
+        count = self.wait(base.IterInstances(r, callback=instances.append,
+                                             fields=["name"]))
+        self.assertEqual(count, 6)
+        self.assertEqual(instances[0], {"name": "inst00000.example.com"})
+        self.assertEqual(codec.decoded, 6)
+
+    def test_iter_instances_requires_callback(self):
+        r = self.client()
+        self.assertRaises(ClientError, base.IterInstances, r)
+
+    def test_stream_not_okay(self):
+        r = self.client()
+        self.server.inject("/2/instances", code=503, count=1)
+        self.assertRaises(NotOkayError, self.wait,
+                          base.IterInstances(r, callback=lambda i: None))
+
+    def test_verified(self):
+        r = self.client(tls=TLSOptions("localhost", ca_file=self.server.cert))
+        self.assertEqual(self.wait(base.GetInfo(r))["name"],
+                         "cluster.example.com")
+
+    def test_verified_wrong_host(self):
+        r = self.client(tls=TLSOptions("example.com",
+                                       ca_file=self.server.cert))
+        self.assertRaises(CertificateError, self.wait, base.GetInfo(r))
+
+    def test_pinned(self):
+        with open(self.server.cert) as f:
+            pin = fingerprint(ssl.PEM_cert_to_DER_cert(f.read()))
+        r = self.client(tls=TLSOptions("localhost", fingerprint=pin))
+        self.assertEqual(self.wait(base.GetInfo(r))["name"],
+                         "cluster.example.com")
+
+    def test_pinned_mismatch(self):
+        r = self.client(tls=TLSOptions("localhost", fingerprint="00" * 32))
+        self.assertRaises(CertificateError, self.wait, base.GetInfo(r))
+
+    def test_retry(self):
+        r = self.client(retry=RetryPolicy(backoff=0.01))
+        self.server.inject("/2/info", code=503, count=2)
+        self.assertEqual(self.wait(base.GetInfo(r))["name"],
+                         "cluster.example.com")
+
+    def test_breaker(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=60)
+        r = self.client(breaker=breaker)
+        self.server.inject("/2/info", code=503, count=1)
+        self.assertRaises(NotOkayError, self.wait, base.GetInfo(r))
+        self.assertRaises(CircuitOpenError, self.wait, base.GetInfo(r))
+
+    def test_limiter(self):
+        concurrency = AdaptiveConcurrency(initial=1, maximum=1)
+        r = self.client(limiter=Limiter(concurrency=concurrency))
+        self.server.inject("/2/instances/*", delay=0.05)
+        names = ["inst%05d.example.com" % i for i in range(3)]
+        instances = self.wait(asyncio.gather(*[base.GetInstance(r, name)
+                                               for name in names]))
+        self.assertEqual([i["name"] for i in instances], names)
+        self.assertEqual(concurrency.stats()["inflight"], 0)
+
+    def test_cancel_while_limited(self):
+        concurrency = AdaptiveConcurrency(initial=1, maximum=1)
+        r = self.client(limiter=Limiter(concurrency=concurrency))
+        self.server.inject("/2/info", delay=0.2, count=1)
+
+        first = base.GetInfo(r)
+        second = base.GetInstances(r)
+        self.wait(asyncio.sleep(0.05))
+        self.assertEqual(concurrency.stats()["waiting"], 1)
+
+        second.cancel()
+        self.assertRaises(asyncio.CancelledError, self.wait, second)
+        # The request itself is cancelled on the loop's next turns.
+        self.wait(asyncio.sleep(0.01))
+        self.assertEqual(concurrency.stats()["waiting"], 0)
+
+        self.wait(first)
+        self.assertEqual(concurrency.stats()["inflight"], 0)
+
+    def test_hooks(self):
+        records = []
+        r = self.client(hooks=[records.append])
+        self.wait(base.GetInfo(r))
+        self.server.inject("/2/info", code=503, count=1)
+        self.assertRaises(NotOkayError, self.wait, base.GetInfo(r))
+
+        self.assertEqual([(record.function, record.status)
+                          for record in records],
+                         [("GetInfo", 200), ("GetInfo", 503)])
+        self.assertTrue(records[0].bytes_in > 0)
+        self.assertTrue(isinstance(records[1].error, NotOkayError))
@@ -0,0 +1,413 @@
+from twisted.internet import reactor
+from twisted.internet.defer import (CancelledError, gatherResults,
+                                    inlineCallbacks, returnValue)
+from twisted.internet.task import deferLater
+from twisted.trial import unittest
+from twisted.web.client import HTTPConnectionPool
+
+from gentleman import base
+from gentleman.async import (TwistedBulkTagger, TwistedJobWaiter,
+                             TwistedRapiClient)
+from gentleman.bulk import select
+from gentleman.errors import (CircuitOpenError, ClientError, DeadlineError,
+                              JobFailedError, NotOkayError)
+from gentleman.limit import AdaptiveConcurrency, Limiter
+from gentleman.retry import CircuitBreaker, RetryPolicy
+from gentleman.test.common import CountingCodec, FakeServerMixin
+from gentleman.tls import TLSOptions
+
+def sleep(seconds):
+    return deferLater(reactor, seconds, lambda: None)
+
+class TwistedServerMixin(FakeServerMixin):
+
+    def client(self, **kwargs):
+        tls = TLSOptions("localhost", ca_file=self.server.cert)
+        r = TwistedRapiClient("localhost", self.server.port, tls=tls,
+                              **kwargs)
+        self.addCleanup(r.pool.closeCachedConnections)
+        return r
+
+class TestCoalesce(TwistedServerMixin, unittest.TestCase):
+
+    @inlineCallbacks
+    def test_shared(self):
+        r = self.client()
+        yield base.GetInfo(r)
+        sent = self.server.requests
+
+        results = yield gatherResults([base.GetInstances(r, bulk=True)
+                                       for i in range(3)])
+        self.assertEqual(self.server.requests, sent + 1)
+        self.assertTrue(results[0] is results[1] is results[2])
+        self.assertEqual(r.coalesce_stats(), {"hits": 2, "misses": 2,
+                                              "inflight": 0})
+
+    @inlineCallbacks
+    def test_not_shared_after_response(self):
+        r = self.client()
+        yield base.GetInfo(r)
+        yield base.GetInfo(r)
+        self.assertEqual(r.coalesce_stats()["hits"], 0)
+
+    @inlineCallbacks
+    def test_different_query(self):
+        r = self.client()
+        yield gatherResults([base.GetInstances(r),
+                             base.GetInstances(r, bulk=True)])
+        self.assertEqual(r.coalesce_stats()["hits"], 0)
+
+    @inlineCallbacks
+    def test_jobs_not_shared(self):
+        r = self.client()
+        job_ids = yield gatherResults([base.AddClusterTags(r, ["a"])
+                                       for i in range(2)])
+        self.assertNotEqual(job_ids[0], job_ids[1])
+        self.assertEqual(r.coalesce_stats()["hits"], 0)
+
+    @inlineCallbacks
+    def test_cancel_one(self):
+        r = self.client()
+        self.server.inject(delay=0.2, count=1)
+        first = base.GetInfo(r)
+        second = base.GetInfo(r)
+
+        first.cancel()
+        yield self.assertFailure(first, CancelledError)
+        info = yield second
+        self.assertEqual(info["name"], "cluster.example.com")
+
+    @inlineCallbacks
+    def test_cancel_all(self):
+        r = self.client()
+        self.server.inject(delay=0.2, count=1)
+        ds = [base.GetInfo(r) for i in range(2)]
+
+        for d in ds:
+            d.cancel()
+            yield self.assertFailure(d, CancelledError)
+        self.assertEqual(r.coalesce_stats()["inflight"], 0)
+
+class TestConnectionPool(TwistedServerMixin, unittest.TestCase):
+
+    @inlineCallbacks
+    def test_reused(self):
+        r = self.client()
+        yield r.start()
+        yield base.GetInfo(r)
+        self.assertEqual(r.pool_stats(), {"open": 1, "idle": 1, "in_use": 0,
+                                          "created": 1, "reused": 2})
+
+    @inlineCallbacks
+    def test_in_use(self):
+        r = self.client()
+        self.server.inject(delay=0.2, count=1)
+        d = base.GetInfo(r)
+        yield sleep(0.1)
+        stats = r.pool_stats()
+        self.assertEqual((stats["open"], stats["in_use"]), (1, 1))
+        yield d
+
+    @inlineCallbacks
+    def test_warm(self):
+        r = self.client(warm=3)
+        self.assertEqual(r.pool.maxPersistentPerHost, 3)
+        yield r.start()
+        stats = r.pool_stats()
+        self.assertEqual(stats["created"], 3)
+        self.assertEqual(stats["idle"], 3)
+
+        # A burst of requests finds its connections already open.
+        yield gatherResults([base.GetInstance(r, "inst%05d.example.com" % i)
+                             for i in range(3)])
+        self.assertEqual(r.pool_stats()["created"], 3)
+
+    @inlineCallbacks
+    def test_errors_release(self):
+        r = self.client()
+        self.server.inject("/2/info", code=503, count=5)
+        for i in range(5):
+            yield self.assertFailure(base.GetInfo(r), NotOkayError)
+
+        stats = r.pool_stats()
+        self.assertEqual((stats["created"], stats["idle"], stats["in_use"]),
+                         (1, 1, 0))
+
+    @inlineCallbacks
+    def test_retries_release(self):
+        r = self.client(retry=RetryPolicy(attempts=4, backoff=0.01))
+        self.server.inject("/2/info", code=503, count=3)
+        info = yield base.GetInfo(r)
+        self.assertEqual(info["name"], "cluster.example.com")
+
+        stats = r.pool_stats()
+        self.assertEqual((stats["created"], stats["idle"], stats["in_use"]),
+                         (1, 1, 0))
+
+    def test_settings(self):
+        r = self.client(max_persistent=5, idle_timeout=10)
+        self.assertEqual(r.pool.maxPersistentPerHost, 5)
+        self.assertEqual(r.pool.cachedConnectionTimeout, 10)
+
+    def test_shared_pool(self):
+        pool = HTTPConnectionPool(reactor)
+        pool.maxPersistentPerHost = 7
+        r = self.client(pool=pool, max_persistent=2)
+        self.assertEqual(pool.maxPersistentPerHost, 7)
+        # The pool doesn't keep count.
+        self.assertEqual(r.pool_stats(), None)
+
+class TestStream(TwistedServerMixin, unittest.TestCase):
+
+    @inlineCallbacks
+    def test_iter_instances(self):
+        r = self.client()
+        instances = []
+        count = yield base.IterInstances(r, callback=instances.append,
+                                         fields=["name"])
+        self.assertEqual(count, 6)
+        self.assertEqual(instances[0], {"name": "inst00000.example.com"})
+
+    @inlineCallbacks
+    def test_bulk_codec(self):
+        codec = CountingCodec()
+        r = self.client(codec=codec)
+        instances = yield base.GetInstances(r, bulk=True)
+        self.assertEqual(len(instances), 6)
+        self.assertEqual(codec.decoded, 6)
+
+    def test_iter_instances_requires_callback(self):
+        r = self.client()
+        self.assertRaises(ClientError, base.IterInstances, r)
+
+class TestDeadline(TwistedServerMixin, unittest.TestCase):
+
+    def test_client_deadline(self):
+        r = self.client(deadline=0.1)
+        self.server.inject(delay=0.5, count=1)
+        return self.assertFailure(base.GetInfo(r), DeadlineError)
+
+    @inlineCallbacks
+    def test_met(self):
+        r = self.client(deadline=5)
+        info = yield base.GetInfo(r)
+        self.assertEqual(info["name"], "cluster.example.com")
+
+    @inlineCallbacks
+    def test_request_deadline(self):
+        r = self.client(deadline=0.1)
+        self.server.inject(delay=0.3, count=1)
+        info = yield r.request("get", "/2/info", deadline=5)
+        self.assertEqual(info["name"], "cluster.example.com")
+
+    @inlineCallbacks
+    def test_within(self):
+        r = self.client()
+        limited = r.within(0.4)
+        self.assertEqual(limited.pool_stats(), r.pool_stats())
+
+        yield base.GetInfo(limited)
+        self.server.inject(delay=0.6, count=1)
+        yield self.assertFailure(base.GetInstances(limited), DeadlineError)
+
+    @inlineCallbacks
+    def test_cancel(self):
+        r = self.client()
+        self.server.inject(delay=0.3, count=1)
+        d = base.GetInfo(r)
+        yield sleep(0.1)
+        d.cancel()
+        yield self.assertFailure(d, CancelledError)
+
+        info = yield base.GetInfo(r)
+        self.assertEqual(info["name"], "cluster.example.com")
+
+    @inlineCallbacks
+    def test_cancel_while_limited(self):
+        concurrency = AdaptiveConcurrency(initial=1, maximum=1)
+        r = self.client(limiter=Limiter(concurrency=concurrency))
+        self.server.inject(delay=0.2, count=1)
+
+        first = base.GetInfo(r)
+        second = base.GetInstances(r)
+        yield sleep(0.05)
+        self.assertEqual(concurrency.stats()["waiting"], 1)
+
+        second.cancel()
+        yield self.assertFailure(second, CancelledError)
+        self.assertEqual(concurrency.stats()["waiting"], 0)
+
+        yield first
+        self.assertEqual(concurrency.stats()["inflight"], 0)
+
+    @inlineCallbacks
+    def test_cancelled_probe(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=0.2)
+        r = self.client(breaker=breaker)
+
+        self.server.inject(code=503, count=1)
+        yield self.assertFailure(base.GetInfo(r), NotOkayError)
+        yield self.assertFailure(base.GetInfo(r), CircuitOpenError)
+
+        yield sleep(0.25)
+        self.server.inject(delay=0.6, count=1)
+        yield self.assertFailure(r.request("get", "/2/info", deadline=0.3),
+                                 DeadlineError)
+
+        # The probe was given up on, so another may take its place.
+        info = yield base.GetInfo(r)
+        self.assertEqual(info["name"], "cluster.example.com")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    @inlineCallbacks
+    def test_cancelled_not_measured(self):
+        concurrency = AdaptiveConcurrency(initial=4)
+        r = self.client(limiter=Limiter(concurrency=concurrency))
+
+        self.server.inject(delay=0.5, count=1)
+        yield self.assertFailure(r.request("get", "/2/info", deadline=0.1),
+                                 DeadlineError)
+        self.assertEqual(concurrency.stats()["inflight"], 0)
+        self.assertEqual(concurrency.latency, None)
+
+class TestJobWaiter(TwistedServerMixin, unittest.TestCase):
+
+    @inlineCallbacks
+    def submit(self, r, count):
+        self.server.cluster.run_delay = 0.2
+        job_ids = yield gatherResults([base.AddClusterTags(r, ["t%d" % i])
+                                       for i in range(count)])
+        returnValue(job_ids)
+
+    @inlineCallbacks
+    def test_wait(self):
+        r = self.client()
+        job_ids = yield self.submit(r, 3)
+        finished = []
+        waiter = TwistedJobWaiter(r, max_connections=2,
+                                  callback=lambda *args: finished.append(args))
+
+        results, errors = yield waiter.wait(job_ids)
+        self.assertEqual(sorted(results), sorted(job_ids))
+        self.assertEqual(errors, {})
+        for job_id in job_ids:
+            self.assertEqual(results[job_id]["status"], "success")
+        self.assertEqual(sorted(args[0] for args in finished),
+                         sorted(job_ids))
+        self.assertEqual(finished[0][2], None)
+        self.assertTrue(waiter.use_wait)
+
+    @inlineCallbacks
+    def test_missing_job(self):
+        r = self.client()
+        job_ids = yield self.submit(r, 1)
+        results, errors = yield TwistedJobWaiter(r).wait(job_ids + [999])
+        self.assertEqual(list(results), job_ids)
+        self.assertEqual(list(errors), [999])
+        self.assertEqual(errors[999].code, 404)
+
+    @inlineCallbacks
+    def test_failed_job(self):
+        r = self.client()
+        self.server.cluster.fail_next_jobs(1)
+        job_ids = yield self.submit(r, 2)
+        results, errors = yield TwistedJobWaiter(r).wait(job_ids)
+        self.assertEqual(errors, {})
+        self.assertEqual(sorted(job["status"] for job in results.values()),
+                         ["error", "success"])
+
+    @inlineCallbacks
+    def test_poll_fallback(self):
+        r = self.client()
+        self.server.inject("/2/jobs/*/wait", code=501)
+        job_ids = yield self.submit(r, 2)
+        waiter = TwistedJobWaiter(r, max_connections=1, poll_interval=0.05)
+
+        results, errors = yield waiter.wait(job_ids)
+        self.assertEqual(errors, {})
+        for job_id in job_ids:
+            self.assertEqual(results[job_id]["status"], "success")
+        self.assertFalse(waiter.use_wait)
+
+    @inlineCallbacks
+    def test_wait_unavailable(self):
+        r = self.client()
+        self.server.inject("/2/jobs/*/wait", code=503, count=1)
+        job_ids = yield self.submit(r, 1)
+        waiter = TwistedJobWaiter(r)
+
+        results, errors = yield waiter.wait(job_ids)
+        self.assertEqual(results, {})
+        self.assertEqual(errors[job_ids[0]].code, 503)
+        self.assertTrue(waiter.use_wait)
+
+    @inlineCallbacks
+    def test_wait_retried(self):
+        r = self.client(retry=RetryPolicy(backoff=0.01))
+        self.server.inject("/2/jobs/*/wait", code=503, count=1)
+        job_ids = yield self.submit(r, 1)
+        waiter = TwistedJobWaiter(r)
+
+        results, errors = yield waiter.wait(job_ids)
+        self.assertEqual(errors, {})
+        self.assertEqual(results[job_ids[0]]["status"], "success")
+        self.assertTrue(waiter.use_wait)
+
+class TestBulkTagger(TwistedServerMixin, unittest.TestCase):
+
+    def setUp(self):
+        super(TestBulkTagger, self).setUp()
+        self.r = self.client()
+        self.tagger = TwistedBulkTagger(self.r, poll_interval=0.01)
+
+    @inlineCallbacks
+    def test_add_tags(self):
+        qfilter = ["=~", "name", "inst0000[0-3]"]
+        jobs = yield self.tagger.add_tags("instance", qfilter, ["bulk"])
+        self.assertEqual(len(jobs), 4)
+
+        results, errors = yield jobs.wait()
+        self.assertEqual(errors, {})
+        self.assertEqual(len(results), 4)
+
+        tagged = yield select(self.r, "instance", ["=[]", "tags", "bulk"])
+        self.assertEqual(sorted(tagged), sorted(results))
+
+    @inlineCallbacks
+    def test_delete_tags(self):
+        jobs = yield self.tagger.add_tags("node", None, ["gone"])
+        yield jobs.wait()
+        jobs = yield self.tagger.delete_tags("node", None, ["gone"])
+        results, errors = yield jobs.wait()
+        self.assertEqual(len(results), 3)
+
+        tagged = yield select(self.r, "node", ["=[]", "tags", "gone"])
+        self.assertEqual(tagged, [])
+
+    @inlineCallbacks
+    def test_job_failed(self):
+        self.server.cluster.fail_next_jobs(1)
+        jobs = yield self.tagger.add_tags("instance", None, ["flaky"])
+        results, errors = yield jobs.wait()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(errors), 1)
+        error = errors.values()[0]
+        self.assertTrue(isinstance(error, JobFailedError))
+        self.assertEqual(error.job["status"], base.JOB_STATUS_ERROR)
+
+    @inlineCallbacks
+    def test_submit_failed(self):
+        self.server.inject("/2/instances/inst00001.example.com/tags",
+                           method="PUT", code=404)
+        jobs = yield self.tagger.add_tags("instance", None, ["partial"])
+        self.assertEqual(len(jobs.job_ids), 5)
+        self.assertTrue(isinstance(jobs.errors["inst00001.example.com"],
+                                   NotOkayError))
+
+        results, errors = yield jobs.wait()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(list(errors), ["inst00001.example.com"])
+
+    def test_unknown_kind(self):
+        self.assertRaises(ClientError, self.tagger.add_tags, "cluster", None,
+                          ["tag"])
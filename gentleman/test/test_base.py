@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+from gentleman import base
+from gentleman.errors import NotOkayError
+
+class FakeClient(object):
+
+    features = []
+
+    def __init__(self, response=None):
+        self.response = response
+        self.sent = []
+
+    def request(self, method, path, query=None, content=None):
+        self.sent.append((method, path, query, content))
+        return self.response
+
+    @staticmethod
+    def applier(f, a):
+        return f(a)
+
+class TestProjection(TestCase):
+
+    def test_bulk_fields(self):
+        r = FakeClient([])
+        base.GetInstances(r, fields=["name", "pnode"])
+        self.assertEqual(r.sent[0][2], {"bulk": 1, "fields": "name,pnode"})
+
+    def test_bulk_without_fields(self):
+        r = FakeClient([])
+        base.GetNodes(r, bulk=True)
+        self.assertEqual(r.sent[0][2], {"bulk": 1})
+
+    def test_single_fields(self):
+        r = FakeClient({
+            "fields": [{"name": "name"}, {"name": "pnode"}],
+            "data": [[[0, "web01"], [0, "node1"]]],
+        })
+        instance = base.GetInstance(r, "web01", fields=["name", "pnode"])
+        self.assertEqual(instance, {"name": "web01", "pnode": "node1"})
+        method, path, query, content = r.sent[0]
+        self.assertEqual((method, path), ("put", "/2/query/instance"))
+        self.assertEqual(content["filter"], ["=", "name", "web01"])
+
+    def test_single_missing(self):
+        r = FakeClient({"fields": [{"name": "name"}], "data": []})
+        try:
+            base.GetGroup(r, "nope", fields=["name"])
+        except NotOkayError, noe:
+            self.assertEqual(noe.code, 404)
+        else:
+            self.fail("No error for a missing group")
@@ -0,0 +1,66 @@
+from unittest import TestCase
+
+from gentleman import base
+from gentleman.bulk import BulkTagger, select
+from gentleman.errors import ClientError, JobFailedError, NotOkayError
+from gentleman.stdlib import StdlibRapiClient
+from gentleman.test.common import FakeServerMixin
+
+class TestBulkTagger(FakeServerMixin, TestCase):
+
+    client_class = StdlibRapiClient
+
+    def setUp(self):
+        super(TestBulkTagger, self).setUp()
+        self.r = self.client()
+        self.tagger = BulkTagger(self.r, poll_interval=0.01)
+
+    def test_select(self):
+        names = select(self.r, "instance", ["=~", "name", "inst0000[12]"])
+        self.assertEqual(sorted(names), ["inst00001.example.com",
+                                         "inst00002.example.com"])
+
+    def test_add_tags(self):
+        qfilter = ["=~", "name", "inst0000[0-3]"]
+        jobs = self.tagger.add_tags("instance", qfilter, ["bulk"])
+        self.assertEqual(len(jobs), 4)
+
+        results, errors = jobs.wait()
+        self.assertEqual(errors, {})
+        self.assertEqual(len(results), 4)
+
+        tagged = select(self.r, "instance", ["=[]", "tags", "bulk"])
+        self.assertEqual(sorted(tagged), sorted(results))
+
+    def test_delete_tags(self):
+        self.tagger.add_tags("node", None, ["gone"]).wait()
+        results, errors = self.tagger.delete_tags("node", None,
+                                                  ["gone"]).wait()
+        self.assertEqual(len(results), 3)
+        self.assertEqual(select(self.r, "node", ["=[]", "tags", "gone"]), [])
+
+    def test_job_failed(self):
+        self.server.cluster.fail_next_jobs(1)
+        results, errors = self.tagger.add_tags("instance", None,
+                                               ["flaky"]).wait()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(errors), 1)
+        error = errors.values()[0]
+        self.assertTrue(isinstance(error, JobFailedError))
+        self.assertEqual(error.job["status"], base.JOB_STATUS_ERROR)
+
+    def test_submit_failed(self):
+        self.server.inject("/2/instances/inst00001.example.com/tags",
+                           method="PUT", code=404)
+        jobs = self.tagger.add_tags("instance", None, ["partial"])
+        self.assertEqual(len(jobs.job_ids), 5)
+        self.assertTrue(isinstance(jobs.errors["inst00001.example.com"],
+                                   NotOkayError))
+
+        results, errors = jobs.wait()
+        self.assertEqual(len(results), 5)
+        self.assertEqual(list(errors), ["inst00001.example.com"])
+
+    def test_unknown_kind(self):
+        self.assertRaises(ClientError, self.tagger.add_tags, "cluster", None,
+                          ["tag"])
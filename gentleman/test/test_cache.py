@@ -0,0 +1,84 @@
+from unittest import TestCase
+
+from gentleman import base
+from gentleman.cache import CachingRapiClient
+
+class FakeClient(object):
+
+    features = []
+
+    def __init__(self):
+        self.sent = []
+
+    def request(self, method, path, query=None, content=None):
+        self.sent.append((method, path))
+        return {"path": path, "count": len(self.sent)}
+
+    @staticmethod
+    def applier(f, a):
+        return f(a)
+
+    @staticmethod
+    def succeed(a):
+        return a
+
+class TestCachingRapiClient(TestCase):
+
+    def setUp(self):
+        self.r = FakeClient()
+        self.c = CachingRapiClient(self.r)
+
+    def test_hit(self):
+        first = base.GetInstance(self.c, "web01")
+        self.assertEqual(base.GetInstance(self.c, "web01"), first)
+        self.assertEqual(len(self.r.sent), 1)
+        self.assertEqual(self.c.cache_stats()["hits"], 1)
+
+    def test_uncached_endpoint(self):
+        base.GetJobStatus(self.c, 1)
+        base.GetJobStatus(self.c, 1)
+        self.assertEqual(len(self.r.sent), 2)
+
+    def test_expiry(self):
+        self.c.ttls["/2/info"] = -1
+        base.GetInfo(self.c)
+        base.GetInfo(self.c)
+        self.assertEqual(len(self.r.sent), 2)
+
+    def test_invalidate_resource(self):
+        base.GetInstance(self.c, "web01")
+        base.GetInstance(self.c, "web02")
+        base.AddInstanceTags(self.c, "web01", ["a"])
+        base.GetInstance(self.c, "web01")
+        base.GetInstance(self.c, "web02")
+        self.assertEqual([path for method, path in self.r.sent],
+                         ["/2/instances/web01", "/2/instances/web02",
+                          "/2/instances/web01/tags", "/2/instances/web01"])
+
+    def test_invalidate_listing(self):
+        self.c.ttls["/2/instances"] = 10
+        base.GetInstances(self.c, bulk=True)
+        base.ModifyInstance(self.c, "web01", beparams={})
+        base.GetInstances(self.c, bulk=True)
+        self.assertEqual(len(self.r.sent), 3)
+
+    def test_query_does_not_invalidate(self):
+        base.GetNode(self.c, "node1")
+        base.Query(self.c, "node", ["name"])
+        base.GetNode(self.c, "node1")
+        self.assertEqual(len(self.r.sent), 2)
+
+    def test_lru(self):
+        self.c.max_entries = 2
+        base.GetNode(self.c, "node1")
+        base.GetNode(self.c, "node2")
+        base.GetNode(self.c, "node1")
+        base.GetNode(self.c, "node3")
+        base.GetNode(self.c, "node1")
+        base.GetNode(self.c, "node2")
+        self.assertEqual(len(self.r.sent), 4)
+        self.assertEqual(self.c.cache_stats()["evictions"], 2)
+
+    def test_features(self):
+        self.r.features = ["instance-create-reqv1"]
+        self.assertEqual(self.c.features, ["instance-create-reqv1"])
@@ -0,0 +1,66 @@
+from unittest import TestCase
+
+from gentleman.codec import BACKENDS, Codec, available, default_codec
+from gentleman.stream import JsonStreamDecoder
+
+class TestCodec(TestCase):
+
+    def test_available(self):
+        names = available()
+        self.assertTrue("json" in names)
+        self.assertEqual(names, [name for name in BACKENDS if name in names])
+
+    def test_default(self):
+        self.assertEqual(default_codec().backend, available()[0])
+        self.assertTrue(default_codec() is default_codec())
+
+    def test_round_trip(self):
+        obj = {"name": "web01", "disk.sizes": [1024, 2048], "mtime": 1.5,
+               "oper_ram": None, "tags": [u"caf\xe9"]}
+        for backend in available():
+            codec = Codec(backend)
+            self.assertEqual(codec.loads(codec.dumps(obj)), obj, backend)
+
+    def test_sort_keys(self):
+        for backend in available():
+            body = Codec(backend).dumps({"b": 1, "a": 2})
+            if not isinstance(body, bytes):
+                body = body.encode("ascii")
+            self.assertTrue(body.index(b'"a"') < body.index(b'"b"'), backend)
+
+    def test_bytes(self):
+        for backend in available():
+            self.assertEqual(Codec(backend).loads(b'{"a": [1, 2]}'),
+                             {"a": [1, 2]}, backend)
+
+    def test_missing(self):
+        self.assertRaises(KeyError, Codec, "yaml")
+
+class TestStreamLoads(TestCase):
+
+    def test_object(self):
+        calls = []
+
+        def loads(data):
+            calls.append(data)
+            return {}
+
+        decoder = JsonStreamDecoder(loads=loads)
+        decoder.feed('{"a": ')
+        decoder.feed('1}')
+        self.assertEqual(decoder.close(), {})
+        self.assertEqual(calls, ['{"a": 1}'])
+
+    def test_array_elements(self):
+        calls = []
+
+        def loads(data):
+            calls.append(data)
+            return len(calls)
+
+        decoder = JsonStreamDecoder(loads=loads)
+        decoder.feed('[{"a": [1, "]"]}, "b')
+        decoder.feed('c", 12')
+        decoder.feed('3, []]')
+        self.assertEqual(decoder.close(), [1, 2, 3, 4])
+        self.assertEqual(calls, ['{"a": [1, "]"]}', '"bc"', '123', '[]'])
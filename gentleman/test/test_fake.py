@@ -0,0 +1,166 @@
+import time
+from unittest import TestCase
+
+from gentleman import base
+from gentleman.errors import GanetiApiError
+from gentleman.fake import FakeCluster
+from gentleman.sync import RequestsRapiClient
+from gentleman.test.common import FakeServerMixin
+
+class TestFakeCluster(TestCase):
+
+    def setUp(self):
+        self.cluster = FakeCluster(instances=5, nodes=3, run_delay=0.0)
+        self.name = "inst00000.example.com"
+
+    def test_listing(self):
+        code, result = self.cluster.handle("GET", "/2/instances")
+        self.assertEqual(code, 200)
+        self.assertEqual(len(result), 5)
+        self.assertEqual(result[0], {"id": self.name,
+                                     "uri": "/2/instances/" + self.name})
+
+    def test_listing_bulk_fields(self):
+        code, result = self.cluster.handle("GET", "/2/instances",
+                                           {"bulk": ["1"],
+                                            "fields": ["name,pnode"]})
+        self.assertEqual(sorted(result[0]), ["name", "pnode"])
+
+    def test_not_found(self):
+        code, result = self.cluster.handle("GET", "/2/instances/missing")
+        self.assertEqual(code, 404)
+        code, result = self.cluster.handle("GET", "/2/nowhere")
+        self.assertEqual(code, 404)
+
+    def test_unsupported_method(self):
+        code, result = self.cluster.handle("POST", "/2/info")
+        self.assertEqual(code, 501)
+
+    def test_job_applies_effect(self):
+        code, job_id = self.cluster.handle("PUT", "/2/instances/%s/rename" %
+                                           self.name,
+                                           body={"new_name": "renamed"})
+        self.assertEqual(code, 200)
+
+        code, job = self.cluster.handle("GET", "/2/jobs/%d" % job_id)
+        self.assertEqual(job["status"], "success")
+        self.assertTrue("renamed" in self.cluster.instances)
+        self.assertFalse(self.name in self.cluster.instances)
+
+    def test_job_fails_effect(self):
+        code, job_id = self.cluster.handle("DELETE", "/2/instances/missing")
+        code, job = self.cluster.handle("GET", "/2/jobs/%d" % job_id)
+        self.assertEqual(job["status"], "error")
+
+    def test_dry_run(self):
+        code, job_id = self.cluster.handle("DELETE",
+                                           "/2/instances/%s" % self.name,
+                                           {"dry-run": ["1"]})
+        code, job = self.cluster.handle("GET", "/2/jobs/%d" % job_id)
+        self.assertEqual(job["status"], "success")
+        self.assertTrue(self.name in self.cluster.instances)
+
+    def test_injected_failure(self):
+        self.cluster.fail_next_jobs()
+        code, job_id = self.cluster.handle("PUT", "/2/instances/%s/startup" %
+                                           self.name)
+        code, job = self.cluster.handle("GET", "/2/jobs/%d" % job_id)
+        self.assertEqual(job["status"], "error")
+
+    def test_job_lifecycle(self):
+        self.cluster.queue_delay = 0.05
+        self.cluster.run_delay = 0.05
+        code, job_id = self.cluster.handle("PUT", "/2/tags",
+                                           {"tag": ["a", "b"]})
+
+        code, job = self.cluster.handle("GET", "/2/jobs/%d" % job_id)
+        self.assertEqual(job["status"], "queued")
+        self.assertEqual(self.cluster.tags, [])
+
+        time.sleep(0.06)
+        code, job = self.cluster.handle("GET", "/2/jobs/%d" % job_id)
+        self.assertEqual(job["status"], "running")
+
+        time.sleep(0.06)
+        code, job = self.cluster.handle("GET", "/2/jobs/%d" % job_id)
+        self.assertEqual(job["status"], "success")
+        self.assertEqual(self.cluster.tags, ["a", "b"])
+
+    def test_cancel(self):
+        self.cluster.queue_delay = 10
+        code, job_id = self.cluster.handle("PUT", "/2/tags", {"tag": ["a"]})
+        code, result = self.cluster.handle("DELETE", "/2/jobs/%d" % job_id)
+        self.assertEqual(result[0], True)
+
+        code, job = self.cluster.handle("GET", "/2/jobs/%d" % job_id)
+        self.assertEqual(job["status"], "canceled")
+        self.assertEqual(self.cluster.tags, [])
+
+    def test_wait_changed(self):
+        self.cluster.run_delay = 0.05
+        code, job_id = self.cluster.handle("PUT", "/2/tags", {"tag": ["a"]})
+        path = "/2/jobs/%d/wait" % job_id
+
+        code, result = self.cluster.handle("GET", path, body={
+            "fields": ["status"], "previous_job_info": None})
+        self.assertEqual(result["job_info"], ["running"])
+
+        started = time.time()
+        code, result = self.cluster.handle("GET", path, body={
+            "fields": ["status"], "previous_job_info": ["running"]})
+        self.assertEqual(result["job_info"], ["success"])
+        self.assertTrue(time.time() - started < 1)
+
+    def test_wait_timeout(self):
+        self.cluster.queue_delay = 10
+        self.cluster.wait_timeout = 0.05
+        code, job_id = self.cluster.handle("PUT", "/2/tags", {"tag": ["a"]})
+
+        code, result = self.cluster.handle(
+            "GET", "/2/jobs/%d/wait" % job_id,
+            body={"fields": ["status"], "previous_job_info": ["queued"]})
+        self.assertEqual(result, None)
+
+    def test_query_filter(self):
+        code, result = self.cluster.handle("PUT", "/2/query/instance", body={
+            "fields": ["name", "missing"],
+            "qfilter": ["|", ["=", "name", self.name],
+                        ["=~", "name", "^inst00001"]]})
+        self.assertEqual(len(result["data"]), 2)
+        self.assertEqual(result["data"][0], [[0, self.name], [1, None]])
+        self.assertEqual(result["fields"][0]["kind"], "text")
+
+    def test_query_fields(self):
+        code, result = self.cluster.handle("GET", "/2/query/node/fields",
+                                           {"fields": ["name,offline"]})
+        self.assertEqual([f["kind"] for f in result], ["text", "bool"])
+
+class TestFakeRapiServer(FakeServerMixin, TestCase):
+
+    cluster_options = {"instances": 3, "run_delay": 0.0}
+    client_class = RequestsRapiClient
+
+    def setUp(self):
+        super(TestFakeRapiServer, self).setUp()
+        self.r = self.client()
+        self.r.start()
+
+    def test_round_trip(self):
+        self.assertEqual(len(base.GetInstances(self.r)), 3)
+
+        job_id = base.AddClusterTags(self.r, ["tagged"])
+        self.assertEqual(base.GetJobStatus(self.r, job_id)["status"],
+                         "success")
+        self.assertEqual(base.GetClusterTags(self.r), ["tagged"])
+
+    def test_cached_after_job(self):
+        name = base.GetInstances(self.r)[0]
+        tags = base.GetInstanceTags(self.r, name)
+        base.AddInstanceTags(self.r, name, ["x"])
+        # The job finished at once; nothing else was asked in between.
+        self.assertEqual(base.GetInstanceTags(self.r, name), tags + ["x"])
+
+    def test_inject_error(self):
+        self.server.inject("/2/info", code=503, count=1)
+        self.assertRaises(GanetiApiError, base.GetInfo, self.r)
+        self.assertEqual(base.GetInfo(self.r)["name"], "cluster.example.com")
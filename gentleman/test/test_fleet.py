@@ -0,0 +1,80 @@
+from threading import Event
+from unittest import TestCase
+
+from gentleman import base
+from gentleman.errors import GanetiApiError, NotOkayError
+from gentleman.fleet import Fleet
+
+class FakeClient(object):
+
+    features = []
+
+    def __init__(self, name, event=None):
+        self.name = name
+        self.event = event
+
+    def _record(self, method, path):
+        return None
+
+    def _request(self, method, path, query, content, record):
+        return self.request(method, path, query, content)
+
+    def request(self, method, path, query=None, content=None):
+        if self.event is not None:
+            self.event.wait()
+        if path.endswith("/missing"):
+            raise NotOkayError(code=404)
+        return [{"id": "%s-web01" % self.name}]
+
+    def close(self):
+        pass
+
+class TestFleet(TestCase):
+
+    def setUp(self):
+        self.event = Event()
+        self.fleet = Fleet(max_workers=4, timeout=0.5)
+        for name in "one", "two", "slow":
+            event = self.event if name == "slow" else None
+            self.fleet.add(name, "%s.example.com" % name,
+                           client=FakeClient(name, event))
+
+    def tearDown(self):
+        self.event.set()
+        self.fleet.close()
+
+    def test_run(self):
+        results, errors = self.fleet.run(base.GetInstances)
+        self.assertEqual(results, {"one": ["one-web01"],
+                                   "two": ["two-web01"]})
+        self.assertEqual(list(errors), ["slow"])
+        self.assertTrue(isinstance(errors["slow"], GanetiApiError))
+
+    def test_run_on(self):
+        results, errors = self.fleet.run_on(["one"], base.GetInstances)
+        self.assertEqual(results, {"one": ["one-web01"]})
+        self.assertEqual(errors, {})
+
+    def test_run_on_error(self):
+        results, errors = self.fleet.run_on(["one", "two"], base.GetInstance,
+                                            "missing")
+        self.assertEqual(results, {})
+        self.assertEqual(errors["one"].code, 404)
+        self.assertEqual(errors["two"].code, 404)
+
+    def test_run_on_unknown(self):
+        results, errors = self.fleet.run_on(["three"], base.GetInstances)
+        self.assertTrue(isinstance(errors["three"], KeyError))
+
+    def test_slow_cluster_isolated(self):
+        # Each call to the slow cluster times out, but its thread keeps
+        # waiting; the others must still get threads of their own.
+        for i in range(self.fleet.max_workers + 1):
+            results, errors = self.fleet.run(base.GetInstances)
+            self.assertEqual(sorted(results), ["one", "two"])
+            self.assertEqual(list(errors), ["slow"])
+
+    def test_remove(self):
+        self.fleet.remove("one")
+        results, errors = self.fleet.run_on(["two"], base.GetInstances)
+        self.assertEqual(results, {"two": ["two-web01"]})
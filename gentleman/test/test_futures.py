@@ -0,0 +1,88 @@
+from unittest import TestCase
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from gentleman import base
+from gentleman.errors import NotOkayError
+from gentleman.futures import FuturesRapiClient, chain
+
+class FakeClient(object):
+
+    features = []
+
+    def _record(self, method, path):
+        return None
+
+    def _request(self, method, path, query, content, record):
+        return self.request(method, path, query, content)
+
+    def request(self, method, path, query=None, content=None):
+        if path.endswith("/missing"):
+            raise NotOkayError(code=404)
+        if path == "/2/instances":
+            return [{"id": "web01"}, {"id": "web02"}]
+        return {"path": path}
+
+    def close(self):
+        pass
+
+class TestChain(TestCase):
+
+    def test_value(self):
+        f = Future()
+        d = chain(f, lambda x: x + 1)
+        f.set_result(1)
+        self.assertEqual(d.result(), 2)
+
+    def test_nested_future(self):
+        f = Future()
+        inner = Future()
+        d = chain(f, lambda x: inner)
+        f.set_result(1)
+        self.assertFalse(d.done())
+        inner.set_result(3)
+        self.assertEqual(d.result(), 3)
+
+    def test_exception(self):
+        f = Future()
+        d = chain(f, lambda x: x + 1)
+        f.set_exception(ValueError())
+        self.assertTrue(isinstance(d.exception(), ValueError))
+
+class TestFuturesRapiClient(TestCase):
+
+    def setUp(self):
+        self.c = FuturesRapiClient("localhost", max_workers=2,
+                                   client=FakeClient())
+
+    def tearDown(self):
+        self.c.close()
+
+    def test_applier(self):
+        self.assertEqual(base.GetInstances(self.c).result(),
+                         ["web01", "web02"])
+
+    def test_fan_out(self):
+        results = self.c.fan_out(base.GetInstance, ["a", "b", "c"],
+                                 max_workers=1)
+        self.assertEqual([r["path"] for r in results],
+                         ["/2/instances/a", "/2/instances/b",
+                          "/2/instances/c"])
+
+    def test_fan_out_errors(self):
+        self.assertRaises(NotOkayError, self.c.fan_out, base.GetInstance,
+                          ["a", "missing"])
+
+    def test_fan_out_return_exceptions(self):
+        results = self.c.fan_out(base.GetInstance, ["a", "missing"],
+                                 return_exceptions=True)
+        self.assertEqual(results[0]["path"], "/2/instances/a")
+        self.assertTrue(isinstance(results[1], NotOkayError))
+
+    def test_shared_executor(self):
+        executor = ThreadPoolExecutor(1)
+        self.addCleanup(executor.shutdown)
+        c = FuturesRapiClient("localhost", executor=executor,
+                              client=FakeClient())
+        c.close()
+        self.assertEqual(executor.submit(lambda: 1).result(), 1)
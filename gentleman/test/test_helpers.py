@@ -1,6 +1,7 @@
 from unittest import TestCase
 
-from gentleman.helpers import itemgetters, prepare_query
+from gentleman.helpers import (itemgetters, path_resource, path_template,
+                               prepare_query)
 
 class TestItemGetters(TestCase):
 
@@ -19,3 +20,33 @@ class TestPrepareQuery(TestCase):
         prepare_query(d)
         self.assertEqual(d["test"], 1)
         self.assertEqual(type(d["test"]), int)
+
+class TestPathTemplate(TestCase):
+
+    def test_instance(self):
+        self.assertEqual(path_template("/2/instances/web01/tags"),
+                         "/2/instances/*/tags")
+
+    def test_disk(self):
+        self.assertEqual(path_template("/2/instances/web01/disk/0/grow"),
+                         "/2/instances/*/disk/*/grow")
+
+    def test_collection(self):
+        self.assertEqual(path_template("/2/nodes"), "/2/nodes")
+
+    def test_query(self):
+        self.assertEqual(path_template("/2/query/instance"),
+                         "/2/query/instance")
+
+class TestPathResource(TestCase):
+
+    def test_resource(self):
+        self.assertEqual(path_resource("/2/groups/default/modify"),
+                         ("/2/groups", "/2/groups/default"))
+
+    def test_collection(self):
+        self.assertEqual(path_resource("/2/instances"),
+                         ("/2/instances", None))
+
+    def test_cluster(self):
+        self.assertEqual(path_resource("/2/tags"), ("/2", None))
@@ -0,0 +1,33 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+# Modules which should only be imported once a client needs them.
+HEAVY = ["requests", "simplejson", "ujson", "orjson", "twisted",
+         "zope.interface"]
+
+# How long imports take is measured by bench/imports.py; timings are too
+# noisy to test here.
+_script = """
+import sys
+%s
+print(",".join(name for name in %r if name in sys.modules))
+"""
+
+def run(statements):
+    output = subprocess.check_output([sys.executable, "-c",
+                                      _script % (statements, HEAVY)])
+    return [name for name in output.decode("ascii").strip().split(",")
+            if name]
+
+class TestImports(TestCase):
+
+    statements = ("import gentleman.base\n"
+                  "from gentleman.sync import RequestsRapiClient")
+
+    def test_lazy(self):
+        self.assertEqual(run(self.statements), [])
+
+    def test_client_imports(self):
+        loaded = run(self.statements + "\nRequestsRapiClient('localhost')")
+        self.assertTrue("requests" in loaded)
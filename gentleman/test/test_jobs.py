@@ -0,0 +1,92 @@
+from unittest import TestCase
+
+from gentleman.errors import NotOkayError
+from gentleman.jobs import JobTracker, JobWaiter
+
+class FakeJobsClient(object):
+    """
+    Pretend that each job takes a few checks to finish.
+    """
+
+    def __init__(self, steps, can_wait=True, wait_code=404, wait_errors=()):
+        self.steps = steps
+        self.can_wait = can_wait
+        self.wait_code = wait_code
+        self.wait_errors = list(wait_errors)
+        self.paths = []
+
+    def request(self, method, path, query=None, content=None):
+        self.paths.append(path)
+        job_id = int(path.split("/")[3])
+
+        if job_id not in self.steps:
+            raise NotOkayError(code=404)
+
+        if path.endswith("/wait"):
+            if not self.can_wait:
+                raise NotOkayError(code=self.wait_code)
+            if self.wait_errors:
+                raise NotOkayError(code=self.wait_errors.pop(0))
+            self.steps[job_id] -= 1
+            if self.steps[job_id] > 0:
+                return {"job_info": ["running"], "log_entries": [[1]]}
+            return {"job_info": ["success"], "log_entries": [[2]]}
+
+        self.steps[job_id] -= 1
+        status = "success" if self.steps[job_id] <= 0 else "running"
+        return {"id": job_id, "status": status}
+
+class TestJobTracker(TestCase):
+
+    def test_changed(self):
+        tracker = JobTracker(1)
+        self.assertFalse(tracker.changed(None))
+        self.assertFalse(tracker.changed({"job_info": ["running"],
+                                          "log_entries": [[3], [5]]}))
+        self.assertEqual(tracker.log_serial, 5)
+        self.assertTrue(tracker.changed({"job_info": ["error"],
+                                         "log_entries": []}))
+        self.assertEqual(tracker.log_serial, 5)
+
+class TestJobWaiter(TestCase):
+
+    def test_wait(self):
+        r = FakeJobsClient({1: 1, 2: 3, 3: 2})
+        finished = []
+        waiter = JobWaiter(r, max_connections=2,
+                           callback=lambda *args: finished.append(args[0]))
+        results, errors = waiter.wait([1, 2, 3])
+        self.assertEqual(sorted(results), [1, 2, 3])
+        self.assertEqual(errors, {})
+        self.assertEqual(sorted(finished), [1, 2, 3])
+        self.assertTrue(waiter.use_wait)
+
+    def test_missing_job(self):
+        r = FakeJobsClient({1: 1})
+        results, errors = JobWaiter(r).wait([1, 4])
+        self.assertEqual(list(results), [1])
+        self.assertEqual(list(errors), [4])
+        self.assertEqual(errors[4].code, 404)
+
+    def test_poll_fallback(self):
+        r = FakeJobsClient({1: 2, 2: 3}, can_wait=False)
+        waiter = JobWaiter(r, max_connections=1, poll_interval=0)
+        results, errors = waiter.wait([1, 2])
+        self.assertEqual(results[2]["status"], "success")
+        self.assertFalse(waiter.use_wait)
+
+    def test_poll_fallback_codes(self):
+        for code in 405, 501:
+            r = FakeJobsClient({1: 2}, can_wait=False, wait_code=code)
+            waiter = JobWaiter(r, poll_interval=0)
+            results, errors = waiter.wait([1])
+            self.assertEqual(results[1]["status"], "success")
+            self.assertFalse(waiter.use_wait)
+
+    def test_wait_unavailable(self):
+        r = FakeJobsClient({1: 2, 2: 2}, wait_errors=[503])
+        waiter = JobWaiter(r, max_connections=1)
+        results, errors = waiter.wait([1, 2])
+        self.assertEqual(list(results), [2])
+        self.assertEqual(errors[1].code, 503)
+        self.assertTrue(waiter.use_wait)
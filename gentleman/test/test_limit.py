@@ -0,0 +1,119 @@
+from unittest import TestCase
+
+from gentleman.errors import GanetiApiError, NotOkayError
+from gentleman.limit import (JOB, READ, AdaptiveConcurrency, Limiter,
+                             TokenBucket, endpoint_class)
+
+class TestEndpointClass(TestCase):
+
+    def test_get(self):
+        self.assertEqual(endpoint_class("GET", "/2/instances"), READ)
+
+    def test_query(self):
+        self.assertEqual(endpoint_class("put", "/2/query/instances"), READ)
+
+    def test_job(self):
+        self.assertEqual(endpoint_class("post", "/2/instances"), JOB)
+        self.assertEqual(endpoint_class("put",
+                                        "https://h:5080/2/instances/a/reboot"),
+                         JOB)
+
+class TestTokenBucket(TestCase):
+
+    def test_burst(self):
+        bucket = TokenBucket(10, burst=3)
+        self.assertEqual([bucket.reserve() for i in range(3)], [0, 0, 0])
+        self.assertTrue(0.05 < bucket.reserve() <= 0.1)
+
+    def test_queue(self):
+        bucket = TokenBucket(10, burst=1)
+        bucket.reserve()
+        first = bucket.reserve()
+        second = bucket.reserve()
+        self.assertTrue(second > first)
+
+class TestAdaptiveConcurrency(TestCase):
+
+    def fill(self, c):
+        for i in range(int(c.limit)):
+            c.acquire()
+
+    def test_waiters(self):
+        c = AdaptiveConcurrency(initial=1, maximum=1)
+        c.acquire()
+        called = []
+        c.acquire(lambda: called.append(True))
+        self.assertEqual(c.stats()["waiting"], 1)
+        c.release(0.1)
+        self.assertEqual(called, [True])
+        self.assertEqual(c.inflight, 1)
+
+    def test_withdraw(self):
+        c = AdaptiveConcurrency(initial=1, maximum=1)
+        c.acquire()
+        called = []
+        callback = lambda: called.append(True)
+        c.acquire(callback)
+        self.assertTrue(c.withdraw(callback))
+        self.assertFalse(c.withdraw(callback))
+        c.release(0.1)
+        self.assertEqual(called, [])
+        self.assertEqual(c.inflight, 0)
+
+    def test_grows(self):
+        c = AdaptiveConcurrency(initial=4)
+        for i in range(20):
+            self.fill(c)
+            for j in range(int(c.limit)):
+                c.release(0.1)
+        self.assertTrue(c.limit > 4)
+
+    def test_shrinks(self):
+        c = AdaptiveConcurrency(initial=16)
+        self.fill(c)
+        c.release(0.1)
+        for i in range(15):
+            c.release(1.0)
+        self.assertTrue(c.limit < 16)
+        self.assertEqual(c.inflight, 0)
+
+    def test_unhealthy(self):
+        c = AdaptiveConcurrency(initial=8)
+        c.acquire()
+        c.release(0.1, GanetiApiError("Connection refused!"))
+        self.assertEqual(c.limit, 4)
+
+    def test_client_error(self):
+        c = AdaptiveConcurrency(initial=8)
+        c.acquire()
+        c.release(0.1, NotOkayError(code=404))
+        self.assertEqual(c.limit, 8)
+
+    def test_cancelled(self):
+        c = AdaptiveConcurrency(initial=8)
+        c.acquire()
+        c.release(None, GanetiApiError())
+        self.assertEqual(c.limit, 8)
+        self.assertEqual(c.latency, None)
+        self.assertEqual(c.inflight, 0)
+
+    def test_bounds(self):
+        c = AdaptiveConcurrency(initial=2, minimum=2)
+        c.acquire()
+        c.release(0.1, GanetiApiError())
+        self.assertEqual(c.limit, 2)
+
+class TestLimiter(TestCase):
+
+    def test_classes(self):
+        limiter = Limiter(jobs=TokenBucket(1, burst=1))
+        self.assertEqual(limiter.reserve("get", "/2/instances"), 0)
+        self.assertEqual(limiter.reserve("post", "/2/instances"), 0)
+        self.assertTrue(limiter.reserve("post", "/2/instances") > 0)
+        self.assertEqual(limiter.reserve("get", "/2/instances"), 0)
+
+    def test_admit(self):
+        limiter = Limiter()
+        called = []
+        limiter.admit(lambda: called.append(True))
+        self.assertEqual(called, [True])
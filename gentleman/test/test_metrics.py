@@ -0,0 +1,117 @@
+from unittest import TestCase
+
+from gentleman import base
+from gentleman.errors import NotOkayError
+from gentleman.metrics import (LatencyHistogram, MetricsAggregator,
+                               RequestRecord, calling_function)
+
+class FakeClient(object):
+
+    def request(self, method, path, query=None, content=None):
+        return calling_function()
+
+    def applier(self, f, value):
+        return value
+
+class TestCallingFunction(TestCase):
+
+    def test_base(self):
+        self.assertEqual(base.GetInfo(FakeClient()), "GetInfo")
+
+    def test_nested(self):
+        self.assertEqual(base.GetInstance(FakeClient(), "web01",
+                                          fields=["name"]),
+                         "GetInstance")
+
+    def test_outside_base(self):
+        self.assertEqual(FakeClient().request("get", "/2/info"), None)
+
+class TestRequestRecord(TestCase):
+
+    def test_template(self):
+        record = RequestRecord("get", "/2/instances/web01/tags")
+        self.assertEqual(record.method, "GET")
+        self.assertEqual(record.path, "/2/instances/*/tags")
+
+    def test_finish(self):
+        records = []
+        record = RequestRecord("get", "/2/info")
+        record.finish([records.append])
+        self.assertEqual(records, [record])
+        self.assertTrue(record.total >= 0)
+
+    def test_finish_error(self):
+        record = RequestRecord("get", "/2/info")
+        record.finish([], NotOkayError(code=404))
+        self.assertEqual(record.status, 404)
+
+    def test_broken_hook(self):
+        records = []
+        record = RequestRecord("get", "/2/info")
+        record.finish([lambda r: 1 / 0, records.append])
+        self.assertEqual(records, [record])
+
+    def test_attempt(self):
+        record = RequestRecord("get", "/2/info")
+        record.attempt()
+        record.ttfb = 1.0
+        record.attempt()
+        self.assertEqual(record.attempts, 2)
+        self.assertEqual(record.ttfb, 0.0)
+
+class TestLatencyHistogram(TestCase):
+
+    def test_empty(self):
+        h = LatencyHistogram()
+        self.assertEqual(h.mean(), None)
+        self.assertEqual(h.percentile(50), None)
+
+    def test_percentile(self):
+        h = LatencyHistogram()
+        for i in range(99):
+            h.add(0.003)
+        h.add(2.5)
+        self.assertEqual(h.percentile(50), 0.004)
+        self.assertEqual(h.percentile(100), 2.5)
+        self.assertEqual(h.count, 100)
+
+    def test_overflow(self):
+        h = LatencyHistogram()
+        h.add(1000)
+        self.assertEqual(h.buckets()[-1], (None, 1))
+        self.assertEqual(h.percentile(99), 1000)
+
+class TestMetricsAggregator(TestCase):
+
+    def record(self, path, total, function=None, error=None):
+        record = RequestRecord("get", path, function)
+        record.attempt()
+        record.status = 200 if error is None else error.code
+        record.ttfb = total
+        record.finish([], error)
+        record.total = total
+        return record
+
+    def test_report(self):
+        m = MetricsAggregator()
+        m(self.record("/2/instances/a", 0.5, "GetInstance"))
+        m(self.record("/2/instances/b", 0.3, "GetInstance"))
+        m(self.record("/2/info", 0.01, "GetInfo"))
+        m(self.record("/2/info", 0.01, error=NotOkayError(code=502)))
+
+        report = m.report()
+        self.assertEqual([row["path"] for row in report],
+                         ["/2/instances/*", "/2/info"])
+
+        row = report[0]
+        self.assertEqual(row["count"], 2)
+        self.assertEqual(row["functions"], {"GetInstance": 2})
+        self.assertAlmostEqual(row["ttfb"], 0.4)
+        self.assertEqual(report[1]["errors"], 1)
+        self.assertEqual(report[1]["statuses"], {200: 1, 502: 1})
+
+    def test_reset(self):
+        m = MetricsAggregator()
+        m(self.record("/2/info", 0.01))
+        m.reset()
+        self.assertEqual(m.report(), [])
@@ -0,0 +1,73 @@
+from unittest import TestCase
+
+from gentleman import base
+from gentleman.mirror import (ADDED, CHANGED, REMOVED, RUNTIME_FIELDS,
+                              InventoryMirror)
+from gentleman.stdlib import StdlibRapiClient
+from gentleman.test.common import FakeServerMixin
+
+class TestInventoryMirror(FakeServerMixin, TestCase):
+
+    cluster_options = {"instances": 10, "nodes": 3, "queue_delay": 0,
+                       "run_delay": 0}
+    client_class = StdlibRapiClient
+
+    def setUp(self):
+        super(TestInventoryMirror, self).setUp()
+        self.r = self.client()
+
+        self.events = []
+        self.mirror = InventoryMirror(self.r, callback=self.record)
+
+    def record(self, event, kind, name, record):
+        self.events.append((event, kind, name))
+
+    def test_initial(self):
+        events = self.mirror.refresh()
+        self.assertEqual(len(events), 14)
+        self.assertEqual(len(self.events), 14)
+        self.assertEqual(len(self.mirror["instance"]), 10)
+        self.assertEqual(len(self.mirror["node"]), 3)
+        self.assertEqual(len(self.mirror["group"]), 1)
+
+        bulk = base.GetInstances(self.r, bulk=True)
+        mirrored = self.mirror["instance"][bulk[0]["name"]]
+        self.assertEqual(mirrored["pnode"], bulk[0]["pnode"])
+        self.assertEqual(mirrored["serial_no"], bulk[0]["serial_no"])
+
+    def test_no_runtime_fields(self):
+        self.mirror.refresh()
+        for kind, fields in RUNTIME_FIELDS.iteritems():
+            for record in self.mirror[kind].itervalues():
+                for field in fields:
+                    self.assertFalse(field in record)
+
+    def test_unchanged(self):
+        self.mirror.refresh()
+        fetched = self.mirror.fetched
+        self.assertEqual(self.mirror.refresh(), [])
+        self.assertEqual(self.mirror.fetched, fetched)
+
+    def test_changed(self):
+        self.mirror.refresh()
+        base.AddInstanceTags(self.r, "inst00003.example.com", ["changed"])
+
+        fetched = self.mirror.fetched
+        events = self.mirror.refresh()
+        self.assertEqual([event[:3] for event in events],
+                         [(CHANGED, "instance", "inst00003.example.com")])
+        self.assertEqual(self.mirror.fetched, fetched + 1)
+        self.assertTrue("changed" in
+                        self.mirror["instance"]["inst00003.example.com"]
+                        ["tags"])
+
+    def test_added_removed(self):
+        self.mirror.refresh()
+        base.DeleteInstance(self.r, "inst00004.example.com")
+        base.CreateGroup(self.r, "extra")
+
+        events = sorted(event[:3] for event in self.mirror.refresh())
+        self.assertEqual(events,
+                         [(ADDED, "group", "extra"),
+                          (REMOVED, "instance", "inst00004.example.com")])
+        self.assertFalse("inst00004.example.com" in self.mirror["instance"])
@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from gentleman.query import RS_NORMAL, RS_OFFLINE, columnar
+
+result = {
+    "fields": [
+        {"name": "name", "kind": "text"},
+        {"name": "oper_ram", "kind": "unit"},
+        {"name": "admin_up", "kind": "bool"},
+    ],
+    "data": [
+        [[RS_NORMAL, "web01"], [RS_NORMAL, 512], [RS_NORMAL, True]],
+        [[RS_NORMAL, "web02"], [RS_OFFLINE, None], [RS_NORMAL, False]],
+    ],
+}
+
+class TestColumnar(TestCase):
+
+    def test_columns(self):
+        q = columnar(result)
+        self.assertEqual(len(q), 2)
+        self.assertEqual(q["name"], ["web01", "web02"])
+        self.assertEqual(list(q["oper_ram"]), [512, 0])
+        self.assertEqual(list(q.masks["oper_ram"]), [RS_NORMAL, RS_OFFLINE])
+        self.assertEqual(q["oper_ram"].typecode, "l")
+
+    def test_valid(self):
+        q = columnar(result)
+        self.assertEqual(q.valid("oper_ram"), [512])
+        self.assertEqual(q.valid("name"), ["web01", "web02"])
+
+    def test_rows(self):
+        rows = list(columnar(result).rows())
+        self.assertEqual(rows[1], {"name": "web02", "admin_up": False})
+
+    def test_empty(self):
+        q = columnar({"fields": result["fields"], "data": []})
+        self.assertEqual(len(q), 0)
+        self.assertEqual(list(q["oper_ram"]), [])
+
+    def test_mislabelled_kind(self):
+        q = columnar({"fields": [{"name": "mtime", "kind": "timestamp"}],
+                      "data": [[[RS_NORMAL, [1, 2]]]]})
+        self.assertEqual(q["mtime"], [[1, 2]])
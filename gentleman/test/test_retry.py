@@ -0,0 +1,83 @@
+from unittest import TestCase
+
+from gentleman.errors import GanetiApiError, NotOkayError
+from gentleman.retry import CircuitBreaker, RetryPolicy, parse_retry_after
+
+class TestRetryPolicy(TestCase):
+
+    def test_retryable(self):
+        policy = RetryPolicy(attempts=3)
+        self.assertTrue(policy.retryable("get", NotOkayError(code=503), 1))
+        self.assertTrue(policy.retryable("GET", GanetiApiError(), 2))
+        self.assertFalse(policy.retryable("get", NotOkayError(code=404), 1))
+        self.assertFalse(policy.retryable("put", NotOkayError(code=503), 1))
+        self.assertFalse(policy.retryable("get", NotOkayError(code=503), 3))
+
+    def test_backoff(self):
+        policy = RetryPolicy(backoff=1, max_backoff=5, jitter=0)
+        self.assertEqual([policy.delay(i) for i in range(1, 5)],
+                         [1, 2, 4, 5])
+
+    def test_jitter(self):
+        policy = RetryPolicy(backoff=1, jitter=0.5)
+        for i in range(20):
+            self.assertTrue(0.5 <= policy.delay(1) <= 1)
+
+    def test_retry_after(self):
+        policy = RetryPolicy(max_backoff=10)
+        self.assertEqual(policy.delay(1, NotOkayError(retry_after=7)), 7)
+        self.assertEqual(policy.delay(1, NotOkayError(retry_after=70)), 10)
+
+class TestParseRetryAfter(TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after("120"), 120)
+
+    def test_date(self):
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"),
+                         0)
+
+    def test_garbage(self):
+        self.assertEqual(parse_retry_after("soon"), None)
+        self.assertEqual(parse_retry_after(None), None)
+
+class TestCircuitBreaker(TestCase):
+
+    def test_opens(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        breaker.record(GanetiApiError())
+        self.assertTrue(breaker.allow())
+        breaker.record(NotOkayError(code=502))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_client_errors_are_healthy(self):
+        breaker = CircuitBreaker(threshold=1)
+        breaker.record(NotOkayError(code=404))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_probe(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        # Only one probe at a time.
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_abandoned_probe(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=0)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.abandon()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.allow())
+
+    def test_abandoned_closed(self):
+        breaker = CircuitBreaker(threshold=1)
+        breaker.abandon()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
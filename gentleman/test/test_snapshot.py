@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from gentleman import base
+from gentleman.mirror import CHANGED
+from gentleman.snapshot import InventorySnapshot
+from gentleman.stdlib import StdlibRapiClient
+from gentleman.test.common import FakeServerMixin
+
+class TestInventorySnapshot(FakeServerMixin, TestCase):
+
+    cluster_options = {"instances": 10, "nodes": 3, "queue_delay": 0,
+                       "run_delay": 0}
+    client_class = StdlibRapiClient
+
+    def setUp(self):
+        super(TestInventorySnapshot, self).setUp()
+
+        self.requests = []
+        self.r = self.client(hooks=[self.requests.append])
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "inventory.db")
+
+    def snapshot(self):
+        snapshot = InventorySnapshot(self.path)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_empty(self):
+        snapshot = self.snapshot()
+        self.assertEqual(snapshot.age(), None)
+        self.assertEqual(snapshot.get("instance", "inst00001.example.com"),
+                         None)
+
+    def test_update(self):
+        self.snapshot().update(self.r)
+
+        # Read back through a new connection, as another process would.
+        snapshot = self.snapshot()
+        self.assertTrue(snapshot.age() < 60)
+        self.assertEqual(len(snapshot.names("instance")), 10)
+        self.assertEqual(len(snapshot.names("node")), 3)
+
+        instance = base.GetInstance(self.r, "inst00001.example.com")
+        stored = snapshot.get("instance", "inst00001.example.com")
+        self.assertEqual(stored["pnode"], instance["pnode"])
+
+    def test_incremental(self):
+        snapshot = self.snapshot()
+        snapshot.update(self.r)
+        base.AddNodeTags(self.r, "node001.example.com", ["changed"])
+        base.GetInfo(self.r)
+
+        events = snapshot.update(self.r)
+        self.assertEqual([event[:3] for event in events],
+                         [(CHANGED, "node", "node001.example.com")])
+        self.assertTrue("changed" in
+                        snapshot.get("node", "node001.example.com")["tags"])
+
+    def test_fewer_kinds(self):
+        snapshot = self.snapshot()
+        snapshot.update(self.r)
+
+        snapshot.update(self.r, kinds=["instance"])
+        self.assertEqual(len(snapshot.names("instance")), 10)
+        self.assertEqual(snapshot.names("node"), [])
+        self.assertEqual(snapshot.names("group"), [])
+
+    def test_other_cluster(self):
+        snapshot = self.snapshot()
+        snapshot.update(self.r)
+        with snapshot._db:
+            snapshot._set_meta("cluster", ["other.example.com", None, None])
+            snapshot._store("instance", "other", {"name": "other"})
+
+        snapshot.update(self.r)
+        self.assertEqual(snapshot.get("instance", "other"), None)
+        self.assertEqual(len(snapshot.names("instance")), 10)
+
+    def test_revalidate_fresh(self):
+        snapshot = self.snapshot()
+        snapshot.update(self.r)
+        del self.requests[:]
+
+        self.assertEqual(snapshot.revalidate(self.r, max_age=60), None)
+        self.assertEqual(self.requests, [])
+
+    def test_revalidate_stale(self):
+        snapshot = self.snapshot()
+        snapshot.update(self.r)
+        base.DeleteInstance(self.r, "inst00002.example.com")
+        base.GetInfo(self.r)
+
+        thread = snapshot.revalidate(self.r, max_age=0)
+        self.assertNotEqual(thread, None)
+        # The process mustn't wait on the RAPI when it exits.
+        self.assertTrue(thread.daemon)
+        thread.join()
+        self.assertEqual(snapshot.get("instance", "inst00002.example.com"),
+                         None)
+
+    def test_revalidate_missing(self):
+        snapshot = self.snapshot()
+        self.assertEqual(snapshot.revalidate(self.r), None)
+        self.assertEqual(len(snapshot.names("instance")), 10)
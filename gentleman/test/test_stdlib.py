@@ -0,0 +1,76 @@
+import socket
+from unittest import TestCase
+
+from gentleman import base
+from gentleman.errors import GanetiApiError, NotOkayError
+from gentleman.stdlib import StdlibRapiClient
+from gentleman.test.common import FakeServerMixin
+
+class TestStdlibRapiClient(FakeServerMixin, TestCase):
+
+    cluster_options = {"instances": 3}
+    client_class = StdlibRapiClient
+
+    def setUp(self):
+        super(TestStdlibRapiClient, self).setUp()
+        self.r = self.client()
+        self.r.start()
+
+    def test_start(self):
+        self.assertEqual(self.r.version, 2)
+        self.assertTrue("instance-create-reqv1" in self.r.features)
+
+    def test_keep_alive(self):
+        base.GetInstances(self.r)
+        base.GetInfo(self.r)
+        stats = self.r.pool_stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["reused"], 3)
+
+    def test_not_okay(self):
+        self.assertRaises(NotOkayError, base.GetInstance, self.r, "missing")
+        base.GetInfo(self.r)
+        self.assertEqual(self.r.pool_stats()["created"], 1)
+
+    def test_content(self):
+        job_id = base.AddClusterTags(self.r, ["one", "two"])
+        self.assertTrue(isinstance(job_id, int))
+
+    def test_stale(self):
+        self.r._connection.sock.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(base.GetInfo(self.r)["name"], "cluster.example.com")
+
+        stats = self.r.pool_stats()
+        self.assertEqual(stats["created"], 2)
+        self.assertEqual(stats["reconnects"], 1)
+
+    def lose_response(self):
+        def getresponse():
+            raise socket.error("Connection reset by peer")
+        self.r._connection.getresponse = getresponse
+
+    def test_stale_response_get(self):
+        self.lose_response()
+        self.assertEqual(base.GetInfo(self.r)["name"], "cluster.example.com")
+        self.assertEqual(self.r.pool_stats()["reconnects"], 1)
+
+    def test_stale_response_not_resent(self):
+        # The master got the whole request, and may have made a job of it.
+        self.lose_response()
+        self.assertRaises(GanetiApiError, base.AddClusterTags, self.r,
+                          ["one"])
+        self.assertEqual(self.r.pool_stats()["reconnects"], 0)
+
+    def test_stream(self):
+        names = []
+        count = self.r.stream("get", "/2/instances", callback=names.append)
+        self.assertEqual(count, 3)
+        self.assertEqual(len(names), 3)
+
+    def test_stream_abandoned(self):
+        items = self.r.stream("get", "/2/instances")
+        del items
+
+        # The connection was given up, along with the rest of the response.
+        self.assertEqual(base.GetInfo(self.r)["name"], "cluster.example.com")
+        self.assertEqual(self.r.pool_stats()["created"], 2)
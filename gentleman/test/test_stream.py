@@ -0,0 +1,71 @@
+from unittest import TestCase
+
+import simplejson as json
+
+from gentleman.stream import JsonStreamDecoder
+
+class TestJsonStreamDecoder(TestCase):
+
+    def decode(self, data, size):
+        decoder = JsonStreamDecoder()
+        for i in range(0, len(data), size):
+            decoder.feed(data[i:i + size])
+        return decoder.close()
+
+    def test_array_every_split(self):
+        data = json.dumps([{"name": "web01", "tags": ["a", "]"]}, 12345,
+                           "esc\\\"aped", [], None, 1.5e3, True])
+        for size in range(1, len(data) + 1):
+            self.assertEqual(self.decode(data, size), json.loads(data))
+
+    def test_nested_every_split(self):
+        data = json.dumps([{"a": [{"b": "]}[{"}, "\\", ["\\\"]"]]},
+                           ["{", {"c": []}], "x\\\\", "\"[\""])
+        for size in range(1, len(data) + 1):
+            self.assertEqual(self.decode(data, size), json.loads(data))
+
+    def test_invalid_element(self):
+        decoder = JsonStreamDecoder()
+        decoder.feed('[{"a": [1, 2}')
+        self.assertRaises(ValueError, decoder.feed, '], 3]')
+
+    def test_number_at_chunk_boundary(self):
+        decoder = JsonStreamDecoder()
+        decoder.feed("[12")
+        decoder.feed("34]")
+        self.assertEqual(decoder.close(), [1234])
+
+    def test_empty_array(self):
+        self.assertEqual(self.decode(" [ ] ", 1), [])
+
+    def test_object(self):
+        data = json.dumps({"name": "web01", "disks": [1, 2]})
+        self.assertEqual(self.decode(data, 3), json.loads(data))
+
+    def test_scalar(self):
+        self.assertEqual(self.decode("2", 1), 2)
+
+    def test_callback(self):
+        items = []
+        decoder = JsonStreamDecoder(callback=items.append)
+        decoder.feed('[{"id": 1}, {"id"')
+        self.assertEqual(items, [{"id": 1}])
+        decoder.feed(': 2}]')
+        self.assertEqual(decoder.close(), 2)
+        self.assertEqual(items, [{"id": 1}, {"id": 2}])
+
+    def test_truncated(self):
+        decoder = JsonStreamDecoder()
+        decoder.feed('[{"id": 1}, {"id"')
+        self.assertRaises(ValueError, decoder.close)
+
+    def test_trailing_comma(self):
+        decoder = JsonStreamDecoder()
+        self.assertRaises(ValueError, decoder.feed, "[1,]")
+
+    def test_empty(self):
+        self.assertRaises(ValueError, JsonStreamDecoder().close)
+
+    def test_callback_requires_array(self):
+        decoder = JsonStreamDecoder(callback=lambda item: None)
+        self.assertRaises(ValueError, decoder.feed, '{"id": 1}')
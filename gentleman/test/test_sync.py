@@ -0,0 +1,76 @@
+import time
+from unittest import TestCase
+
+from gentleman import base
+from gentleman.sync import RequestsRapiClient
+from gentleman.test.common import CountingCodec, FakeServerMixin
+
+class TestRequestsRapiClient(FakeServerMixin, TestCase):
+
+    # Enough instances that listings take several chunks.
+    cluster_options = {"instances": 300}
+    client_class = RequestsRapiClient
+
+    def client(self, **kwargs):
+        r = FakeServerMixin.client(self, **kwargs)
+        r.start()
+        return r
+
+    def test_keep_alive(self):
+        r = self.client()
+        base.GetInstances(r)
+        base.GetInfo(r)
+        self.assertEqual(r.pool_stats(), {"requests": 4, "created": 1,
+                                          "reused": 3, "idle": 1,
+                                          "evictions": 0})
+
+    def test_no_keep_alive(self):
+        r = self.client(keep_alive=False)
+        base.GetInfo(r)
+        stats = r.pool_stats()
+        self.assertEqual(stats["created"], 3)
+        self.assertEqual(stats["reused"], 0)
+
+    def test_idle_eviction(self):
+        r = self.client(idle_timeout=0.05)
+        base.GetInfo(r)
+        time.sleep(0.1)
+        base.GetInfo(r)
+        base.GetInfo(r)
+
+        stats = r.pool_stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["created"], 2)
+        self.assertEqual(stats["reused"], 3)
+
+    def test_iter_instances(self):
+        r = self.client()
+        names = [instance["name"] for instance in base.IterInstances(r)]
+        self.assertEqual(names, base.GetInstances(r))
+
+    def test_iter_instances_callback(self):
+        r = self.client()
+        instances = []
+        count = base.IterInstances(r, callback=instances.append,
+                                   fields=["name"])
+        self.assertEqual(count, 300)
+        self.assertEqual(instances[0], {"name": "inst00000.example.com"})
+
+    def test_iter_instances_codec(self):
+        codec = CountingCodec()
+        r = self.client(codec=codec)
+        decoded = codec.decoded
+        self.assertEqual(len(list(base.IterInstances(r, fields=["name"]))),
+                         300)
+        self.assertEqual(codec.decoded, decoded + 300)
+
+    def test_iter_instances_abandoned(self):
+        r = self.client()
+        instances = base.IterInstances(r)
+        self.assertEqual(next(instances)["name"], "inst00000.example.com")
+        instances.close()
+
+        # The rest of the response was still on its way, so its connection
+        # was given up.
+        self.assertEqual(base.GetInfo(r)["name"], "cluster.example.com")
+        self.assertEqual(r.pool_stats()["created"], 2)
@@ -0,0 +1,133 @@
+import ssl
+from unittest import TestCase
+
+from twisted.internet.defer import inlineCallbacks
+from twisted.trial import unittest
+
+from gentleman import async, base
+from gentleman.async import TwistedRapiClient
+from gentleman.errors import CertificateError, GanetiApiError
+from gentleman.stdlib import StdlibRapiClient
+from gentleman.sync import RequestsRapiClient
+from gentleman.test.common import FakeServerMixin
+from gentleman.tls import TLSOptions, fingerprint, options_for
+
+class TestTLSOptions(TestCase):
+
+    def test_check(self):
+        options = TLSOptions("localhost", fingerprint=fingerprint("cert"))
+        options.check("cert")
+        self.assertRaises(CertificateError, options.check, "other")
+
+    def test_check_unpinned(self):
+        TLSOptions("localhost").check("cert")
+
+    def test_fingerprint_colons(self):
+        digest = fingerprint("cert")
+        colons = ":".join(digest[i:i + 2] for i in range(0, len(digest), 2))
+        TLSOptions("localhost", fingerprint=colons.upper()).check("cert")
+
+    def test_context_cached(self):
+        options = TLSOptions("localhost")
+        self.assertTrue(options.context() is options.context())
+
+    def test_options_for(self):
+        self.assertTrue(options_for("one") is options_for("one"))
+        self.assertFalse(options_for("one") is options_for("two"))
+        self.assertFalse(options_for("one") is
+                         options_for("one", fingerprint="00"))
+
+class TestClients(FakeServerMixin, TestCase):
+
+    cluster_options = {"instances": 1}
+
+    def setUp(self):
+        super(TestClients, self).setUp()
+        with open(self.server.cert) as f:
+            self.fingerprint = fingerprint(ssl.PEM_cert_to_DER_cert(f.read()))
+
+    def client(self, factory, tls):
+        r = factory("localhost", self.server.port, tls=tls)
+        self.addCleanup(r.close)
+        return r
+
+    def test_pinned(self):
+        for factory in StdlibRapiClient, RequestsRapiClient:
+            tls = TLSOptions("localhost", fingerprint=self.fingerprint)
+            r = self.client(factory, tls)
+            self.assertEqual(base.GetInfo(r)["name"], "cluster.example.com")
+
+    def test_pinned_mismatch(self):
+        for factory in StdlibRapiClient, RequestsRapiClient:
+            tls = TLSOptions("localhost", fingerprint="00" * 32)
+            r = self.client(factory, tls)
+            self.assertRaises(CertificateError, base.GetInfo, r)
+
+    def test_verified(self):
+        for factory in StdlibRapiClient, RequestsRapiClient:
+            tls = TLSOptions("localhost", ca_file=self.server.cert)
+            r = self.client(factory, tls)
+            self.assertEqual(base.GetInfo(r)["name"], "cluster.example.com")
+
+    def test_verified_wrong_host(self):
+        for factory in StdlibRapiClient, RequestsRapiClient:
+            tls = TLSOptions("example.com", ca_file=self.server.cert)
+            r = self.client(factory, tls)
+            self.assertRaises(CertificateError, base.GetInfo, r)
+
+class TestTwistedClient(FakeServerMixin, unittest.TestCase):
+
+    cluster_options = {"instances": 1}
+
+    def setUp(self):
+        super(TestTwistedClient, self).setUp()
+        with open(self.server.cert) as f:
+            self.fingerprint = fingerprint(ssl.PEM_cert_to_DER_cert(f.read()))
+
+    def client(self, tls=None):
+        r = TwistedRapiClient("localhost", self.server.port, tls=tls)
+        self.addCleanup(r.pool.closeCachedConnections)
+        return r
+
+    @inlineCallbacks
+    def test_pinned(self):
+        tls = TLSOptions("localhost", fingerprint=self.fingerprint)
+        r = self.client(tls=tls)
+        info = yield base.GetInfo(r)
+        self.assertEqual(info["name"], "cluster.example.com")
+
+    def test_pinned_mismatch(self):
+        r = self.client(tls=TLSOptions("localhost", fingerprint="00" * 32))
+        return self.assertFailure(base.GetInfo(r), CertificateError)
+
+    def test_default_verifies(self):
+        # The fake's certificate is self-signed.
+        r = self.client()
+        self.assertEqual(r.tls_stats(), None)
+        return self.assertFailure(base.GetInfo(r), GanetiApiError)
+
+    @inlineCallbacks
+    def test_resumed(self):
+        r = self.client(tls=TLSOptions("localhost", ca_file=self.server.cert))
+        for i in range(3):
+            yield base.GetInfo(r)
+            yield r.pool.closeCachedConnections()
+        self.assertEqual(r.tls_stats(), {"handshakes": 3, "resumed": 2})
+
+    @inlineCallbacks
+    def test_resumed_pinned(self):
+        r = self.client(tls=TLSOptions("localhost",
+                                       fingerprint=self.fingerprint))
+        for i in range(3):
+            yield base.GetInfo(r)
+            yield r.pool.closeCachedConnections()
+        self.assertEqual(r.tls_stats(), {"handshakes": 3, "resumed": 2})
+
+    @inlineCallbacks
+    def test_not_resumable(self):
+        self.patch(async, "_resumable", False)
+        r = self.client(tls=TLSOptions("localhost", ca_file=self.server.cert))
+        for i in range(3):
+            yield base.GetInfo(r)
+            yield r.pool.closeCachedConnections()
+        self.assertEqual(r.tls_stats(), {"handshakes": 3, "resumed": 0})
@@ -0,0 +1,157 @@
+"""
+TLS for connections to a cluster.
+
+Every connection to a cluster is secured the same way, so a L{TLSOptions}
+holds everything needed for one cluster: the certificates to trust, an
+optional pinned certificate fingerprint, and the TLS contexts built from
+them. Contexts are costly to build, and options are cached per cluster by
+L{options_for}, so that every client and every connection to a cluster
+shares them. The Twisted client also resumes earlier TLS sessions when it
+reconnects, skipping the full handshake.
+"""
+
+import hashlib
+import ssl
+from threading import Lock
+
+from gentleman.errors import CertificateError
+
+
+def fingerprint(der):
+    """
+    Compute the fingerprint of a certificate.
+
+    @type der: str
+    @param der: the certificate, DER-encoded
+    @rtype: str
+    @return: the SHA-256 digest of the certificate, in lowercase hex
+    """
+
+    return hashlib.sha256(der).hexdigest()
+
+
+class TLSOptions(object):
+    """
+    How to secure connections to one cluster.
+
+    Without a CA file, certificates are not verified, which is how clients
+    have always connected to Ganeti's self-signed RAPI certificates. A
+    pinned fingerprint is checked either way, once per connection.
+    """
+
+    def __init__(self, host, ca_file=None, fingerprint=None):
+        """
+        @type host: str
+        @param host: the cluster master, whose name certificates must carry
+                     when they are verified
+        @type ca_file: str or None
+        @param ca_file: path of the certificates to trust, in PEM
+        @type fingerprint: str or None
+        @param fingerprint: the SHA-256 fingerprint which the master's
+                            certificate must have, in hex, with or without
+                            colons
+        """
+
+        self.host = host
+        self.ca_file = ca_file
+        self.fingerprint = None
+        if fingerprint is not None:
+            self.fingerprint = fingerprint.replace(":", "").lower()
+
+        self._context = None
+        self._lock = Lock()
+
+    def __repr__(self):
+        return "<TLSOptions %s%s%s>" % (
+            self.host, " verified" if self.verify else "",
+            " pinned" if self.fingerprint else "")
+
+    @property
+    def verify(self):
+        return self.ca_file is not None
+
+    def check(self, der):
+        """
+        Check a certificate against the pinned fingerprint, if any.
+
+        @type der: str
+        @param der: the master's certificate, DER-encoded
+
+        @raises CertificateError: if the fingerprint doesn't match
+        """
+
+        if self.fingerprint is None:
+            return
+
+        actual = fingerprint(der)
+        if actual != self.fingerprint:
+            raise CertificateError("Certificate of %s has fingerprint %s, "
+                                   "not %s" % (self.host, actual,
+                                               self.fingerprint))
+
+    def context(self):
+        """
+        Get the context for securing sockets with the ssl module.
+
+        @rtype: C{ssl.SSLContext}
+        """
+
+        with self._lock:
+            if self._context is None:
+                if self.verify:
+                    self._context = ssl.create_default_context(
+                        cafile=self.ca_file)
+                else:
+                    self._context = ssl._create_unverified_context()
+            return self._context
+
+    def wrap(self, sock):
+        """
+        Secure a connected socket, checking the master's certificate.
+
+        @type sock: C{socket.socket}
+        @rtype: C{ssl.SSLSocket}
+
+        @raises CertificateError: if the certificate is pinned and doesn't
+                                  match, or can't be verified
+        """
+
+        try:
+            secured = self.context().wrap_socket(sock,
+                                                 server_hostname=self.host)
+        except ssl.CertificateError as e:
+            sock.close()
+            raise CertificateError(str(e))
+        except ssl.SSLError as e:
+            sock.close()
+            if "CERTIFICATE_VERIFY_FAILED" in str(e):
+                raise CertificateError(str(e))
+            raise
+
+        try:
+            self.check(secured.getpeercert(True))
+        except CertificateError:
+            secured.close()
+            raise
+
+        return secured
+
+
+_cache = {}
+_cache_lock = Lock()
+
+
+def options_for(host, port=5080, ca_file=None, fingerprint=None):
+    """
+    Get the shared options for a cluster.
+
+    @rtype: L{TLSOptions}
+    """
+
+    key = host, port, ca_file, fingerprint
+
+    with _cache_lock:
+        options = _cache.get(key)
+        if options is None:
+            options = _cache[key] = TLSOptions(host, ca_file, fingerprint)
+        return options